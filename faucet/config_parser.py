@@ -230,9 +230,14 @@ def _watcher_parser_v2(conf, logname):
                 logger.error('dp %s metered but not configured', dp_name)
                 continue
             dp = dps[dp_name]
-            watcher = WatcherConf(name, dictionary)
-            watcher.add_db(dbs[watcher.db])
-            watcher.add_dp(dp)
+            try:
+                watcher = WatcherConf(name, dictionary)
+                watcher.add_db(dbs[watcher.db])
+                watcher.add_dp(dp)
+                watcher.check_config()
+            except AssertionError as err:
+                logger.exception('Error in watcher %s config: %s', name, err)
+                continue
             result.append(watcher)
 
     return result
@@ -45,6 +45,7 @@ class DP(Conf):
     configured = False
     table_offset = None
     port_acl_table = None
+    port_acl_rules_table = None
     vlan_table = None
     vlan_acl_table = None
     eth_src_table = None
@@ -65,15 +66,27 @@ class DP(Conf):
     drop_lldp = None
     group_table = False
     group_table_routing = False
+    multi_out = None
     max_hosts_per_resolve_cycle = None
     max_host_fib_retry_count = None
     max_resolve_backoff_time = None
     packetin_pps = None
+    packetin_dp_rate = None
+    packetin_vlan_rate = None
+    packetin_port_rate = None
+    packetin_control_plane_pps = None
+    packetin_route_miss_pps = None
     learn_jitter = None
     learn_ban_timeout = None
+    learn_hold_down = None
+    mac_flap_threshold = None
+    mac_flap_window = None
     advertise_interval = None
     proactive_learn = None
     pipeline_config_dir = None
+    compress_acls = None
+    port_acl_metadata = None
+    reconnect_audit = None
 
     # Values that are set to None will be set using set_defaults
     # they are included here for testing and informational purposes
@@ -85,6 +98,8 @@ class DP(Conf):
         'table_offset': 0,
         'port_acl_table': None,
         # The table for internally associating vlans
+        'port_acl_rules_table': None,
+        # The table for port ACL rules shared between ports (only used with port_acl_metadata)
         'vlan_table': None,
         'vlan_acl_table': None,
         'eth_src_table': None,
@@ -130,6 +145,8 @@ class DP(Conf):
         # Use GROUP tables for VLAN flooding
         'group_table_routing': False,
         # Use GROUP tables for routing (nexthops)
+        'multi_out': True,
+        # Flood controller generated packets (eg. ARP/ND) with one packet out with multiple outputs, rather than one per port.
         'max_hosts_per_resolve_cycle': 5,
         # Max hosts to try to resolve per gateway resolution cycle.
         'max_host_fib_retry_count': 10,
@@ -138,16 +155,40 @@ class DP(Conf):
         # Max number of seconds to back off to when resolving nexthops.
         'packetin_pps': 0,
         # Ask switch to rate limit packet pps. TODO: Not supported by OVS in 2.7.0
+        'packetin_dp_rate': 0,
+        # Max packet ins per second handled for this DP (0 for no limit).
+        'packetin_vlan_rate': 0,
+        # Max packet ins per second handled for each VLAN (0 for no limit).
+        'packetin_port_rate': 0,
+        # Max packet ins per second handled for each port (0 for no limit). Ports over this rate have learning temporarily banned.
+        'packetin_control_plane_pps': 0,
+        # Ask switch to meter ARP/ND/ICMP packet ins for FAUCET VIPs to this pps (0 for no meter).
+        'packetin_route_miss_pps': 0,
+        # Ask switch to meter packet ins for unresolved routed hosts to this pps (0 for no meter).
         'learn_jitter': 10,
         # Jitter learn timeouts by up to this many seconds
         'learn_ban_timeout': 10,
         # When banning/limiting learning, wait this many seconds before learning can be retried
+        'learn_hold_down': 2,
+        # Do not relearn a host on the same port within this many seconds of learning it
+        'mac_flap_threshold': 0,
+        # If a host moves between ports this many times within mac_flap_window, assume a loop and temporarily ban learning on those ports (0 to disable).
+        'mac_flap_window': 10,
+        # Seconds over which host moves are counted for mac_flap_threshold.
         'advertise_interval': 30,
         # How often to advertise (eg. IPv6 RAs)
         'proactive_learn': True,
         # whether proactive learning is enabled for IP nexthops
         'pipeline_config_dir': '/etc/ryu/faucet',
         # where config files for pipeline are stored (if any).
+        'compress_acls': False,
+        # Remove shadowed ACL rules and merge adjacent rules with the same actions, to save flow table space.
+        'port_acl_metadata': False,
+        # Tag packets with their port's ACL in OpenFlow metadata, so each port ACL's rules are installed once rather than once per port.
+        'reconnect_audit': False,
+        # When a datapath reconnects, compare its flows and groups with the expected ones and send only corrections, rather than cold starting.
+        'reconnect_audit_timeout': 30,
+        # Cold start a reconnected datapath if its reconnect_audit replies have not all arrived after this many seconds.
         }
 
     defaults_types = {
@@ -156,6 +197,7 @@ class DP(Conf):
         'interfaces': dict,
         'table_offset': int,
         'port_acl_table': int,
+        'port_acl_rules_table': int,
         'vlan_table': int,
         'vlan_acl_table': int,
         'eth_src_table': int,
@@ -183,15 +225,28 @@ class DP(Conf):
         'drop_lldp': bool,
         'group_table': bool,
         'group_table_routing': bool,
+        'multi_out': bool,
         'max_hosts_per_resolve_cycle': int,
         'max_host_fib_retry_count': int,
         'max_resolve_backoff_time': int,
         'packetin_pps': int,
+        'packetin_dp_rate': int,
+        'packetin_vlan_rate': int,
+        'packetin_port_rate': int,
+        'packetin_control_plane_pps': int,
+        'packetin_route_miss_pps': int,
         'learn_jitter': int,
         'learn_ban_timeout': int,
+        'learn_hold_down': int,
+        'mac_flap_threshold': int,
+        'mac_flap_window': int,
         'advertise_interval': int,
         'proactive_learn': bool,
         'pipeline_config_dir': str,
+        'compress_acls': bool,
+        'port_acl_metadata': bool,
+        'reconnect_audit': bool,
+        'reconnect_audit_timeout': int,
     }
 
 
@@ -232,16 +287,19 @@ class DP(Conf):
         self._set_default('highest_priority', self.high_priority + 98)
         self._set_default('description', self.name)
         table_id = self.table_offset
-        for table_name in (
-                'port_acl_table',
-                'vlan_table',
-                'vlan_acl_table',
-                'eth_src_table',
-                'ipv4_fib_table',
-                'ipv6_fib_table',
-                'vip_table',
-                'eth_dst_table',
-                'flood_table'):
+        table_names = ['port_acl_table']
+        if self.port_acl_metadata:
+            table_names.append('port_acl_rules_table')
+        table_names.extend([
+            'vlan_table',
+            'vlan_acl_table',
+            'eth_src_table',
+            'ipv4_fib_table',
+            'ipv6_fib_table',
+            'vip_table',
+            'eth_dst_table',
+            'flood_table'])
+        for table_name in table_names:
             self._set_default(table_name, table_id)
             table_id += 1
 
@@ -262,6 +320,17 @@ class DP(Conf):
         if port.stack is not None:
             self.stack_ports.append(port)
 
+    def port_acl_metadata_ids(self):
+        """Return the OpenFlow metadata value for each ACL applied to a port.
+
+        Returns:
+            dict: metadata value (int) by ACL name.
+        """
+        port_acls = sorted(set(self.port_acl_in.values()), key=str)
+        return dict(
+            (acl_in, metadata)
+            for metadata, acl_in in enumerate(port_acls, start=1))
+
     def add_vlan(self, vlan):
         self.vlans[vlan.vid] = vlan
         if vlan.acl_in is not None:
@@ -347,6 +416,25 @@ class DP(Conf):
             return peer_dp_ports[0]
         return None
 
+    def shard(self, shards):
+        """Return the shard (worker process) that should control this DP.
+
+        DPs in the same stack are always in the same shard, as Valves look
+        up hosts learned by other DPs in the stack. DPs not connected to the
+        stack (which still have its root_dp) are sharded by their own DP ID.
+
+        Args:
+            shards (int): number of shards.
+        Returns:
+            int: shard number, from 0 to shards - 1.
+        """
+        dp_id = self.dp_id
+        if self.stack is not None and 'root_dp' in self.stack:
+            root_dp = self.stack['root_dp']
+            if networkx.has_path(self.stack['graph'], self.name, root_dp.name):
+                dp_id = root_dp.dp_id
+        return dp_id % shards
+
     def shortest_path_to_root(self):
         if self.stack is not None:
             root_dp = self.stack['root_dp']
@@ -18,10 +18,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import logging
 import os
 import random
 import signal
+import time
 
 from ryu.base import app_manager
 from ryu.controller.handler import CONFIG_DISPATCHER
@@ -42,6 +44,7 @@ try:
     import faucet_metrics
     import valve_packet
     import valve_of
+    import valve_state
 
     import my_lockfile as lockfile
 except ImportError:
@@ -54,6 +57,7 @@ except ImportError:
     from faucet import faucet_metrics
     from faucet import valve_packet
     from faucet import valve_of
+    from faucet import valve_state
 
     from faucet import my_lockfile as lockfile
 
@@ -62,26 +66,56 @@ class EventFaucetReconfigure(event.EventBase):
     pass
 
 
-class EventFaucetResolveGateways(event.EventBase):
+class EventFaucetPeriodic(event.EventBase):
+    """Base class for events used to trigger periodic work on each Valve.
+
+    Args:
+        dp_ids (list): DP IDs still to be processed, or None for all.
+    """
+
+    def __init__(self, dp_ids=None):
+        super(EventFaucetPeriodic, self).__init__()
+        self.dp_ids = dp_ids
+        self.queued_time = time.time()
+
+
+class EventFaucetResolveGateways(EventFaucetPeriodic):
     """Event used to trigger gateway re/resolution."""
     pass
 
 
-class EventFaucetHostExpire(event.EventBase):
+class EventFaucetHostExpire(EventFaucetPeriodic):
     """Event used to trigger expiration of host state in controller."""
     pass
 
 
-class EventFaucetMetricUpdate(event.EventBase):
+class EventFaucetMetricUpdate(EventFaucetPeriodic):
     """Event used to trigger update of metrics."""
     pass
 
 
-class EventFaucetAdvertise(event.EventBase):
+class EventFaucetAdvertise(EventFaucetPeriodic):
     """Event used to trigger periodic network advertisements (eg IPv6 RAs)."""
     pass
 
 
+class EventFaucetStateSave(EventFaucetPeriodic):
+    """Event used to trigger saving of learned state for a warm restart."""
+    pass
+
+
+class EventFaucetPacketInBatch(event.EventBase):
+    """Event used to trigger handling of queued packet ins from a DP.
+
+    Args:
+        dp_id (int): DP ID packet ins were received from.
+    """
+
+    def __init__(self, dp_id):
+        super(EventFaucetPacketInBatch, self).__init__()
+        self.dp_id = dp_id
+
+
 class EventFaucetAPIRegistered(event.EventBase):
     """Event used to notify that the API is registered with Faucet."""
     pass
@@ -116,6 +150,26 @@ class Faucet(app_manager.RyuApp):
         self.exc_logfile = os.getenv(
             'FAUCET_EXCEPTION_LOG',
             sysprefix + '/var/log/ryu/faucet/faucet_exception.log')
+        # Learned state is saved here periodically and restored on
+        # restart, if set. Each shard needs its own state file.
+        self.state_file = os.getenv('FAUCET_STATE_FILE', '')
+        # Periodic work on Valves is split into slices of at most this
+        # many seconds, so packet ins can be handled between slices.
+        self.event_slice_sec = float(os.getenv('FAUCET_EVENT_SLICE_SEC', '0.05'))
+        # DPs can be partitioned between FAUCET_SHARDS controller processes,
+        # each listening on its own OpenFlow and Prometheus port. This process
+        # controls only the DPs in shard FAUCET_SHARD.
+        self.shards = int(os.getenv('FAUCET_SHARDS', '1'))
+        self.shard = int(os.getenv('FAUCET_SHARD', '0'))
+        # If set, packet ins are queued per DP and handled in batches of up
+        # to this many, rather than one event each. Batches are still
+        # handled on this process's one event loop (learning needs the
+        # Valve's host state, and sending packet ins to worker processes
+        # costs more than parsing their headers), so this saves per event
+        # overhead but does not use more cores. Use FAUCET_SHARDS to
+        # spread packet in handling for many DPs across cores.
+        self.packet_in_batch = int(os.getenv('FAUCET_PACKET_IN_BATCH', '0'))
+        self._packet_in_queues = collections.defaultdict(collections.deque)
 
         # Create dpset object for querying Ryu's DPSet application
         self.dpset = kwargs['dpset']
@@ -127,6 +181,13 @@ class Faucet(app_manager.RyuApp):
         self.exc_logger = get_logger(
             self.exc_logname, self.exc_logfile, logging.DEBUG, 1)
 
+        if not 0 <= self.shard < self.shards:
+            shard_error = (
+                'FAUCET_SHARD (%d) must be at least 0 and less than FAUCET_SHARDS (%d)' % (
+                    self.shard, self.shards))
+            self.logger.error(shard_error)
+            raise ValueError(shard_error)
+
         self.valves = {}
 
         # Start Prometheus
@@ -141,11 +202,17 @@ class Faucet(app_manager.RyuApp):
         # Configure all Valves
         self._load_configs(self.config_file)
 
+        # Restore learned state from before a restart
+        if self.state_file:
+            self._restore_state()
+
         # Start all threads
         self._threads = [
             hub.spawn(thread) for thread in (
                 self._gateway_resolve_request, self._host_expire_request,
                 self._metric_update_request, self._advertise_request)]
+        if self.state_file:
+            self._threads.append(hub.spawn(self._state_save_request))
 
         # Register to API
         api = kwargs['faucet_api']
@@ -163,6 +230,10 @@ class Faucet(app_manager.RyuApp):
         if new_dps is None:
             self.logger.error('new config bad - rejecting')
             return
+        if self.shards > 1:
+            new_dps = [
+                new_dp for new_dp in new_dps
+                if new_dp.shard(self.shards) == self.shard]
         deleted_valve_dpids = (
             set(list(self.valves.keys())) -
             set([valve.dp_id for valve in new_dps]))
@@ -199,6 +270,16 @@ class Faucet(app_manager.RyuApp):
                 ryu_dp.close()
         self._bgp.reset(self.valves, self.metrics)
 
+    @kill_on_exception(exc_logname)
+    def _restore_state(self):
+        """Restore learned state saved by a previous instance."""
+        state_by_dp_id = valve_state.load_state(self.state_file, self.logger)
+        for dp_id, state in list(state_by_dp_id.items()):
+            if dp_id in self.valves:
+                self.valves[dp_id].set_warm_state(state)
+                self.logger.info(
+                    'Restoring saved state for %s', dpid_log(dp_id))
+
     @kill_on_exception(exc_logname)
     def _send_flow_msgs(self, dp_id, flow_msgs, ryu_dp=None):
         """Send OpenFlow messages to a connected datapath.
@@ -236,61 +317,111 @@ class Faucet(app_manager.RyuApp):
         if sigid == signal.SIGHUP:
             self.send_event('Faucet', EventFaucetReconfigure())
 
-    def _thread_reschedule(self, ryu_event, period, jitter=2):
+    def _thread_reschedule(self, ryu_event_class, period, jitter=2):
         """Trigger Ryu events periodically with a jitter.
 
         Args:
-            ryu_event (ryu.controller.event.EventReplyBase): event to trigger.
+            ryu_event_class (EventFaucetPeriodic): class of event to trigger.
             period (int): how often to trigger.
         """
         while True:
-            self.send_event('Faucet', ryu_event)
+            self.send_event('Faucet', ryu_event_class())
             hub.sleep(period + random.randint(0, jitter))
 
     def _gateway_resolve_request(self):
-        self._thread_reschedule(EventFaucetResolveGateways(), 2)
+        self._thread_reschedule(EventFaucetResolveGateways, 2)
 
     def _host_expire_request(self):
-        self._thread_reschedule(EventFaucetHostExpire(), 5)
+        self._thread_reschedule(EventFaucetHostExpire, 5)
 
     def _metric_update_request(self):
-        self._thread_reschedule(EventFaucetMetricUpdate(), 5)
+        self._thread_reschedule(EventFaucetMetricUpdate, 5)
 
     def _advertise_request(self):
-        self._thread_reschedule(EventFaucetAdvertise(), 5)
+        self._thread_reschedule(EventFaucetAdvertise, 5)
+
+    def _state_save_request(self):
+        self._thread_reschedule(EventFaucetStateSave, 30)
+
+    def _time_sliced_valves(self, ryu_event):
+        """Yield Valves for a periodic event, within a time budget.
+
+        Valves not reached within the budget are left to a new event of the
+        same type, queued behind any events (eg. packet ins) already waiting.
+        At least one Valve is processed per event.
+
+        Args:
+            ryu_event (EventFaucetPeriodic): periodic event being handled.
+        Yields:
+            tuple: DP ID and Valve.
+        """
+        event_name = type(ryu_event).__name__
+        start_time = time.time()
+        # pylint: disable=no-member
+        self.metrics.faucet_event_loop_lag.labels(
+            event=event_name).set(start_time - ryu_event.queued_time)
+        dp_ids = ryu_event.dp_ids
+        if dp_ids is None:
+            dp_ids = sorted(self.valves.keys())
+        for i, dp_id in enumerate(dp_ids):
+            if i and time.time() - start_time > self.event_slice_sec:
+                self.send_event('Faucet', type(ryu_event)(dp_ids[i:]))
+                return
+            if dp_id in self.valves:
+                yield dp_id, self.valves[dp_id]
 
     @set_ev_cls(EventFaucetResolveGateways, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
-    def resolve_gateways(self, _):
+    def resolve_gateways(self, ryu_event):
         """Handle a request to re/resolve gateways."""
-        for dp_id, valve in list(self.valves.items()):
+        for dp_id, valve in self._time_sliced_valves(ryu_event):
             flowmods = valve.resolve_gateways()
             if flowmods:
                 self._send_flow_msgs(dp_id, flowmods)
 
     @set_ev_cls(EventFaucetHostExpire, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
-    def host_expire(self, _):
+    def host_expire(self, ryu_event):
         """Handle a request expire host state in the controller."""
-        for valve in list(self.valves.values()):
+        for dp_id, valve in self._time_sliced_valves(ryu_event):
+            flowmods = valve.audit_expire()
+            if flowmods:
+                self._send_flow_msgs(dp_id, flowmods)
             valve.host_expire()
             valve.update_metrics(self.metrics)
+            meter_stats_requests = valve.meter_stats_request()
+            if meter_stats_requests:
+                self._send_flow_msgs(dp_id, meter_stats_requests)
 
     @set_ev_cls(EventFaucetMetricUpdate, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
-    def metric_update(self, _):
+    def metric_update(self, ryu_event):
         """Handle a request to update metrics in the controller."""
+        # pylint: disable=no-member
+        self.metrics.faucet_event_loop_lag.labels(
+            event=type(ryu_event).__name__).set(
+                time.time() - ryu_event.queued_time)
         self._bgp.update_metrics()
 
     @set_ev_cls(EventFaucetAdvertise, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
-    def advertise(self, _):
+    def advertise(self, ryu_event):
         """Handle a request to advertise services."""
-        for dp_id, valve in list(self.valves.items()):
+        for dp_id, valve in self._time_sliced_valves(ryu_event):
             flowmods = valve.advertise()
             if flowmods:
                 self._send_flow_msgs(dp_id, flowmods)
 
+    @set_ev_cls(EventFaucetStateSave, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    def state_save(self, _):
+        """Handle a request to save learned state for a warm restart."""
+        try:
+            valve_state.save_state(self.state_file, self.valves)
+        except (IOError, OSError) as err:
+            self.logger.error(
+                'could not save state to %s: %s', self.state_file, err)
+
     @set_ev_cls(EventFaucetReconfigure, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
     def reload_config(self, _):
@@ -334,11 +465,45 @@ class Faucet(app_manager.RyuApp):
         # pylint: disable=no-member
         self.metrics.of_packet_ins.labels(
             dpid=hex(dp_id)).inc()
+        if self.packet_in_batch:
+            packet_in_queue = self._packet_in_queues[dp_id]
+            if not packet_in_queue:
+                self.send_event('Faucet', EventFaucetPacketInBatch(dp_id))
+            packet_in_queue.append((in_port, vlan_vid, pkt))
+            return
         flowmods = valve.rcv_packet(
             dp_id, self.valves, in_port, vlan_vid, pkt)
         self._send_flow_msgs(dp_id, flowmods)
         valve.update_metrics(self.metrics)
 
+    @set_ev_cls(EventFaucetPacketInBatch, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    def _packet_in_batch_handler(self, ryu_event):
+        """Handle a batch of queued packet ins from a DP, in order received.
+
+        Flows for the whole batch are sent together, and metrics updated
+        once. If more packet ins remain, another batch is queued behind
+        any other waiting events.
+
+        Args:
+            ryu_event (EventFaucetPacketInBatch): trigger.
+        """
+        dp_id = ryu_event.dp_id
+        packet_in_queue = self._packet_in_queues[dp_id]
+        packet_ins = []
+        while packet_in_queue and len(packet_ins) < self.packet_in_batch:
+            packet_ins.append(packet_in_queue.popleft())
+        if packet_in_queue:
+            self.send_event('Faucet', EventFaucetPacketInBatch(dp_id))
+        if dp_id not in self.valves:
+            packet_in_queue.clear()
+            return
+        valve = self.valves[dp_id]
+        flowmods = valve.rcv_packets(dp_id, self.valves, packet_ins)
+        if flowmods:
+            self._send_flow_msgs(dp_id, flowmods)
+        valve.update_metrics(self.metrics)
+
     @set_ev_cls(ofp_event.EventOFPErrorMsg, MAIN_DISPATCHER) # pylint: disable=no-member
     @kill_on_exception(exc_logname)
     def _error_handler(self, ryu_event):
@@ -356,6 +521,68 @@ class Faucet(app_manager.RyuApp):
                 dpid=hex(dp_id)).inc()
             self.valves[dp_id].ofchannel_log([msg])
         self.logger.error('OFError %s from %s', msg, dpid_log(dp_id))
+        if dp_id in self.valves:
+            flowmods = self.valves[dp_id].ofp_error(dp_id, msg)
+            if flowmods:
+                self._send_flow_msgs(dp_id, flowmods)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER) # pylint: disable=no-member
+    @kill_on_exception(exc_logname)
+    def _barrier_reply_handler(self, ryu_event):
+        """Handle a barrier reply (confirming flows for learned hosts).
+
+        Args:
+            ryu_event (ryu.controller.ofp_event.EventOFPBarrierReply): trigger.
+        """
+        msg = ryu_event.msg
+        dp_id = msg.datapath.id
+        if dp_id in self.valves:
+            self.valves[dp_id].barrier_reply(dp_id, msg.xid)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER) # pylint: disable=no-member
+    @kill_on_exception(exc_logname)
+    def _flow_stats_reply_handler(self, ryu_event):
+        """Handle a flow stats reply (used to audit flows on reconnect).
+
+        Args:
+            ryu_event (ryu.controller.ofp_event.EventOFPFlowStatsReply): trigger.
+        """
+        msg = ryu_event.msg
+        dp_id = msg.datapath.id
+        if dp_id in self.valves:
+            more = bool(msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+            flowmods = self.valves[dp_id].flow_stats_reply(dp_id, msg.body, more)
+            if flowmods:
+                self._send_flow_msgs(dp_id, flowmods)
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER) # pylint: disable=no-member
+    @kill_on_exception(exc_logname)
+    def _meter_stats_reply_handler(self, ryu_event):
+        """Handle a meter stats reply (packets dropped by packet in meters).
+
+        Args:
+            ryu_event (ryu.controller.ofp_event.EventOFPMeterStatsReply): trigger.
+        """
+        msg = ryu_event.msg
+        dp_id = msg.datapath.id
+        if dp_id in self.valves:
+            self.valves[dp_id].meter_stats_reply(dp_id, msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER) # pylint: disable=no-member
+    @kill_on_exception(exc_logname)
+    def _group_desc_reply_handler(self, ryu_event):
+        """Handle a group desc reply (used to audit groups on reconnect).
+
+        Args:
+            ryu_event (ryu.controller.ofp_event.EventOFPGroupDescStatsReply): trigger.
+        """
+        msg = ryu_event.msg
+        dp_id = msg.datapath.id
+        if dp_id in self.valves:
+            more = bool(msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+            flowmods = self.valves[dp_id].group_desc_reply(dp_id, msg.body, more)
+            if flowmods:
+                self._send_flow_msgs(dp_id, flowmods)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER) # pylint: disable=no-member
     @kill_on_exception(exc_logname)
@@ -388,7 +615,7 @@ class Faucet(app_manager.RyuApp):
             discovered_up_port_nums = [
                 port.port_no for port in list(ryu_dp.ports.values()) if port.state == 0]
             valve = self.valves[dp_id]
-            flowmods = valve.datapath_connect(
+            flowmods = valve.datapath_reconnect(
                 dp_id, discovered_up_port_nums)
             self._send_flow_msgs(dp_id, flowmods)
         else:
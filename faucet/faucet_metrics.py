@@ -29,6 +29,14 @@ class FaucetMetrics(object):
         self.of_packet_ins = Counter(
             'of_packet_ins',
             'number of OF packet_ins received from DP', ['dpid'])
+        self.of_packet_ins_limited = Gauge(
+            'of_packet_ins_limited',
+            'number of OF packet_ins ignored by rate limits from DP',
+            ['dpid', 'level'])
+        self.of_packet_ins_metered = Gauge(
+            'of_packet_ins_metered',
+            'number of packets dropped by packet in meters on DP',
+            ['dpid', 'type'])
         self.of_flowmsgs_sent = Counter(
             'of_flowmsgs_sent',
             'number of OF flow messages (and packet outs) sent to DP', ['dpid'])
@@ -55,6 +63,14 @@ class FaucetMetrics(object):
         self.vlan_hosts_learned = Gauge(
             'vlan_hosts_learned',
             'number of hosts learned on a vlan', ['dpid', 'vlan'])
+        self.vlan_learns_suppressed = Gauge(
+            'vlan_learns_suppressed',
+            'number of duplicate host learns suppressed on a vlan',
+            ['dpid', 'vlan'])
+        self.vlan_mac_flaps = Gauge(
+            'vlan_mac_flaps',
+            'number of times a host flapping between ports was detected on a vlan',
+            ['dpid', 'vlan'])
         self.vlan_neighbors = Gauge(
             'vlan_neighbors',
             'number of neighbors on a vlan', ['dpid', 'vlan', 'ipv'])
@@ -87,4 +103,8 @@ class FaucetMetrics(object):
             'dp_status',
             'status of datapaths',
             ['dpid'])
+        self.faucet_event_loop_lag = Gauge(
+            'faucet_event_loop_lag_seconds',
+            'seconds between a periodic event being queued and handled',
+            ['event'])
         start_http_server(prom_port, prom_addr)
@@ -21,6 +21,7 @@ import time
 import os
 import signal
 
+from prometheus_client import start_http_server
 from ryu.base import app_manager
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
@@ -77,6 +78,11 @@ class Gauge(app_manager.RyuApp):
         self.exc_logger = get_logger(
             self.exc_logname, self.exc_logfile, logging.DEBUG, 1)
 
+        # Export Gauge's own metrics (eg. InfluxDB write queue depth)
+        prom_port = int(os.getenv('GAUGE_PROMETHEUS_PORT', '9303'))
+        prom_addr = os.getenv('GAUGE_PROMETHEUS_ADDR', '')
+        start_http_server(prom_port, prom_addr)
+
         # dict of watchers/handlers:
         # indexed by dp_id and then by name
         self.watchers = self._load_config()
@@ -151,31 +157,57 @@ class Gauge(app_manager.RyuApp):
         ryu_dp = ryu_event.dp
         self._handler_datapath_up(ryu_dp)
 
-    def _load_config(self):
-        """Load Gauge config."""
+    def _load_config(self, old_watchers=None):
+        """Load Gauge config.
+
+        Args:
+            old_watchers (dict): watchers to keep, where their config is unchanged.
+        Returns:
+            dict: watchers indexed by dp_id and then by type.
+        """
+        if old_watchers is None:
+            old_watchers = {}
         self.config_file = os.getenv('GAUGE_CONFIG', self.config_file)
         new_confs = watcher_parser(self.config_file, self.logname)
         new_watchers = {}
         for conf in new_confs:
-            watcher = watcher_factory(conf)(conf, self.logname)
-            new_watchers.setdefault(watcher.dp.dp_id, {})
-            new_watchers[watcher.dp.dp_id][watcher.conf.type] = watcher
+            dp_id = conf.dp.dp_id
+            watcher = old_watchers.get(dp_id, {}).get(conf.type, None)
+            if watcher is not None and watcher.conf == conf:
+                # Keep the running watcher, but with the new DP config
+                # (eg. port names).
+                watcher.dp = conf.dp
+                watcher.conf.dp = conf.dp
+            else:
+                watcher = watcher_factory(conf)(conf, self.logname)
+            new_watchers.setdefault(dp_id, {})
+            new_watchers[dp_id][conf.type] = watcher
         return new_watchers
 
     @set_ev_cls(EventGaugeReconfigure, MAIN_DISPATCHER)
     def reload_config(self, _):
-        """Handle request for Gauge config reload."""
-        new_watchers = self._load_config()
-        for dp_id, watchers in self.watchers:
-            for watcher_type, watcher in watchers:
-                try:
-                    new_watcher = new_watchers[dp_id][watcher_type]
-                    self.watchers[dp_id][watcher_type] = new_watcher
-                except KeyError:
-                    del self.watchers[dp_id][watcher_type]
-                if watcher.running():
+        """Handle request for Gauge config reload.
+
+        Watchers whose config is unchanged keep running, with their poll
+        phase, state and DB connections. Only watchers that were removed
+        or changed are stopped, and only new or changed watchers started.
+        """
+        old_watchers = self.watchers
+        new_watchers = self._load_config(old_watchers)
+        for dp_id, watchers in list(old_watchers.items()):
+            for watcher_type, watcher in list(watchers.items()):
+                if new_watchers.get(dp_id, {}).get(watcher_type, None) is not watcher:
                     watcher.stop()
-                    new_watcher.start(self.dpset.get(dp_id))
+        self.watchers = new_watchers
+        for dp_id, watchers in list(new_watchers.items()):
+            ryu_dp = self.dpset.get(dp_id)
+            if ryu_dp is None:
+                continue
+            for watcher_type, watcher in list(watchers.items()):
+                if old_watchers.get(dp_id, {}).get(watcher_type, None) is not watcher:
+                    self.logger.info(
+                        '%s %s watcher reloaded', dpid_log(dp_id), watcher_type)
+                    watcher.start(ryu_dp)
 
     def _update_watcher(self, dp_id, name, msg):
         """Call watcher with event data."""
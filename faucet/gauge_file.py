@@ -0,0 +1,96 @@
+"""Buffered, rotated text file output for Gauge watchers."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+_WRITERS = {}
+
+
+def file_writer(conf):
+    """Return the FileWriter for a WatcherConf's file.
+
+    Watchers that write to the same file share a writer, and so its handle.
+
+    Args:
+        conf (WatcherConf): watcher configuration.
+    Returns:
+        FileWriter: writer for this file.
+    """
+    if conf.file not in _WRITERS:
+        _WRITERS[conf.file] = FileWriter(
+            conf.file, conf.file_max_bytes, conf.file_backups)
+    return _WRITERS[conf.file]
+
+
+class FileWriter(object):
+    """Append to a file through one buffered handle, rotating it by size.
+
+    When the file reaches max_bytes (if not 0), it is renamed to file.1
+    (file.1 to file.2 and so on, keeping up to backups old files) and a
+    new file is started.
+
+    If the file is moved or removed by something else (eg. logrotate), it is
+    reopened at path before the next write.
+    """
+
+    def __init__(self, path, max_bytes=0, backups=1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.handle = None
+
+    def writelines(self, lines):
+        """Append lines, and flush them so readers see whole replies.
+
+        Args:
+            lines (list): strings to write (including any newlines).
+        """
+        if self.handle is not None and self._moved():
+            self.close()
+        if self.handle is None:
+            self.handle = open(self.path, 'a')
+        self.handle.writelines(lines)
+        self.handle.flush()
+        if self.max_bytes and self.handle.tell() >= self.max_bytes:
+            self.rotate()
+
+    def _moved(self):
+        """Return True if path is no longer the file the handle has open."""
+        try:
+            path_ino = os.stat(self.path).st_ino
+        except OSError:
+            return True
+        return path_ino != os.fstat(self.handle.fileno()).st_ino
+
+    def rotate(self):
+        """Move the current file to a backup and start a new one."""
+        self.close()
+        for backup in range(self.backups - 1, 0, -1):
+            old_path = '%s.%u' % (self.path, backup)
+            if os.path.exists(old_path):
+                os.rename(old_path, '%s.%u' % (self.path, backup + 1))
+        if self.backups:
+            os.rename(self.path, '%s.1' % self.path)
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        """Close the file (it will be reopened by the next write)."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
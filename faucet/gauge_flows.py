@@ -0,0 +1,99 @@
+"""Delta encoding of Gauge flow table dumps."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+
+COUNTERS = ('packet_count', 'byte_count')
+
+
+def flow_key(flow):
+    """Return (table_id, priority, match) identifying a flow.
+
+    Args:
+        flow (dict): OFPFlowStats as a JSON dict.
+    Returns:
+        tuple: key for flow.
+    """
+    stats = flow['OFPFlowStats']
+    return (
+        stats['table_id'], stats['priority'],
+        json.dumps(stats['match'], sort_keys=True))
+
+
+class FlowSnapshot(object):
+    """Keep the last flow table dump, to encode the next as changes.
+
+    Every keyframe_interval dumps (and the first), the full table is a
+    keyframe. Otherwise only added and removed flows, and counter deltas
+    for flows whose counters changed, are encoded.
+    """
+
+    def __init__(self, keyframe_interval):
+        self.keyframe_interval = keyframe_interval
+        self.flows = None
+        self.dumps_since_keyframe = 0
+
+    def update(self, flows):
+        """Record a new flow table dump and return it encoded.
+
+        Args:
+            flows (list): OFPFlowStats as JSON dicts.
+        Returns:
+            dict: with keyframe (bool) and either flows (keyframe), or
+                added, removed and counters.
+        """
+        new_flows = dict((flow_key(flow), flow) for flow in flows)
+        old_flows = self.flows
+        self.flows = new_flows
+        if (old_flows is None or
+                self.dumps_since_keyframe + 1 >= self.keyframe_interval):
+            self.dumps_since_keyframe = 0
+            return {'keyframe': True, 'flows': flows}
+        self.dumps_since_keyframe += 1
+        added = []
+        counters = []
+        for key, flow in list(new_flows.items()):
+            old_flow = old_flows.get(key, None)
+            if old_flow is None:
+                added.append(flow)
+                continue
+            stats = flow['OFPFlowStats']
+            old_stats = old_flow['OFPFlowStats']
+            deltas = {}
+            for counter in COUNTERS:
+                delta = stats[counter] - old_stats[counter]
+                if delta < 0:
+                    # Flow was replaced, so its counters were reset.
+                    delta = stats[counter]
+                if delta:
+                    deltas[counter] = delta
+            if deltas:
+                deltas.update({
+                    'table_id': stats['table_id'],
+                    'priority': stats['priority'],
+                    'match': stats['match']})
+                counters.append(deltas)
+        removed = [
+            flow for key, flow in list(old_flows.items())
+            if key not in new_flows]
+        return {
+            'keyframe': False,
+            'added': added,
+            'removed': removed,
+            'counters': counters}
@@ -0,0 +1,192 @@
+"""Batched, asynchronous writes of Gauge points to InfluxDB."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import time
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from prometheus_client import Counter, Gauge
+from requests.exceptions import RequestException
+from ryu.lib import hub
+
+
+INFLUX_QUEUE_DEPTH = Gauge(
+    'gauge_influx_queue_depth',
+    'number of points waiting to be written to InfluxDB', ['influx'])
+INFLUX_WRITE_SECONDS = Gauge(
+    'gauge_influx_write_seconds',
+    'time taken by the last write of points to InfluxDB', ['influx'])
+INFLUX_POINTS_DROPPED = Counter(
+    'gauge_influx_points_dropped',
+    'number of points dropped because the InfluxDB queue was full', ['influx'])
+
+_WRITERS = {}
+
+
+def escape_tag(value):
+    """Return a tag key or value escaped for InfluxDB line protocol."""
+    return str(value).replace(
+        '\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def encode_tags(tags):
+    """Return tags encoded for InfluxDB line protocol.
+
+    Args:
+        tags (list): (key, value) tuples, in the order to be encoded.
+    Returns:
+        str: tags, each with a leading comma.
+    """
+    return ''.join([
+        ',%s=%s' % (escape_tag(key), escape_tag(value)) for key, value in tags])
+
+
+def encode_line(measurement, encoded_tags, rcv_time, value):
+    """Return one point in InfluxDB line protocol.
+
+    InfluxDB has only one integer type, int64. We are logging OF stats that
+    are uint64, so values are written without the integer suffix to be
+    stored as float64 and prevent an overflow.
+    q.v. https://docs.influxdata.com/influxdb/v1.2/write_protocols/line_protocol_reference/
+
+    Args:
+        measurement (str): measurement name (must not need escaping).
+        encoded_tags (str): tags from encode_tags().
+        rcv_time (float): time of point.
+        value (int): value of point.
+    Returns:
+        str: point in line protocol.
+    """
+    return '%s%s value=%u %u' % (measurement, encoded_tags, value, rcv_time)
+
+
+def influx_writer(conf, logger):
+    """Return the InfluxWriter for a WatcherConf's InfluxDB database.
+
+    Watchers that write to the same database share a writer, and so share
+    its queue and connection pool.
+
+    Args:
+        conf (WatcherConf): watcher configuration.
+        logger (logging.Logger): logger for write errors.
+    Returns:
+        InfluxWriter: writer for this database.
+    """
+    writer_key = (
+        conf.influx_host, conf.influx_port, conf.influx_user,
+        conf.influx_pwd, conf.influx_db)
+    if writer_key not in _WRITERS:
+        _WRITERS[writer_key] = InfluxWriter(conf, logger)
+    return _WRITERS[writer_key]
+
+
+class InfluxWriter(object):
+    """Queue points and write them to InfluxDB from a background thread.
+
+    Points are written when influx_batch_size points are queued, or every
+    influx_flush_interval seconds. Failed writes are retried with
+    exponential backoff (up to influx_max_backoff seconds). When more than
+    influx_queue_size points are waiting, the oldest points are dropped.
+    """
+
+    def __init__(self, conf, logger):
+        self.logger = logger
+        self.name = '%s:%u/%s' % (
+            conf.influx_host, conf.influx_port, conf.influx_db)
+        self.batch_size = conf.influx_batch_size
+        self.flush_interval = conf.influx_flush_interval
+        self.max_backoff = conf.influx_max_backoff
+        self.queue = collections.deque(maxlen=conf.influx_queue_size)
+        # The client's HTTP session keeps connections open between writes.
+        self.client = InfluxDBClient(
+            host=conf.influx_host,
+            port=conf.influx_port,
+            username=conf.influx_user,
+            password=conf.influx_pwd,
+            database=conf.influx_db,
+            timeout=conf.influx_timeout)
+        self.flush_event = hub.Event()
+        self.thread = None
+
+    def ship(self, points):
+        """Queue points to be written.
+
+        Args:
+            points (list): InfluxDB points in line protocol.
+        Returns:
+            bool: False if points had to be dropped to make room.
+        """
+        dropped = max(0, len(self.queue) + len(points) - self.queue.maxlen)
+        self.queue.extend(points)
+        INFLUX_QUEUE_DEPTH.labels(influx=self.name).set(len(self.queue))
+        if dropped:
+            INFLUX_POINTS_DROPPED.labels(influx=self.name).inc(dropped)
+        if self.thread is None:
+            self.thread = hub.spawn(self)
+        if len(self.queue) >= self.batch_size:
+            self.flush_event.set()
+        return not dropped
+
+    def flush(self):
+        """Write all queued points, a batch at a time.
+
+        Returns:
+            bool: True if all queued points were written.
+        """
+        while self.queue:
+            batch = [
+                self.queue.popleft()
+                for _ in range(min(self.batch_size, len(self.queue)))]
+            start_time = time.time()
+            try:
+                written = self.client.write_points(
+                    points=batch, time_precision='s', protocol='line')
+            except (RequestException, InfluxDBClientError, InfluxDBServerError) as err:
+                self.logger.warning('error writing to %s: %s', self.name, err)
+                written = False
+            INFLUX_WRITE_SECONDS.labels(influx=self.name).set(
+                time.time() - start_time)
+            if not written:
+                # Put the batch back, unless newer points have taken its room.
+                dropped = max(0, len(batch) - (self.queue.maxlen - len(self.queue)))
+                self.queue.extendleft(reversed(batch[dropped:]))
+                if dropped:
+                    INFLUX_POINTS_DROPPED.labels(influx=self.name).inc(dropped)
+                INFLUX_QUEUE_DEPTH.labels(influx=self.name).set(len(self.queue))
+                return False
+            INFLUX_QUEUE_DEPTH.labels(influx=self.name).set(len(self.queue))
+        return True
+
+    def __call__(self):
+        """Write points when enough are queued or the flush interval passes.
+
+        If this thread dies, ship() starts a new one.
+        """
+        backoff = 0
+        try:
+            while True:
+                self.flush_event.wait(timeout=self.flush_interval)
+                self.flush_event.clear()
+                if self.flush():
+                    backoff = 0
+                else:
+                    backoff = min(max(backoff * 2, 1), self.max_backoff)
+                    hub.sleep(backoff)
+        finally:
+            self.thread = None
@@ -0,0 +1,129 @@
+"""Schedule Gauge pollers deterministically from one thread."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import time
+
+from prometheus_client import Gauge
+from ryu.lib import hub
+
+
+POLL_REPLY_SECONDS = Gauge(
+    'gauge_poll_reply_seconds',
+    'average time for a DP to start replying to a poll', ['dp_id', 'type'])
+
+_SCHEDULER = None
+
+
+def poll_scheduler():
+    """Return the GaugePollScheduler shared by all pollers."""
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = GaugePollScheduler()
+    return _SCHEDULER
+
+
+def poll_offset(dp_id, watcher_type, interval):
+    """Return a poller's start offset within its interval.
+
+    The offset is derived from a hash of the DP ID and watcher type, so it
+    is the same every time Gauge starts and pollers are spread evenly
+    across the interval.
+
+    Args:
+        dp_id (int): DP ID of poller.
+        watcher_type (str): type of poller (eg. port_stats).
+        interval (int): seconds between polls.
+    Returns:
+        float: seconds after each multiple of interval to poll.
+    """
+    digest = hashlib.md5(
+        ('%u-%s' % (dp_id, watcher_type)).encode('utf-8')).hexdigest()
+    return (int(digest, 16) % (interval * 1000)) / 1000.0
+
+
+class GaugePollScheduler(object):
+    """Call each poller's poll() every poll_interval() seconds.
+
+    Each poller is polled at a fixed phase (see poll_offset()) within its
+    interval. One thread polls all pollers.
+    """
+
+    def __init__(self):
+        self.next_poll = {}
+        self.wakeup = hub.Event()
+        self.thread = None
+
+    def add(self, poller, now=None):
+        """Start polling a poller."""
+        if now is None:
+            now = time.time()
+        interval = poller.poll_interval()
+        next_poll = now - (now % interval) + poll_offset(
+            poller.dp.dp_id, poller.conf.type, interval)
+        if next_poll <= now:
+            next_poll += interval
+        self.next_poll[poller] = next_poll
+        if self.thread is None:
+            self.thread = hub.spawn(self)
+        self.wakeup.set()
+
+    def remove(self, poller):
+        """Stop polling a poller."""
+        self.next_poll.pop(poller, None)
+
+    def scheduled(self, poller):
+        """Return True if poller is being polled."""
+        return poller in self.next_poll
+
+    def due(self, now):
+        """Return pollers due to be polled, and schedule their next polls."""
+        due_pollers = []
+        for poller, next_poll in list(self.next_poll.items()):
+            if next_poll <= now:
+                due_pollers.append(poller)
+                next_poll += poller.poll_interval()
+                if next_poll <= now:
+                    # We fell behind, so skip missed polls.
+                    next_poll = now + poller.poll_interval()
+                self.next_poll[poller] = next_poll
+        return sorted(
+            due_pollers, key=lambda poller: (poller.dp.dp_id, poller.conf.type))
+
+    def poll_due(self, now):
+        """Poll pollers that are due.
+
+        One poller failing (eg. because of bad config) must not stop
+        polling of every other DP, so errors are logged per poller.
+        """
+        for poller in self.due(now):
+            try:
+                poller.poll(now)
+            except Exception as err: # pylint: disable=broad-except
+                poller.logger.exception(
+                    'error polling %s: %s', poller.dp.name, err)
+
+    def __call__(self):
+        """Poll pollers as they become due."""
+        while True:
+            self.poll_due(time.time())
+            timeout = None
+            if self.next_poll:
+                timeout = max(0, min(self.next_poll.values()) - time.time())
+            self.wakeup.wait(timeout=timeout)
+            self.wakeup.clear()
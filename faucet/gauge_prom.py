@@ -0,0 +1,40 @@
+"""Prometheus metrics for the Gauge prometheus db_type."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prometheus_client import Gauge
+
+try:
+    from gauge_rates import PORT_STATS
+except ImportError:
+    from faucet.gauge_rates import PORT_STATS
+
+
+PORT_LABELS = ['dp_id', 'dp_name', 'port_name']
+
+PROM_PORT_STATS = dict(
+    (stat_name, Gauge(
+        'of_port_%s' % stat_name,
+        'last %s counter polled from a port' % stat_name.replace('_', ' '),
+        PORT_LABELS))
+    for stat_name, _ in PORT_STATS)
+PROM_PORT_STATE_REASON = Gauge(
+    'of_port_state_reason',
+    'reason for last port status change', PORT_LABELS)
+PROM_PORT_LINK_UP = Gauge(
+    'of_port_link_up',
+    '1 if port link is up, 0 if down', PORT_LABELS)
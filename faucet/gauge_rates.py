@@ -0,0 +1,186 @@
+"""In memory history of port stats, and their rates, for Gauge."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy
+
+from prometheus_client import Gauge
+
+
+# (counter name, OFPPortStats attribute) for each port stats counter.
+PORT_STATS = (
+    ('packets_out', 'tx_packets'),
+    ('packets_in', 'rx_packets'),
+    ('bytes_out', 'tx_bytes'),
+    ('bytes_in', 'rx_bytes'),
+    ('dropped_out', 'tx_dropped'),
+    ('dropped_in', 'rx_dropped'),
+    ('errors_in', 'rx_errors'))
+
+# For openvswitch, unsupported statistics are set to all-1-bits.
+UINT64_MAX = numpy.uint64(2**64-1)
+# A counter that goes backwards by more than this has been reset, not wrapped.
+MAX_WRAP_DELTA = numpy.uint64(2**63)
+
+PORT_STATS_RATE = Gauge(
+    'gauge_port_stats_rate',
+    'per second rate of a port stats counter, over the last poll',
+    ['dp_id', 'dp_name', 'port_name', 'counter'])
+
+_HISTORIES = {}
+
+
+def port_stats_history(dp_id, size):
+    """Return the PortStatsHistory for a DP.
+
+    Args:
+        dp_id (int): DP ID.
+        size (int): number of samples to keep, if history is new.
+    Returns:
+        PortStatsHistory: history for this DP.
+    """
+    if dp_id not in _HISTORIES:
+        _HISTORIES[dp_id] = PortStatsHistory(dp_id, size)
+    return _HISTORIES[dp_id]
+
+
+class PortStatsHistory(object):
+    """Keep the last size port stats samples for a DP, with their rates.
+
+    Counters and rates are kept in ring buffers, one row per port and one
+    column per counter in PORT_STATS, so that rates for all ports are
+    computed at once for each reply.
+
+    Counters are unsigned 64 bit, so the difference between samples is
+    correct even if a counter wraps. A counter that is, or was,
+    UINT64_MAX (unsupported), has no rate (NaN). A counter that goes
+    backwards by more than half its range was reset, and its rate is
+    computed from zero.
+    """
+
+    def __init__(self, dp_id, size):
+        self.dp_id = dp_id
+        self.size = size
+        self.port_rows = {}
+        self.samples = 0
+        self.times = numpy.zeros(size)
+        self.counters = numpy.full(
+            (size, 0, len(PORT_STATS)), UINT64_MAX, dtype=numpy.uint64)
+        self.rates = numpy.full((size, 0, len(PORT_STATS)), numpy.nan)
+
+    def _add_ports(self, port_nos):
+        new_ports = [
+            port_no for port_no in port_nos if port_no not in self.port_rows]
+        if not new_ports:
+            return
+        for port_no in new_ports:
+            self.port_rows[port_no] = len(self.port_rows)
+        new_shape = (self.size, len(new_ports), len(PORT_STATS))
+        self.counters = numpy.concatenate((
+            self.counters,
+            numpy.full(new_shape, UINT64_MAX, dtype=numpy.uint64)), axis=1)
+        self.rates = numpy.concatenate((
+            self.rates, numpy.full(new_shape, numpy.nan)), axis=1)
+
+    def update(self, rcv_time, stats):
+        """Add a port stats reply, and compute rates since the last reply.
+
+        Args:
+            rcv_time (float): time reply was received.
+            stats (list): OFPPortStats from reply.
+        """
+        self._add_ports([stat.port_no for stat in stats])
+        counters = numpy.full(
+            self.counters.shape[1:], UINT64_MAX, dtype=numpy.uint64)
+        if stats:
+            rows = [self.port_rows[stat.port_no] for stat in stats]
+            counters[rows] = numpy.array(
+                [[getattr(stat, stat_attr) for _, stat_attr in PORT_STATS]
+                 for stat in stats], dtype=numpy.uint64)
+        rates = numpy.full(counters.shape, numpy.nan)
+        if self.samples:
+            last = (self.samples - 1) % self.size
+            interval = rcv_time - self.times[last]
+            if interval > 0:
+                last_counters = self.counters[last]
+                deltas = counters - last_counters
+                reset = deltas > MAX_WRAP_DELTA
+                deltas[reset] = counters[reset]
+                valid = (counters != UINT64_MAX) & (last_counters != UINT64_MAX)
+                rates[valid] = deltas[valid].astype(numpy.float64) / interval
+        index = self.samples % self.size
+        self.times[index] = rcv_time
+        self.counters[index] = counters
+        self.rates[index] = rates
+        self.samples += 1
+
+    def _order(self):
+        """Return ring buffer indexes of samples, oldest first."""
+        kept = min(self.samples, self.size)
+        return (numpy.arange(kept) + self.samples - kept) % self.size
+
+    def history(self, port_no, counter):
+        """Return times and rates of a port's counter, oldest first.
+
+        Args:
+            port_no (int): port number.
+            counter (str): counter name from PORT_STATS (eg. bytes_in).
+        Returns:
+            tuple: numpy arrays of times and rates (NaN where unknown).
+        """
+        order = self._order()
+        if port_no not in self.port_rows:
+            return (self.times[order], numpy.full(len(order), numpy.nan))
+        column = [name for name, _ in PORT_STATS].index(counter)
+        return (
+            self.times[order],
+            self.rates[order, self.port_rows[port_no], column])
+
+    def latest_rates(self):
+        """Return rates from the last sample.
+
+        Returns:
+            dict: {port_no: {counter name: rate}}, for known rates.
+        """
+        latest_rates = {}
+        if self.samples:
+            rates = self.rates[(self.samples - 1) % self.size]
+            for port_no, row in list(self.port_rows.items()):
+                port_rates = dict(
+                    (name, rate) for (name, _), rate in zip(PORT_STATS, rates[row])
+                    if not numpy.isnan(rate))
+                if port_rates:
+                    latest_rates[port_no] = port_rates
+        return latest_rates
+
+    def export(self, dp_name, port_names):
+        """Export rates from the last sample to Prometheus.
+
+        Args:
+            dp_name (str): DP name.
+            port_names (dict): port names by port number. Ports without a
+                name are not exported.
+        """
+        dp_id = hex(self.dp_id)
+        for port_no, port_rates in list(self.latest_rates().items()):
+            port_name = port_names.get(port_no, None)
+            if port_name is None:
+                continue
+            for counter, rate in list(port_rates.items()):
+                PORT_STATS_RATE.labels(
+                    dp_id=dp_id, dp_name=dp_name, port_name=port_name,
+                    counter=counter).set(rate)
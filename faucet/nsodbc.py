@@ -36,6 +36,7 @@ class NsOdbc(object):
     create
     get_doc
     insert_update_doc
+    insert_update_docs
     delete_doc
     """
 
@@ -126,6 +127,43 @@ class DatabaseCouch(object):
             doc_id, _ = self.database.save(l_doc)
             return doc_id
 
+    def insert_update_docs(self, docs):
+        """Insert, update or delete many documents in one bulk request.
+
+        Documents to update or delete must have the _rev of the stored
+        document. If they do not (for example, after a restart) the current
+        _revs are fetched, and those documents retried in one more request.
+        Returns a dict of the new _rev of each document that was saved.
+        """
+        saved_revs = {}
+        conflicts = []
+        for doc, (success, doc_id, rev) in zip(docs, self.database.update(docs)):
+            if success:
+                saved_revs[doc_id] = rev
+            elif isinstance(rev, couchdb.http.ResourceConflict):
+                conflicts.append(doc)
+        if conflicts:
+            current_revs = {}
+            for row in self.database.view(
+                    '_all_docs', keys=[doc['_id'] for doc in conflicts]):
+                if row.value:
+                    current_revs[row.id] = row.value['rev']
+            for doc in conflicts:
+                if doc['_id'] in current_revs:
+                    doc['_rev'] = current_revs[doc['_id']]
+                else:
+                    doc.pop('_rev', None)
+            for success, doc_id, rev in self.database.update(conflicts):
+                if success:
+                    saved_revs[doc_id] = rev
+        return saved_revs
+
+    def get_revs(self, id_prefix):
+        """Return the _rev of each document whose _id starts with id_prefix."""
+        rows = self.database.view(
+            '_all_docs', startkey=id_prefix, endkey=id_prefix + u'\ufff0')
+        return dict((row.id, row.value['rev']) for row in rows)
+
     def get_docs(self, view_url, key):
         """Select docs
 
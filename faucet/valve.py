@@ -18,6 +18,7 @@
 # limitations under the License.
 
 import copy
+import ipaddress
 import logging
 import time
 
@@ -35,6 +36,7 @@ try:
     import valve_host
     import valve_of
     import valve_packet
+    import valve_ratelimit
     import valve_route
     import valve_util
 except ImportError:
@@ -44,6 +46,7 @@ except ImportError:
     from faucet import valve_host
     from faucet import valve_of
     from faucet import valve_packet
+    from faucet import valve_ratelimit
     from faucet import valve_route
     from faucet import valve_util
 
@@ -73,13 +76,14 @@ def valve_factory(dp):
 class PacketMeta(object):
     """Original, and parsed Ethernet packet metadata."""
 
-    def __init__(self, pkt, eth_pkt, port, vlan, eth_src, eth_dst):
+    def __init__(self, pkt, eth_pkt, port, vlan, eth_src, eth_dst, eth_type):
         self.pkt = pkt
         self.eth_pkt = eth_pkt
         self.port = port
         self.vlan = vlan
         self.eth_src = eth_src
         self.eth_dst = eth_dst
+        self.eth_type = eth_type
 
 
 class Valve(object):
@@ -101,9 +105,21 @@ class Valve(object):
         self._packet_in_count_sec = 0
         self._last_packet_in_sec = 0
         self._last_advertise_sec = 0
+        self._warm_state = None
+        self._provisioned = False
+        self._audit = None
+        self._dp_init()
+
+    def _dp_init(self):
+        """Initialize flow managers for the current DP configuration."""
         self._register_table_match_types()
         # TODO: functional flow managers require too much state.
         # Should interface with a common composer class.
+        self.flood_manager = valve_flood.ValveFloodManager(
+            self.dp.flood_table, self.dp.low_priority,
+            self.valve_in_match, self.valve_flowmod,
+            self.dp.stack, self.dp.ports, self.dp.shortest_path_to_root,
+            self.dp.group_table, self.dp.multi_out)
         self.route_manager_by_ipv = {}
         for fib_table, route_manager_class in (
                 (self.dp.ipv4_fib_table, valve_route.ValveIPv4RouteManager),
@@ -116,18 +132,26 @@ class Valve(object):
                 self.dp.eth_dst_table, self.dp.flood_table,
                 self.dp.highest_priority,
                 self.valve_in_match, self.valve_flowdel, self.valve_flowmod,
-                self.valve_flowcontroller,
+                self.valve_flowcontroller, self.flood_manager.build_flood_pkt,
                 self.dp.group_table_routing, self.dp.routers)
             self.route_manager_by_ipv[route_manager.IPV] = route_manager
-        self.flood_manager = valve_flood.ValveFloodManager(
-            self.dp.flood_table, self.dp.low_priority,
-            self.valve_in_match, self.valve_flowmod,
-            self.dp.stack, self.dp.ports, self.dp.shortest_path_to_root,
-            self.dp.group_table)
+        self.packet_in_limiter = valve_ratelimit.PacketInLimiter(
+            self.dp.packetin_dp_rate, self.dp.packetin_vlan_rate,
+            self.dp.packetin_port_rate)
+        self._port_overload_bans = {}
+        self._packetin_meters = {}
+        for packetin_type, meter_id, pps in (
+                ('control_plane', valve_of.CONTROL_PLANE_METER_ID,
+                 self.dp.packetin_control_plane_pps),
+                ('route_miss', valve_of.ROUTE_MISS_METER_ID,
+                 self.dp.packetin_route_miss_pps)):
+            if pps:
+                self._packetin_meters[packetin_type] = (meter_id, pps)
+        self._packetin_meter_drops = {}
         self.host_manager = valve_host.ValveHostManager(
             self.logger, self.dp.eth_src_table, self.dp.eth_dst_table,
             self.dp.timeout, self.dp.learn_jitter, self.dp.learn_ban_timeout,
-            self.dp.low_priority, self.dp.highest_priority,
+            self.dp.learn_hold_down, self.dp.low_priority, self.dp.highest_priority,
             self.valve_in_match, self.valve_flowmod, self.valve_flowdel,
             self.valve_flowdrop)
 
@@ -264,7 +288,8 @@ class Valve(object):
             eth_dst, eth_dst_mask, ipv6_nd_target, icmpv6_type,
             nw_proto, nw_src, nw_dst)
         if (table_id not in (
-            self.dp.port_acl_table, self.dp.vlan_acl_table, ofp.OFPTT_ALL)):
+            self.dp.port_acl_table, self.dp.port_acl_rules_table,
+            self.dp.vlan_acl_table, ofp.OFPTT_ALL)):
             assert table_id in self.TABLE_MATCH_TYPES,\
                 '%u table not registered' % table_id
             for match_type in match_dict:
@@ -293,7 +318,7 @@ class Valve(object):
         Returns:
             tuple: all Valve tables as ints.
         """
-        return (
+        tables = (
             self.dp.vlan_table,
             self.dp.port_acl_table,
             self.dp.vlan_acl_table,
@@ -302,6 +327,9 @@ class Valve(object):
             self.dp.ipv6_fib_table,
             self.dp.eth_dst_table,
             self.dp.flood_table)
+        if self.dp.port_acl_rules_table is not None:
+            tables += (self.dp.port_acl_rules_table,)
+        return tables
 
     def valve_flowmod(self, table_id, match=None, priority=None,
                       inst=None, command=ofp.OFPFC_ADD, out_port=0,
@@ -351,10 +379,19 @@ class Valve(object):
             inst=[])
 
     def valve_flowcontroller(self, table_id, match=None, priority=None,
-                             inst=None, max_len=96):
-        """Add flow outputting to controller."""
+                             inst=None, max_len=96, packetin_type=None):
+        """Add flow outputting to controller.
+
+        If a packet in meter is configured for packetin_type (eg.
+        control_plane), packets are metered before being output to the
+        controller. A meter drops the whole packet, so flows that also
+        forward packets (inst) are never metered.
+        """
         if inst is None:
             inst = []
+        if packetin_type in self._packetin_meters and not inst:
+            meter_id, _ = self._packetin_meters[packetin_type]
+            inst = [valve_of.apply_meter(meter_id)] + inst
         return self.valve_flowmod(
             table_id,
             match=match,
@@ -401,6 +438,11 @@ class Valve(object):
         if groupadd_ofmsgs:
             output_ofmsgs.extend(groupadd_ofmsgs)
             output_ofmsgs.append(valve_of.barrier())
+        if (output_ofmsgs and nondelete_ofmsgs and
+                valve_of.is_barrier(nondelete_ofmsgs[0])):
+            # Already a barrier here (e.g. from a reconnect audit), so send
+            # that one rather than two in a row.
+            output_ofmsgs.pop()
         output_ofmsgs.extend(nondelete_ofmsgs)
         return output_ofmsgs
 
@@ -467,15 +509,58 @@ class Valve(object):
 
         return ofmsgs
 
+    def _build_acl_entries(self, acl_num, acl_allow_inst,
+                           port_num=None, vlan_vid=None, metadata=None):
+        """Return (match, instructions) for each rule in an ACL.
+
+        Args:
+            acl_num (str): ACL to build.
+            acl_allow_inst: instruction for rules that allow packets.
+            port_num (int): port ACL is applied to, if any.
+            vlan_vid (int): VLAN ACL is applied to, if any.
+            metadata (int): metadata identifying ACL, if any.
+        Returns:
+            list: (match, instructions) tuples in priority order.
+        """
+        acl_entries = []
+        for rule_conf in self.dp.acls[acl_num].rules:
+            acl_entries.append(valve_acl.build_acl_entry(
+                rule_conf, acl_allow_inst,
+                port_num=port_num, vlan_vid=vlan_vid, metadata=metadata))
+        if self.dp.compress_acls:
+            compressed_entries = valve_acl.compress_acl_entries(acl_entries)
+            if len(compressed_entries) < len(acl_entries):
+                self.dpid_log('ACL %s compressed from %u to %u rules' % (
+                    acl_num, len(acl_entries), len(compressed_entries)))
+            acl_entries = compressed_entries
+        return acl_entries
+
+    def _add_port_acl_metadata_rules(self):
+        """Add port ACL rules shared between ports via metadata."""
+        ofmsgs = []
+        if self.dp.port_acl_metadata:
+            acl_allow_inst = valve_of.goto_table(self.dp.vlan_table)
+            for acl_num, metadata in list(
+                    self.dp.port_acl_metadata_ids().items()):
+                acl_rule_priority = self.dp.highest_priority
+                for acl_match, acl_inst in self._build_acl_entries(
+                        acl_num, acl_allow_inst, metadata=metadata):
+                    ofmsgs.append(self.valve_flowmod(
+                        self.dp.port_acl_rules_table,
+                        acl_match,
+                        priority=acl_rule_priority,
+                        inst=acl_inst))
+                    acl_rule_priority -= 1
+        return ofmsgs
+
     def _add_vlan_acl(self, vid):
         ofmsgs = []
         if vid in self.dp.vlan_acl_in:
             acl_num = self.dp.vlan_acl_in[vid]
             acl_rule_priority = self.dp.highest_priority
             acl_allow_inst = valve_of.goto_table(self.dp.eth_src_table)
-            for rule_conf in self.dp.acls[acl_num].rules:
-                acl_match, acl_inst = valve_acl.build_acl_entry(
-                    rule_conf, acl_allow_inst, vlan_vid=vid)
+            for acl_match, acl_inst in self._build_acl_entries(
+                    acl_num, acl_allow_inst, vlan_vid=vid):
                 ofmsgs.append(self.valve_flowmod(
                     self.dp.vlan_acl_table,
                     acl_match,
@@ -492,7 +577,12 @@ class Valve(object):
             inst=[valve_of.goto_table(self.dp.flood_table)])]
 
     def _add_controller_learn_flow(self):
-        """Add a flow for controller to learn/add flows for destinations."""
+        """Add a flow for controller to learn/add flows for destinations.
+
+        Packets from unlearned hosts are also forwarded, so packet ins for
+        learning can only be rate limited by packetin_pps (which meters just
+        the copy to the controller), not by a packet in meter.
+        """
         return [self.valve_flowcontroller(
             self.dp.eth_src_table,
             priority=self.dp.low_priority,
@@ -500,12 +590,44 @@ class Valve(object):
 
     def _add_packetin_meter(self):
         """Add rate limiting of packet in pps (not supported by many DPs)."""
+        ofmsgs = []
         if self.dp.packetin_pps:
-            return [
+            ofmsgs.extend([
                 valve_of.controller_pps_meterdel(),
-                valve_of.controller_pps_meteradd(pps=self.dp.packetin_pps)]
+                valve_of.controller_pps_meteradd(pps=self.dp.packetin_pps)])
+        for meter_id, pps in sorted(self._packetin_meters.values()):
+            ofmsgs.extend([
+                valve_of.pps_meterdel(meter_id),
+                valve_of.pps_meteradd(meter_id, pps)])
+        return ofmsgs
+
+    def meter_stats_request(self):
+        """Return request for stats of packet in meters, if any are configured.
+
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        if self.dp.running and self._packetin_meters:
+            return [valve_of.meterstats_request()]
         return []
 
+    def meter_stats_reply(self, dp_id, stats):
+        """Record packets dropped by packet in meters.
+
+        Args:
+            dp_id (int): datapath ID.
+            stats (list): OFPMeterStats instances.
+        """
+        if self._ignore_dpid(dp_id):
+            return
+        packetin_types = dict(
+            (meter_id, packetin_type)
+            for packetin_type, (meter_id, _) in list(self._packetin_meters.items()))
+        for stat in stats:
+            if stat.meter_id in packetin_types:
+                self._packetin_meter_drops[packetin_types[stat.meter_id]] = sum(
+                    [band_stat.packet_band_count for band_stat in stat.band_stats])
+
     def _add_default_flows(self):
         """Configure datapath with necessary default tables and rules."""
         ofmsgs = []
@@ -612,10 +734,250 @@ class Valve(object):
             return []
         self.dpid_log('Cold start configuring DP')
         ofmsgs = []
+        ofmsgs.extend(self._cold_start_ofmsgs(discovered_up_port_nums))
+        ofmsgs.extend(self._restore_warm_state())
+        self._provisioned = True
+        self._audit = None
+        self.dp.running = True
+        return ofmsgs
+
+    def _cold_start_ofmsgs(self, discovered_up_port_nums):
+        """Return OpenFlow messages to provision the pipeline from scratch."""
+        ofmsgs = []
         ofmsgs.extend(self._add_default_flows())
+        ofmsgs.extend(self._add_port_acl_metadata_rules())
         ofmsgs.extend(self._add_ports_and_vlans(discovered_up_port_nums))
         ofmsgs.extend(self._add_controller_learn_flow())
+        return ofmsgs
+
+    def datapath_reconnect(self, dp_id, discovered_up_port_nums):
+        """Handle Ryu datapath reconnection.
+
+        If reconnect_audit is enabled and this datapath has already been
+        provisioned, request its flows and groups so that only corrections
+        need be sent (see flow_stats_reply() and group_desc_reply()).
+        Otherwise, cold start the datapath.
+
+        Args:
+            dp_id (int): datapath ID.
+            discovered_up_port_nums (list): datapath ports that are up as ints.
+        Returns:
+            list: OpenFlow messages to send to datapath.
+        """
+        if self._ignore_dpid(dp_id):
+            return []
+        if not (self.dp.reconnect_audit and self._provisioned):
+            return self.datapath_connect(dp_id, discovered_up_port_nums)
+        self.dpid_log('Auditing flows on reconnect')
+        self._audit = {
+            'deadline': time.time() + self.dp.reconnect_audit_timeout,
+            'port_nums': discovered_up_port_nums,
+            'flows': [],
+            'flows_done': False,
+            'groups': [],
+            'groups_done': False,
+            }
         self.dp.running = True
+        return [
+            valve_of.flowstats_request(
+                cookie=self.dp.cookie, cookie_mask=0xffffffffffffffff),
+            valve_of.groupdesc_request()]
+
+    def flow_stats_reply(self, dp_id, stats, more):
+        """Handle a (part of a) flow stats reply requested by a reconnect audit.
+
+        Args:
+            dp_id (int): datapath ID.
+            stats (list): ryu.ofproto.ofproto_v1_3_parser.OFPFlowStats.
+            more (bool): True if more replies will follow.
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        if self._ignore_dpid(dp_id) or self._audit is None:
+            return []
+        self._audit['flows'].extend(stats)
+        self._audit['flows_done'] = not more
+        return self._audit_reconnect()
+
+    def group_desc_reply(self, dp_id, stats, more):
+        """Handle a (part of a) group desc reply requested by a reconnect audit.
+
+        Args:
+            dp_id (int): datapath ID.
+            stats (list): ryu.ofproto.ofproto_v1_3_parser.OFPGroupDescStats.
+            more (bool): True if more replies will follow.
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        if self._ignore_dpid(dp_id) or self._audit is None:
+            return []
+        self._audit['groups'].extend(stats)
+        self._audit['groups_done'] = not more
+        return self._audit_reconnect()
+
+    def audit_expire(self, now=None):
+        """Cold start the datapath if its reconnect audit has timed out.
+
+        Called periodically, so that a datapath whose audit replies were
+        lost is not left unprovisioned.
+
+        Args:
+            now (float): current time (defaults to time.time()).
+        Returns:
+            list: OpenFlow messages, if the audit timed out.
+        """
+        if self._audit is None:
+            return []
+        if now is None:
+            now = time.time()
+        if now < self._audit['deadline']:
+            return []
+        self.dpid_log('Reconnect audit timed out')
+        return self.datapath_connect(self.dp.dp_id, self._audit['port_nums'])
+
+    def ofp_error(self, dp_id, msg):
+        """Handle an OFPErrorMsg from the datapath.
+
+        The datapath may have rejected a reconnect audit request, so an
+        error during an audit abandons the audit and cold starts the
+        datapath.
+
+        Args:
+            dp_id (int): datapath ID.
+            msg (ryu.ofproto.ofproto_v1_3_parser.OFPErrorMsg): error message.
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        if self._ignore_dpid(dp_id) or self._audit is None:
+            return []
+        self.dpid_log('Reconnect audit abandoned after error: %s' % msg)
+        return self.datapath_connect(dp_id, self._audit['port_nums'])
+
+    def _audit_reconnect(self):
+        """Correct flows and groups on a reconnected datapath.
+
+        Expected flows and groups missing from the datapath, or different
+        on the datapath, are re-sent. Unexpected flows are deleted, except
+        from the tables Valve learns into (and flows with timeouts) as the
+        datapath may still have learned flows we want to keep.
+
+        Returns:
+            list: OpenFlow messages, once both flows and groups are known.
+        """
+        audit = self._audit
+        if not (audit['flows_done'] and audit['groups_done']):
+            return []
+        self._audit = None
+        expected_flows = {}
+        expected_groups = {}
+        for ofmsg in self._cold_start_ofmsgs(audit['port_nums']):
+            if valve_of.is_flowmod(ofmsg):
+                if ofmsg.command == ofp.OFPFC_ADD:
+                    expected_flows[valve_of.flow_key(ofmsg)] = ofmsg
+            elif valve_of.is_groupadd(ofmsg):
+                expected_groups[ofmsg.group_id] = ofmsg
+        learned_tables = set([
+            self.dp.eth_src_table, self.dp.eth_dst_table,
+            self.dp.ipv4_fib_table, self.dp.ipv6_fib_table])
+        delete_ofmsgs = []
+        add_ofmsgs = []
+        dp_flows = set()
+        deleted_flows = 0
+        for flow in audit['flows']:
+            key = valve_of.flow_key(flow)
+            dp_flows.add(key)
+            if key in expected_flows:
+                continue
+            if (flow.table_id in learned_tables or
+                    flow.idle_timeout or flow.hard_timeout):
+                continue
+            delete_ofmsgs.extend(self.valve_flowdel(
+                flow.table_id, match=flow.match,
+                priority=flow.priority, strict=True))
+            deleted_flows += 1
+        nexthop_group_ids = set()
+        for route_manager in list(self.route_manager_by_ipv.values()):
+            nexthop_group_ids.update(route_manager.ip_gw_to_group_id.values())
+        dp_groups = {}
+        for group in audit['groups']:
+            dp_groups[group.group_id] = group
+        changed_groups = 0
+        for group_id, group in list(dp_groups.items()):
+            if group_id not in expected_groups and group_id not in nexthop_group_ids:
+                delete_ofmsgs.append(valve_of.groupdel(group_id=group_id))
+                changed_groups += 1
+        for group_id, ofmsg in list(expected_groups.items()):
+            if group_id not in dp_groups:
+                add_ofmsgs.append(ofmsg)
+                changed_groups += 1
+            elif valve_of.group_key(dp_groups[group_id]) != valve_of.group_key(ofmsg):
+                add_ofmsgs.append(valve_of.groupmod(
+                    type_=ofmsg.type, group_id=group_id, buckets=ofmsg.buckets))
+                changed_groups += 1
+        added_flows = 0
+        for key, ofmsg in list(expected_flows.items()):
+            if key not in dp_flows:
+                add_ofmsgs.append(ofmsg)
+                added_flows += 1
+        self.dpid_log(
+            'Reconnect audit deleted %u flows, added %u flows, changed %u groups' % (
+                deleted_flows, added_flows, changed_groups))
+        ofmsgs = []
+        ofmsgs.extend(delete_ofmsgs)
+        if delete_ofmsgs and add_ofmsgs:
+            # A strict delete and the re-add of the same flow (e.g. with
+            # different instructions) must not be reordered by the datapath.
+            ofmsgs.append(valve_of.barrier())
+        ofmsgs.extend(add_ofmsgs)
+        return ofmsgs
+
+    def _restore_warm_state(self):
+        """Reprovision hosts and neighbors learned before a controller restart.
+
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        ofmsgs = []
+        if self._warm_state is None:
+            return ofmsgs
+        state = self._warm_state
+        self._warm_state = None
+        now = time.time()
+        restored_hosts = 0
+        for vid, eth_src, port_num, cache_time in state.get('hosts', []):
+            if vid not in self.dp.vlans or port_num not in self.dp.ports:
+                continue
+            if now - cache_time > self.dp.timeout:
+                continue
+            vlan = self.dp.vlans[vid]
+            port = self.dp.ports[port_num]
+            if not port.running():
+                continue
+            if port.stack is None and not (
+                    vlan.port_is_tagged(port) or vlan.port_is_untagged(port)):
+                continue
+            ofmsgs.extend(self.host_manager.learn_host_on_vlan_port(
+                port, vlan, eth_src))
+            restored_hosts += 1
+        restored_neighbors = 0
+        for vid, ip_gw, eth_src, cache_time in state.get('neighbors', []):
+            if vid not in self.dp.vlans:
+                continue
+            if now - cache_time > self.dp.arp_neighbor_timeout:
+                continue
+            vlan = self.dp.vlans[vid]
+            if eth_src not in vlan.host_cache:
+                continue
+            ip_gw = ipaddress.ip_address(ip_gw)
+            if ip_gw.version not in self.route_manager_by_ipv:
+                continue
+            route_manager = self.route_manager_by_ipv[ip_gw.version]
+            port = self.dp.ports[vlan.host_cache[eth_src].port_num]
+            ofmsgs.extend(route_manager.restore_nexthop(
+                vlan, port, eth_src, ip_gw))
+            restored_neighbors += 1
+        self.dpid_log('Restored %u hosts and %u neighbors from saved state' % (
+            restored_hosts, restored_neighbors))
         return ofmsgs
 
     def datapath_disconnect(self, dp_id):
@@ -631,12 +993,22 @@ class Valve(object):
     def _port_add_acl(self, port_num):
         ofmsgs = []
         acl_allow_inst = valve_of.goto_table(self.dp.vlan_table)
-        if port_num in self.dp.port_acl_in:
+        if port_num in self.dp.port_acl_in and self.dp.port_acl_metadata:
+            acl_num = self.dp.port_acl_in[port_num]
+            metadata = self.dp.port_acl_metadata_ids()[acl_num]
+            ofmsgs.append(self.valve_flowmod(
+                self.dp.port_acl_table,
+                self.valve_in_match(self.dp.port_acl_table, in_port=port_num),
+                priority=self.dp.highest_priority,
+                inst=[
+                    valve_of.write_metadata(metadata),
+                    valve_of.goto_table(self.dp.port_acl_rules_table)]
+                ))
+        elif port_num in self.dp.port_acl_in:
             acl_num = self.dp.port_acl_in[port_num]
             acl_rule_priority = self.dp.highest_priority
-            for rule_conf in self.dp.acls[acl_num].rules:
-                acl_match, acl_inst = valve_acl.build_acl_entry(
-                    rule_conf, acl_allow_inst, port_num)
+            for acl_match, acl_inst in self._build_acl_entries(
+                    acl_num, acl_allow_inst, port_num=port_num):
                 ofmsgs.append(self.valve_flowmod(
                     self.dp.port_acl_table,
                     acl_match,
@@ -843,9 +1215,10 @@ class Valve(object):
         if (pkt_meta.eth_dst == self.FAUCET_MAC or
                 not valve_packet.mac_addr_is_unicast(pkt_meta.eth_dst)):
             for route_manager in list(self.route_manager_by_ipv.values()):
-                ofmsgs = route_manager.control_plane_handler(pkt_meta)
-                if ofmsgs:
-                    return ofmsgs
+                if pkt_meta.eth_type in route_manager.CONTROL_ETH_TYPES:
+                    ofmsgs = route_manager.control_plane_handler(pkt_meta)
+                    if ofmsgs:
+                        return ofmsgs
         return []
 
     def _known_up_dpid_and_port(self, dp_id, in_port):
@@ -874,6 +1247,34 @@ class Valve(object):
                 return True
         return False
 
+    def _limit_packet_in(self, in_port, vlan_vid):
+        """Apply DP, VLAN and port packet in rate limits.
+
+        Args:
+            in_port (int): port packet was received on.
+            vlan_vid (int): VLAN VID of port packet was received on.
+        Returns:
+            tuple: (True if packet in should be ignored, OpenFlow messages).
+        """
+        now = self.packet_in_limiter.clock()
+        level = self.packet_in_limiter.limit(in_port, vlan_vid)
+        if level is None:
+            return (False, [])
+        ofmsgs = []
+        if level == self.packet_in_limiter.PORT:
+            port = self.dp.ports[in_port]
+            last_ban = self._port_overload_bans.get(in_port, None)
+            if (port.stack is None and
+                    (last_ban is None or
+                     now - last_ban >= self.dp.learn_ban_timeout)):
+                self._port_overload_bans[in_port] = now
+                ofmsgs.append(self.host_manager.temp_ban_host_learning_on_port(
+                    port))
+                self.dpid_log(
+                    'packet in rate exceeded on port %u, '
+                    'temporarily banning learning on this port' % in_port)
+        return (True, ofmsgs)
+
     def _edge_dp_for_host(self, valves, dp_id, pkt_meta):
         """Simple distributed unicast learning.
 
@@ -946,16 +1347,18 @@ class Valve(object):
         Args:
             in_port (int): port packet was received on.
             vlan_vid (int): VLAN VID of port packet was received on.
-            pkt (ryu.lib.packet.packet): packet received.
+            pkt (ryu.lib.packet.packet or LazyPacket): packet received.
         Returns:
             PacketMeta instance.
         """
         eth_pkt = valve_packet.parse_pkt(pkt)
         eth_src = eth_pkt.src
         eth_dst = eth_pkt.dst
+        eth_type = valve_packet.parse_eth_type(pkt)
         vlan = self.dp.vlans[vlan_vid]
         port = self.dp.ports[in_port]
-        return PacketMeta(pkt, eth_pkt, port, vlan, eth_src, eth_dst)
+        return PacketMeta(
+            pkt, eth_pkt, port, vlan, eth_src, eth_dst, eth_type)
 
     def _port_learn_ban_rules(self, pkt_meta):
         """Limit learning to a maximum configured on this port.
@@ -982,6 +1385,41 @@ class Valve(object):
             return ofmsgs
         return ofmsgs
 
+    def _mac_flap_ban_rules(self, pkt_meta):
+        """Ban learning on ports a host is flapping between (eg. a loop).
+
+        Args:
+            pkt_meta: PacketMeta instance.
+        Returns:
+            list: OpenFlow messages, if any.
+        """
+        ofmsgs = []
+        if not self.dp.mac_flap_threshold:
+            return ofmsgs
+        vlan = pkt_meta.vlan
+        port = pkt_meta.port
+        eth_src = pkt_meta.eth_src
+        if eth_src not in vlan.host_cache:
+            return ofmsgs
+        old_port_num = vlan.host_cache[eth_src].port_num
+        if old_port_num == port.number:
+            return ofmsgs
+        moves = self.host_manager.host_moved(
+            vlan, eth_src, time.time(),
+            self.dp.mac_flap_window, self.dp.mac_flap_threshold)
+        if moves < self.dp.mac_flap_threshold:
+            return ofmsgs
+        for flap_port in (port, self.dp.ports.get(old_port_num, None)):
+            if flap_port is not None and flap_port.stack is None:
+                ofmsgs.append(
+                    self.host_manager.temp_ban_host_learning_on_port(flap_port))
+        self.host_manager.host_flaps_by_vid[vlan.vid] += 1
+        self.dpid_warn(
+            '%s moved %u times between ports %u and %u on VLAN %u, '
+            'temporarily banning learning on these ports' % (
+                eth_src, moves, old_port_num, port.number, vlan.vid))
+        return ofmsgs
+
     def _vlan_learn_ban_rules(self, pkt_meta):
         """Limit learning to a maximum configured on this VLAN.
 
@@ -1054,17 +1492,32 @@ class Valve(object):
         """
         # Clear the exported MAC learning.
         dpid = hex(self.dp.dp_id)
-        for _, label_dict, _ in metrics.learned_macs.collect()[0].samples:
+        for sample in metrics.learned_macs.collect()[0].samples:
+            # Newer prometheus_client samples have more than 3 fields.
+            label_dict = sample[1]
             if label_dict['dpid'] == dpid:
                 metrics.learned_macs.labels(
                     dpid=label_dict['dpid'], vlan=label_dict['vlan'],
                     port=label_dict['port'], n=label_dict['n']).set(0)
 
+        for packetin_type, dropped in list(self._packetin_meter_drops.items()):
+            metrics.of_packet_ins_metered.labels(
+                dpid=dpid, type=packetin_type).set(dropped)
+        for level, limited in list(self.packet_in_limiter.limited.items()):
+            metrics.of_packet_ins_limited.labels(
+                dpid=dpid, level=level).set(limited)
+
         for vlan in list(self.dp.vlans.values()):
             hosts_count = self.host_manager.hosts_learned_on_vlan_count(
                 vlan)
             metrics.vlan_hosts_learned.labels(
                 dpid=dpid, vlan=vlan.vid).set(hosts_count)
+            metrics.vlan_learns_suppressed.labels(
+                dpid=dpid, vlan=vlan.vid).set(
+                    self.host_manager.learns_suppressed_by_vid[vlan.vid])
+            metrics.vlan_mac_flaps.labels(
+                dpid=dpid, vlan=vlan.vid).set(
+                    self.host_manager.host_flaps_by_vid[vlan.vid])
             for ipv in vlan.ipvs():
                 neigh_cache_size = len(vlan.neigh_cache_by_ipv(ipv))
                 metrics.vlan_neighbors.labels(
@@ -1099,11 +1552,18 @@ class Valve(object):
         Return:
             list: OpenFlow messages, if any.
         """
+        return self.rcv_packets(dp_id, valves, [(in_port, vlan_vid, pkt)])
+
+    def _rcv_packet(self, dp_id, valves, in_port, vlan_vid, pkt):
+        """Handle a packet from the dataplane, see rcv_packet()."""
         if not self._known_up_dpid_and_port(dp_id, in_port):
             return []
         if not vlan_vid in self.dp.vlans:
             self.dpid_log('Packet_in for unexpected VLAN %s' % (vlan_vid))
             return []
+        limited, ofmsgs = self._limit_packet_in(in_port, vlan_vid)
+        if limited:
+            return ofmsgs
 
         pkt_meta = self._parse_rcv_packet(in_port, vlan_vid, pkt)
         ofmsgs = []
@@ -1120,6 +1580,11 @@ class Valve(object):
         if self._rate_limit_packet_ins():
             return ofmsgs
 
+        ban_flap_rules = self._mac_flap_ban_rules(pkt_meta)
+        if ban_flap_rules:
+            ofmsgs.extend(ban_flap_rules)
+            return ofmsgs
+
         ban_port_rules = self._port_learn_ban_rules(pkt_meta)
         if ban_port_rules:
             ofmsgs.extend(ban_port_rules)
@@ -1133,6 +1598,32 @@ class Valve(object):
         ofmsgs.extend(self._learn_host(valves, dp_id, pkt_meta))
         return ofmsgs
 
+    def rcv_packets(self, dp_id, valves, packet_ins):
+        """Handle a batch of packets from the dataplane, in order received.
+
+        Args:
+            dp_id (int): datapath ID.
+            valves (dict): all datapaths, indexed by datapath ID.
+            packet_ins (list): (in_port, vlan_vid, pkt) for each packet.
+        Return:
+            list: OpenFlow messages for all packets, if any.
+        """
+        ofmsgs = []
+        for in_port, vlan_vid, pkt in packet_ins:
+            ofmsgs.extend(self._rcv_packet(dp_id, valves, in_port, vlan_vid, pkt))
+        ofmsgs.extend(self.host_manager.learn_barrier())
+        return ofmsgs
+
+    def barrier_reply(self, dp_id, xid):
+        """Handle a barrier reply from the datapath.
+
+        Args:
+            dp_id (int): datapath ID.
+            xid (int): transaction ID of barrier reply.
+        """
+        if not self._ignore_dpid(dp_id):
+            self.host_manager.barrier_reply(xid)
+
     def host_expire(self):
         """Expire hosts not recently re/learned.
 
@@ -1181,6 +1672,17 @@ class Valve(object):
                     changed_acls[acl_id] = new_acl
                     self.dpid_log('ACL %s changed' % acl_id)
 
+        if new_dp.port_acl_metadata or self.dp.port_acl_metadata:
+            # Shared port ACL rules are not per port, and enabling them
+            # renumbers tables, so reprovision everything.
+            new_acl_ids = new_dp.port_acl_metadata_ids()
+            if (new_dp.port_acl_metadata != self.dp.port_acl_metadata or
+                    new_acl_ids != self.dp.port_acl_metadata_ids() or
+                    set(changed_acls).intersection(new_acl_ids)):
+                self.dpid_log('port ACLs shared via metadata changed')
+                return (
+                    set([]), set(new_dp.ports.keys()), set([]), set([]), True)
+
         changed_ports = set([])
         for port_no, new_port in list(new_dp.ports.items()):
             if port_no not in self.dp.ports:
@@ -1265,6 +1767,7 @@ class Valve(object):
 
         if all_ports_changed:
             self.dp = new_dp
+            self._dp_init()
             ofmsgs.extend(self.datapath_connect(self.dp.dp_id, changed_ports))
         else:
             cold_start = False
@@ -1356,6 +1859,52 @@ class Valve(object):
                 ofmsgs.extend(route_manager.resolve_gateways(vlan, now))
         return ofmsgs
 
+    def get_warm_state(self):
+        """Return learned state to be restored after a controller restart.
+
+        Returns:
+            dict: learned hosts, resolved neighbors and nexthop group IDs.
+        """
+        hosts = []
+        neighbors = []
+        for vlan in list(self.dp.vlans.values()):
+            for eth_src, host_cache_entry in list(vlan.host_cache.items()):
+                hosts.append([
+                    vlan.vid, eth_src, host_cache_entry.port_num,
+                    host_cache_entry.cache_time])
+            for ipv in vlan.ipvs():
+                for ip_gw, nexthop in list(vlan.neigh_cache_by_ipv(ipv).items()):
+                    if nexthop.eth_src is not None:
+                        neighbors.append([
+                            vlan.vid, str(ip_gw), nexthop.eth_src,
+                            nexthop.cache_time])
+        groups = []
+        for route_manager in list(self.route_manager_by_ipv.values()):
+            for ip_gw, group_id in list(route_manager.ip_gw_to_group_id.items()):
+                groups.append([str(ip_gw), group_id])
+        return {
+            'hosts': hosts,
+            'neighbors': neighbors,
+            'groups': groups,
+            }
+
+    def set_warm_state(self, state):
+        """Restore learned state saved by get_warm_state().
+
+        Nexthop group IDs are restored immediately, so that groups already
+        on the datapath keep their IDs. Hosts and neighbors are reprovisioned
+        when the datapath next connects.
+
+        Args:
+            state (dict): learned state from get_warm_state().
+        """
+        for ip_gw, group_id in state.get('groups', []):
+            ip_gw = ipaddress.ip_address(ip_gw)
+            if ip_gw.version in self.route_manager_by_ipv:
+                route_manager = self.route_manager_by_ipv[ip_gw.version]
+                route_manager.ip_gw_to_group_id[ip_gw] = group_id
+        self._warm_state = state
+
     def get_config_dict(self):
         """Render configuration as a dict, suitable for returning via API call.
 
@@ -17,6 +17,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from ryu.ofproto import ofproto_v1_3 as ofp
+
 try:
     import valve_of
 except ImportError:
@@ -41,7 +43,8 @@ def rewrite_vlan(output_dict):
 
 # TODO: change this, maybe this can be rewritten easily
 # possibly replace with a class for ACLs
-def build_acl_entry(rule_conf, acl_allow_inst, port_num=None, vlan_vid=None):
+def build_acl_entry(rule_conf, acl_allow_inst, port_num=None, vlan_vid=None,
+                    metadata=None):
     acl_inst = []
     match_dict = {}
     for attrib, attrib_value in list(rule_conf.items()):
@@ -95,5 +98,132 @@ def build_acl_entry(rule_conf, acl_allow_inst, port_num=None, vlan_vid=None):
         match_dict['in_port'] = port_num
     if vlan_vid is not None:
         match_dict['vlan_vid'] = valve_of.vid_present(vlan_vid)
+    if metadata is not None:
+        match_dict['metadata'] = metadata
     acl_match = valve_of.match_from_dict(match_dict)
     return acl_match, acl_inst
+
+
+# OXM fields that can carry an arbitrary bitmask, and so can be merged.
+MASKABLE_FIELDS = frozenset([
+    'eth_src', 'eth_dst', 'ipv4_src', 'ipv4_dst', 'ipv6_src', 'ipv6_dst',
+    'arp_spa', 'arp_tpa', 'metadata'])
+
+
+def _match_fields(acl_match):
+    """Return dict of OXM field name to (value, mask, width, OXM type)."""
+    fields = {}
+    for field, user_value in list(acl_match.items()):
+        oxm_type, value, mask = ofp.oxm_from_user(field, user_value)
+        width = len(value) * 8
+        value = int.from_bytes(value, 'big')
+        if mask is None:
+            mask = (1 << width) - 1
+        else:
+            mask = int.from_bytes(mask, 'big')
+        fields[field] = (value & mask, mask, width, oxm_type)
+    return fields
+
+
+def _fields_to_match(fields):
+    """Return an OFPMatch from a dict returned by _match_fields()."""
+    match_fields = {}
+    for field, (value, mask, width, oxm_type) in list(fields.items()):
+        mask_bytes = None
+        if mask != (1 << width) - 1:
+            mask_bytes = mask.to_bytes(width // 8, 'big')
+        _, user_value = ofp.oxm_to_user(
+            oxm_type, value.to_bytes(width // 8, 'big'), mask_bytes)
+        match_fields[field] = user_value
+    return valve_of.match(match_fields)
+
+
+def _fields_cover(outer, inner):
+    """Return True if every packet matching inner also matches outer."""
+    for field, (value, mask, _, _) in list(outer.items()):
+        if field not in inner:
+            return False
+        inner_value, inner_mask, _, _ = inner[field]
+        if inner_mask & mask != mask:
+            return False
+        if inner_value & mask != value:
+            return False
+    return True
+
+
+def _merge_fields(first, second):
+    """Return fields matching exactly the union of first and second, or None.
+
+    The union is expressible when one rule covers the other, or when the
+    rules differ only in a single bit of one maskable field.
+    """
+    if _fields_cover(first, second):
+        return first
+    if _fields_cover(second, first):
+        return second
+    if set(first.keys()) != set(second.keys()):
+        return None
+    diff_field = None
+    for field in first:
+        if first[field] != second[field]:
+            if diff_field is not None:
+                return None
+            diff_field = field
+    if diff_field not in MASKABLE_FIELDS:
+        return None
+    value, mask, width, oxm_type = first[diff_field]
+    other_value, other_mask, _, _ = second[diff_field]
+    if mask != other_mask:
+        return None
+    diff_bits = value ^ other_value
+    if diff_bits & (diff_bits - 1):
+        return None
+    merged = dict(first)
+    mask &= ~diff_bits
+    if mask:
+        merged[diff_field] = (value & mask, mask, width, oxm_type)
+    else:
+        del merged[diff_field]
+    return merged
+
+
+def _inst_key(acl_inst):
+    return [str(inst) for inst in acl_inst]
+
+
+def compress_acl_entries(acl_entries):
+    """Remove shadowed ACL entries, and merge adjacent entries where possible.
+
+    An entry is shadowed if a higher priority entry matches every packet it
+    could match, so it can never be hit. Adjacent entries with identical
+    instructions are merged if a single (possibly masked) match can express
+    their union exactly.
+
+    Args:
+        acl_entries (list): (match, instructions) tuples, in priority order.
+    Returns:
+        list: (match, instructions) tuples, in priority order.
+    """
+    entries = [
+        (_match_fields(acl_match), acl_inst)
+        for acl_match, acl_inst in acl_entries]
+    changed = True
+    while changed:
+        changed = False
+        unshadowed = []
+        for fields, acl_inst in entries:
+            if [prev for prev, _ in unshadowed if _fields_cover(prev, fields)]:
+                changed = True
+                continue
+            unshadowed.append((fields, acl_inst))
+        entries = []
+        for fields, acl_inst in unshadowed:
+            if entries and _inst_key(entries[-1][1]) == _inst_key(acl_inst):
+                merged = _merge_fields(entries[-1][0], fields)
+                if merged is not None:
+                    entries[-1] = (merged, acl_inst)
+                    changed = True
+                    continue
+            entries.append((fields, acl_inst))
+    return [
+        (_fields_to_match(fields), acl_inst) for fields, acl_inst in entries]
@@ -43,13 +43,14 @@ class ValveFloodManager(object):
     def __init__(self, flood_table, flood_priority,
                  valve_in_match, valve_flowmod,
                  dp_stack, dp_ports, dp_shortest_path_to_root,
-                 use_group_table):
+                 use_group_table, use_multi_out):
         self.flood_table = flood_table
         self.flood_priority = flood_priority
         self.valve_in_match = valve_in_match
         self.valve_flowmod = valve_flowmod
         self.stack = dp_stack
         self.use_group_table = use_group_table
+        self.use_multi_out = use_multi_out
         self.stack_ports = [
             port for port in list(dp_ports.values()) if port.stack is not None]
         self.towards_root_stack_ports = []
@@ -286,9 +287,52 @@ class ValveFloodManager(object):
         command = ofp.OFPFC_ADD
         if modify:
             command = ofp.OFPFC_MODIFY_STRICT
+        if self._vlan_uses_group_table(vlan):
+            return self._build_group_flood_rules(vlan, modify, command)
+        return self._build_multiout_flood_rules(vlan, command)
+
+    def _vlan_uses_group_table(self, vlan):
+        """Return True if flooding on this VLAN is done with groups."""
         if self.use_group_table:
             hairpin_ports = [port for port in vlan.get_ports() if port.hairpin]
             # TODO: group tables for stacking and hairpin flooding modes.
             if self.stack is None and not hairpin_ports:
-                return self._build_group_flood_rules(vlan, modify, command)
-        return self._build_multiout_flood_rules(vlan, command)
+                return True
+        return False
+
+    def build_flood_pkt(self, vlan, packet_builder, *args):
+        """Return packet outs to flood a controller generated packet on a VLAN.
+
+        If the VLAN floods with groups, a single packet out is sent via the
+        VLAN's broadcast flood group. Otherwise with multi_out, a single
+        packet out outputs to all tagged and then all untagged ports.
+        Otherwise, one packet out is sent per port.
+
+        Args:
+            vlan (VLAN): VLAN to flood on.
+            packet_builder (function): called with vid and args, to build packet.
+        Returns:
+            list: OpenFlow packet outs.
+        """
+        if self._vlan_uses_group_table(vlan):
+            pkt = packet_builder(vlan.vid, *args)
+            return [valve_of.packetout_actions(
+                [valve_of.group_act(vlan.vid)], pkt.data)]
+        if self.use_multi_out:
+            tagged_ports = vlan.tagged_flood_ports(False)
+            untagged_ports = vlan.untagged_flood_ports(False)
+            flood_acts = []
+            if tagged_ports:
+                pkt = packet_builder(vlan.vid, *args)
+                flood_acts.extend(
+                    [valve_of.output_port(port.number) for port in tagged_ports])
+                if untagged_ports:
+                    flood_acts.append(valve_of.pop_vlan())
+            elif untagged_ports:
+                pkt = packet_builder(None, *args)
+            else:
+                return []
+            flood_acts.extend(
+                [valve_of.output_port(port.number) for port in untagged_ports])
+            return [valve_of.packetout_actions(flood_acts, pkt.data)]
+        return vlan.flood_pkt(packet_builder, *args)
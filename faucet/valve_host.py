@@ -17,6 +17,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import time
 import random
 
@@ -38,8 +39,13 @@ class HostCacheEntry(object):
 
 class ValveHostManager(object):
 
+    # Forget a pending learn after this many seconds, even if its barrier
+    # was never acknowledged (eg. the datapath disconnected).
+    PENDING_LEARN_TIMEOUT = 10
+
     def __init__(self, logger, eth_src_table, eth_dst_table,
-                 learn_timeout, learn_jitter, learn_ban_timeout, low_priority, host_priority,
+                 learn_timeout, learn_jitter, learn_ban_timeout, learn_hold_down,
+                 low_priority, host_priority,
                  valve_in_match, valve_flowmod, valve_flowdel, valve_flowdrop):
         self.logger = logger
         self.eth_src_table = eth_src_table
@@ -47,12 +53,25 @@ class ValveHostManager(object):
         self.learn_timeout = learn_timeout
         self.learn_jitter = learn_jitter
         self.learn_ban_timeout = learn_ban_timeout
+        self.learn_hold_down = learn_hold_down
         self.low_priority = low_priority
         self.host_priority = host_priority
         self.valve_in_match = valve_in_match
         self.valve_flowmod = valve_flowmod
         self.valve_flowdel = valve_flowdel
         self.valve_flowdrop = valve_flowdrop
+        # Learns whose flows may not yet be on the datapath, as
+        # (port number, time learned) by (vid, eth_src).
+        self.pending_learns = {}
+        # Pending learns sent since the last barrier.
+        self.unbarriered_learns = []
+        # (barrier, time sent, pending learns) for each barrier not yet
+        # acknowledged.
+        self.learn_barriers = collections.deque()
+        self.learns_suppressed_by_vid = collections.defaultdict(int)
+        # Recent times each host moved between ports, by (vid, eth_src).
+        self.host_moves = {}
+        self.host_flaps_by_vid = collections.defaultdict(int)
 
     def temp_ban_host_learning_on_port(self, port):
         return self.valve_flowdrop(
@@ -107,15 +126,77 @@ class ValveHostManager(object):
                 host_cache_entry_age = now - host_cache_entry.cache_time
                 if host_cache_entry_age > self.learn_timeout:
                     expired_hosts.append(eth_src)
+        for pending_key, (_, pending_time) in list(self.pending_learns.items()):
+            if (pending_key[0] == vlan.vid and
+                    now - pending_time > self.PENDING_LEARN_TIMEOUT):
+                del self.pending_learns[pending_key]
         if expired_hosts:
             for eth_src in expired_hosts:
                 del vlan.host_cache[eth_src]
+                self.host_moves.pop((vlan.vid, eth_src), None)
                 self.logger.info(
                     'expiring host %s from vlan %u', eth_src, vlan.vid)
             self.logger.info(
                 '%u recently active hosts on vlan %u',
                 self.hosts_learned_on_vlan_count(vlan), vlan.vid)
 
+    def host_moved(self, vlan, eth_src, now, window, max_moves):
+        """Record a host moving between ports.
+
+        Args:
+            vlan (vlan): VLAN the host moved on.
+            eth_src (str): MAC address of the host.
+            now (float): time of move.
+            window (int): seconds over which to count moves.
+            max_moves (int): most moves that need be counted.
+        Returns:
+            int: number of moves of this host within the window.
+        """
+        moves_key = (vlan.vid, eth_src)
+        if moves_key not in self.host_moves:
+            self.host_moves[moves_key] = collections.deque(maxlen=max_moves)
+        moves = self.host_moves[moves_key]
+        moves.append(now)
+        while moves and now - moves[0] > window:
+            moves.popleft()
+        return len(moves)
+
+    def learn_barrier(self):
+        """Return a barrier to confirm flows for pending learns are installed.
+
+        Returns:
+            list: barrier request if there are pending learns since the last.
+        """
+        if not self.unbarriered_learns:
+            return []
+        now = time.time()
+        # Forget barriers whose pending learns have timed out anyway.
+        while (self.learn_barriers and
+               now - self.learn_barriers[0][1] > self.PENDING_LEARN_TIMEOUT):
+            self.learn_barriers.popleft()
+        barrier = valve_of.barrier()
+        self.learn_barriers.append((barrier, now, self.unbarriered_learns))
+        self.unbarriered_learns = []
+        return [barrier]
+
+    def barrier_reply(self, xid):
+        """Clear pending learns confirmed by a barrier reply.
+
+        A reply to a barrier also confirms all barriers sent before it.
+
+        Args:
+            xid (int): transaction ID of barrier reply.
+        """
+        for i, (barrier, _, _) in enumerate(self.learn_barriers):
+            if barrier.xid == xid:
+                for _ in range(i + 1):
+                    _, _, pending_learns = self.learn_barriers.popleft()
+                    for pending_key, pending_learn in pending_learns:
+                        # Only clear if not since relearned.
+                        if self.pending_learns.get(pending_key) == pending_learn:
+                            del self.pending_learns[pending_key]
+                return
+
     def hosts_learned_on_vlan_count(self, vlan):
         return len(vlan.host_cache)
 
@@ -124,14 +205,19 @@ class ValveHostManager(object):
         in_port = port.number
         ofmsgs = []
 
-        # Don't relearn same host on same port if recently learned.
-        # TODO: this is a good place to detect and react to a loop,
-        # if we detect a host moving rapidly between ports.
+        # Don't relearn same host on same port if the flows from learning
+        # it may still be in flight, or if recently learned.
+        pending_key = (vlan.vid, eth_src)
         if eth_src in vlan.host_cache:
             host_cache_entry = vlan.host_cache[eth_src]
             if host_cache_entry.port_num == in_port:
                 cache_age = now - host_cache_entry.cache_time
-                if cache_age < 2:
+                pending = (
+                    self.pending_learns.get(pending_key) ==
+                    (in_port, host_cache_entry.cache_time) and
+                    cache_age < self.PENDING_LEARN_TIMEOUT)
+                if pending or cache_age < self.learn_hold_down:
+                    self.learns_suppressed_by_vid[vlan.vid] += 1
                     return ofmsgs
 
         # hosts learned on this port never relearned
@@ -194,6 +280,9 @@ class ValveHostManager(object):
             port.permanent_learn,
             now)
         vlan.host_cache[eth_src] = host_cache_entry
+        pending_learn = (in_port, now)
+        self.pending_learns[pending_key] = pending_learn
+        self.unbarriered_learns.append((pending_key, pending_learn))
 
         self.logger.info(
             'learned %u hosts on vlan %u',
@@ -28,6 +28,8 @@ from ryu.ofproto import ofproto_v1_3_parser as parser
 
 VLAN_GROUP_OFFSET = 4096
 ROUTE_GROUP_OFFSET = VLAN_GROUP_OFFSET * 2
+CONTROL_PLANE_METER_ID = 1
+ROUTE_MISS_METER_ID = 2
 OFP_VERSIONS = [ofp.OFP_VERSION]
 OFP_IN_PORT = ofp.OFPP_IN_PORT
 
@@ -81,6 +83,17 @@ def is_flowdel(ofmsg):
     return False
 
 
+def is_barrier(ofmsg):
+    """Return True if OF message is a barrier request.
+
+    Args:
+        ofmsg: ryu.ofproto.ofproto_v1_3_parser message.
+    Returns:
+        bool: True if is a BarrierRequest
+    """
+    return isinstance(ofmsg, parser.OFPBarrierRequest)
+
+
 def is_groupdel(ofmsg):
     """Return True if OF message is a GroupMod and command is delete.
 
@@ -131,6 +144,18 @@ def goto_table(table_id):
     return parser.OFPInstructionGotoTable(table_id)
 
 
+def write_metadata(metadata, metadata_mask=0xffffffffffffffff):
+    """Return instruction to write metadata.
+
+    Args:
+        metadata (int): metadata value to write.
+        metadata_mask (int): bits of metadata to write.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPInstruction: write metadata instruction.
+    """
+    return parser.OFPInstructionWriteMetadata(metadata, metadata_mask)
+
+
 def set_eth_src(eth_src):
     """Return action to set source Ethernet MAC address.
 
@@ -248,11 +273,23 @@ def packetout(port_num, data):
     Returns:
         ryu.ofproto.ofproto_v1_3_parser.OFPActionOutput: packet out action.
     """
+    return packetout_actions([output_port(port_num)], data)
+
+
+def packetout_actions(actions, data):
+    """Return OpenFlow packet out applying a list of actions.
+
+    Args:
+        actions (list): OpenFlow actions (e.g. several outputs, or a group).
+        data (str): raw packet to output.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPPacketOut: packet out.
+    """
     return parser.OFPPacketOut(
         datapath=None,
         buffer_id=ofp.OFP_NO_BUFFER,
         in_port=ofp.OFPP_CONTROLLER,
-        actions=[output_port(port_num)],
+        actions=actions,
         data=data)
 
 
@@ -265,6 +302,71 @@ def barrier():
     return parser.OFPBarrierRequest(None)
 
 
+def flowstats_request(cookie=0, cookie_mask=0):
+    """Return OpenFlow request for all flows, optionally filtered by cookie.
+
+    Args:
+        cookie (int): cookie flows must have.
+        cookie_mask (int): bits of cookie that must match.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPFlowStatsRequest: flow stats request.
+    """
+    return parser.OFPFlowStatsRequest(
+        datapath=None,
+        table_id=ofp.OFPTT_ALL,
+        out_port=ofp.OFPP_ANY,
+        out_group=ofp.OFPG_ANY,
+        cookie=cookie,
+        cookie_mask=cookie_mask)
+
+
+def groupdesc_request():
+    """Return OpenFlow request for all group descriptions.
+
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPGroupDescStatsRequest: group desc request.
+    """
+    return parser.OFPGroupDescStatsRequest(None)
+
+
+def _ofjson_key(ofjson):
+    """Return a hashable version of an OpenFlow JSON dict, ignoring lengths."""
+    if isinstance(ofjson, dict):
+        return tuple(sorted(
+            (key, _ofjson_key(value)) for key, value in list(ofjson.items())
+            if key not in ('len', 'length')))
+    if isinstance(ofjson, list):
+        return tuple(_ofjson_key(value) for value in ofjson)
+    return ofjson
+
+
+def flow_key(flow):
+    """Return a key identifying a flow by table, priority, match and instructions.
+
+    Args:
+        flow: flow mod or flow stats (anything with table_id, priority, match
+            and instructions).
+    Returns:
+        tuple: key, equal for flows that would behave the same.
+    """
+    match_key = tuple(sorted(
+        (field, str(value)) for field, value in list(flow.match.items())))
+    inst_key = _ofjson_key([inst.to_jsondict() for inst in flow.instructions])
+    return (flow.table_id, flow.priority, match_key, inst_key)
+
+
+def group_key(group):
+    """Return a key identifying a group by type and buckets.
+
+    Args:
+        group: group mod or group desc stats.
+    Returns:
+        tuple: key, equal for groups that would behave the same.
+    """
+    return (group.type, _ofjson_key(
+        [bucket_.to_jsondict() for bucket_ in group.buckets]))
+
+
 def table_features(body):
     return parser.OFPTableFeaturesStatsRequest(
         datapath=None, body=body)
@@ -393,18 +495,63 @@ def groupdel(datapath=None, group_id=ofp.OFPG_ALL):
         group_id)
 
 
-def controller_pps_meteradd(datapath=None, pps=0):
+def pps_meteradd(meter_id, pps, datapath=None):
+    """Return OpenFlow message to add a meter dropping packets above a rate.
+
+    Args:
+        meter_id (int): meter ID.
+        pps (int): max packets per second.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPMeterMod: meter add.
+    """
     return parser.OFPMeterMod(
         datapath=datapath,
         command=ofp.OFPMC_ADD,
         flags=ofp.OFPMF_PKTPS,
-        meter_id=ofp.OFPM_CONTROLLER,
+        meter_id=meter_id,
         bands=[parser.OFPMeterBandDrop(rate=pps)])
 
 
-def controller_pps_meterdel(datapath=None):
+def pps_meterdel(meter_id, datapath=None):
+    """Return OpenFlow message to delete a meter.
+
+    Args:
+        meter_id (int): meter ID.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPMeterMod: meter delete.
+    """
     return parser.OFPMeterMod(
         datapath=datapath,
         command=ofp.OFPMC_DELETE,
         flags=ofp.OFPMF_PKTPS,
-        meter_id=ofp.OFPM_CONTROLLER)
+        meter_id=meter_id)
+
+
+def apply_meter(meter_id):
+    """Return instruction to apply a meter.
+
+    Args:
+        meter_id (int): meter ID.
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPInstructionMeter: meter instruction.
+    """
+    return parser.OFPInstructionMeter(meter_id, ofp.OFPIT_METER)
+
+
+def meterstats_request(meter_id=ofp.OFPM_ALL):
+    """Return OpenFlow request for meter statistics.
+
+    Args:
+        meter_id (int): meter ID (default all meters).
+    Returns:
+        ryu.ofproto.ofproto_v1_3_parser.OFPMeterStatsRequest: meter stats request.
+    """
+    return parser.OFPMeterStatsRequest(None, 0, meter_id)
+
+
+def controller_pps_meteradd(datapath=None, pps=0):
+    return pps_meteradd(ofp.OFPM_CONTROLLER, pps, datapath=datapath)
+
+
+def controller_pps_meterdel(datapath=None):
+    return pps_meterdel(ofp.OFPM_CONTROLLER, datapath=datapath)
@@ -17,10 +17,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import namedtuple
+import functools
 import ipaddress
+import struct
 
-from ryu.lib import mac
+from ryu.lib import addrconv, mac
 from ryu.lib.packet import arp, ethernet, icmp, icmpv6, ipv4, ipv6, stream_parser, packet, vlan
+from ryu.lib.packet import packet_utils
 from ryu.ofproto import ether
 from ryu.ofproto import inet
 
@@ -35,6 +39,25 @@ IPV6_ALL_ROUTERS_MCAST = '33:33:00:00:00:02'
 IPV6_LINK_LOCAL = ipaddress.IPv6Network(btos('fe80::/10'))
 IPV6_ALL_NODES = ipaddress.IPv6Address(btos('ff02::1'))
 
+ETH_HEADER_LEN = 14
+ETH_VLAN_HEADER_LEN = 18
+ARP_TPA_OFFSET = 24
+IPV6_DST_OFFSET = 24
+IPV6_HEADER_LEN = 40
+ETH_HEADER = struct.Struct('!6s6sH')
+VLAN_HEADER = struct.Struct('!HH')
+MAC_TEXT_FORMAT = ':'.join(['%02x'] * 6)
+ICMPV6_CHECKSUM_OFFSET = 2
+ND_TARGET_OFFSET = 8
+IPV6_SOLICITED_NODE_PREFIX = ipaddress.ip_interface(
+    btos('ff02::1:ff00:0/104')).packed[:13]
+IPV6_SOLICITED_NODE_ETH_PREFIX = b'\x33\x33\xff'
+# Max number of (vid, eth_src, src_ip, ...) packet templates to cache.
+PACKET_TEMPLATE_CACHE_SIZE = 1024
+
+# A pre-serialized packet, compatible with a serialized ryu packet.Packet.
+SerializedPacket = namedtuple('SerializedPacket', ('data',))
+
 
 def mac_addr_is_unicast(mac_addr):
     """Returns True if mac_addr is a unicast Ethernet address.
@@ -59,25 +82,87 @@ def parse_pkt(pkt):
     return pkt.get_protocol(ethernet.ethernet)
 
 
+def parse_eth_type(pkt):
+    """Return EtherType of a packet's payload (inside any VLAN header).
+
+    Args:
+        pkt (ryu.lib.packet.packet or LazyPacket): packet received from dataplane.
+    Returns:
+        int: EtherType.
+    """
+    vlan_pkt = pkt.get_protocol(vlan.vlan)
+    if vlan_pkt is not None:
+        return vlan_pkt.ethertype
+    return pkt.get_protocol(ethernet.ethernet).ethertype
+
+
+class LazyPacket(object):
+    """A received packet, with only the Ethernet/802.1Q header decoded.
+
+    Remaining protocol layers are parsed, once, only if requested via
+    get_protocol() or get_protocols(). Provides the subset of the
+    ryu.lib.packet.packet.Packet API that FAUCET uses.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._pkt = None
+        eth_dst, eth_src, eth_type = ETH_HEADER.unpack_from(data)
+        self.eth_pkt = ethernet.ethernet(
+            dst=MAC_TEXT_FORMAT % tuple(eth_dst),
+            src=MAC_TEXT_FORMAT % tuple(eth_src),
+            ethertype=eth_type)
+        self.vlan_pkt = None
+        if eth_type == ether.ETH_TYPE_8021Q:
+            tci, eth_type = VLAN_HEADER.unpack_from(data, ETH_HEADER_LEN)
+            self.vlan_pkt = vlan.vlan(
+                pcp=tci >> 13, cfi=(tci >> 12) & 1, vid=tci & 0xfff,
+                ethertype=eth_type)
+
+    def _parse(self):
+        if self._pkt is None:
+            try:
+                self._pkt = packet.Packet(self.data)
+            except stream_parser.StreamParser.TooSmallException:
+                self._pkt = packet.Packet()
+        return self._pkt
+
+    def get_protocols(self, protocol):
+        if protocol == ethernet.ethernet:
+            return [self.eth_pkt]
+        return self._parse().get_protocols(protocol)
+
+    def get_protocol(self, protocol):
+        if protocol == ethernet.ethernet:
+            return self.eth_pkt
+        if protocol == vlan.vlan:
+            return self.vlan_pkt
+        return self._parse().get_protocol(protocol)
+
+
 def parse_packet_in_pkt(msg):
+    """Parse the Ethernet/802.1Q header of a packet in.
+
+    Args:
+        msg (ryu.ofproto.ofproto_v1_3_parser.OFPPacketIn): packet in.
+    Returns:
+        tuple: LazyPacket (or None if too short) and VLAN VID (or None).
+    """
     pkt = None
     vlan_vid = None
 
     try:
-        pkt = packet.Packet(msg.data)
-    except stream_parser.StreamParser.TooSmallException:
+        pkt = LazyPacket(msg.data)
+    except struct.error:
         return (pkt, vlan_vid)
 
-    eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
-    eth_type = eth_pkt.ethertype
     # Packet ins, can only come when a VLAN header has already been pushed
     # (ie. when we have progressed past the VLAN table). This gaurantees
     # a VLAN header will always be present, so we know which VLAN the packet
     # belongs to.
-    if eth_type == ether.ETH_TYPE_8021Q:
+    if pkt.vlan_pkt is not None:
         # tagged packet
-        vlan_proto = pkt.get_protocols(vlan.vlan)[0]
-        vlan_vid = vlan_proto.vid
+        vlan_vid = pkt.vlan_pkt.vid
     return (pkt, vlan_vid)
 
 
@@ -106,7 +191,7 @@ def build_pkt_header(vid, eth_src, eth_dst, dl_type):
     return pkt_header
 
 
-def arp_request(vid, eth_src, src_ip, dst_ip):
+def _arp_request_pkt(vid, eth_src, src_ip, dst_ip):
     """Return an ARP request packet.
 
     Args:
@@ -208,7 +293,7 @@ def ipv6_solicited_node_from_ucast(ucast):
     return link_mcast
 
 
-def nd_request(vid, eth_src, src_ip, dst_ip):
+def _nd_request_pkt(vid, eth_src, src_ip, dst_ip):
     """Return IPv6 neighbor discovery request packet.
 
     Args:
@@ -235,7 +320,7 @@ def nd_request(vid, eth_src, src_ip, dst_ip):
     return pkt
 
 
-def nd_advert(vid, eth_src, eth_dst, src_ip, dst_ip, hop_limit):
+def _nd_advert_pkt(vid, eth_src, eth_dst, src_ip, dst_ip, hop_limit):
     """Return IPv6 neighbor avertisement packet.
 
     Args:
@@ -299,7 +384,7 @@ def icmpv6_echo_reply(vid, eth_src, eth_dst, src_ip, dst_ip, hop_limit,
     return pkt
 
 
-def router_advert(vid, eth_src, eth_dst, src_ip, dst_ip,
+def _router_advert_pkt(vid, eth_src, eth_dst, src_ip, dst_ip,
                   vips, hop_limit=255, pi_flags=0x6):
     """Return IPv6 ICMP echo reply packet.
 
@@ -343,3 +428,171 @@ def router_advert(vid, eth_src, eth_dst, src_ip, dst_ip,
     pkt.add_protocol(icmpv6_ra_pkt)
     pkt.serialize()
     return pkt
+
+
+def _l3_offset(vid):
+    """Return offset of the Ethernet payload for a VLAN (or None)."""
+    if vid is None:
+        return ETH_HEADER_LEN
+    return ETH_VLAN_HEADER_LEN
+
+
+def _ipv4(ipa):
+    """Return an ipaddress.IPv4Address from an IPv4 address or string."""
+    if isinstance(ipa, ipaddress.IPv4Address):
+        return ipa
+    return ipaddress.IPv4Address(btos(str(ipa)))
+
+
+def _ipv6(ipa):
+    """Return an ipaddress.IPv6Address from an IPv6 address or string."""
+    if isinstance(ipa, ipaddress.IPv6Address):
+        return ipa
+    return ipaddress.IPv6Address(btos(str(ipa)))
+
+
+def _patch_icmpv6(pkt_data, l3_offset, eth_dst, dst_ip):
+    """Patch Ethernet and IPv6 destination of an ICMPv6 packet template.
+
+    Args:
+        pkt_data (bytearray): copy of a packet template.
+        l3_offset (int): offset of IPv6 header.
+        eth_dst (bytes): destination Ethernet MAC address.
+        dst_ip (bytes): destination IPv6 address.
+    Returns:
+        bytes: packet with destination addresses and ICMPv6 checksum set.
+    """
+    ip_dst = l3_offset + IPV6_DST_OFFSET
+    icmpv6_offset = l3_offset + IPV6_HEADER_LEN
+    icmpv6_checksum = icmpv6_offset + ICMPV6_CHECKSUM_OFFSET
+    pkt_data[0:6] = eth_dst
+    pkt_data[ip_dst:ip_dst + 16] = dst_ip
+    pkt_data[icmpv6_checksum:icmpv6_checksum + 2] = b'\x00\x00'
+    icmpv6_data = pkt_data[icmpv6_offset:]
+    pseudo_header = (
+        bytes(pkt_data[l3_offset + 8:ip_dst + 16]) +
+        struct.pack('!I3xB', len(icmpv6_data), inet.IPPROTO_ICMPV6))
+    struct.pack_into(
+        '!H', pkt_data, icmpv6_checksum,
+        packet_utils.checksum(pseudo_header + bytes(icmpv6_data)))
+    return bytes(pkt_data)
+
+
+@functools.lru_cache(maxsize=PACKET_TEMPLATE_CACHE_SIZE)
+def _arp_request_template(vid, eth_src, src_ip):
+    return bytes(_arp_request_pkt(
+        vid, eth_src, src_ip, ipaddress.IPv4Address(0)).data)
+
+
+@functools.lru_cache(maxsize=PACKET_TEMPLATE_CACHE_SIZE)
+def _nd_request_template(vid, eth_src, src_ip):
+    return bytes(_nd_request_pkt(
+        vid, eth_src, src_ip, ipaddress.IPv6Address(0)).data)
+
+
+@functools.lru_cache(maxsize=PACKET_TEMPLATE_CACHE_SIZE)
+def _nd_advert_template(vid, eth_src, src_ip, hop_limit):
+    return bytes(_nd_advert_pkt(
+        vid, eth_src, mac.DONTCARE_STR, src_ip, ipaddress.IPv6Address(0),
+        hop_limit).data)
+
+
+@functools.lru_cache(maxsize=PACKET_TEMPLATE_CACHE_SIZE)
+def _router_advert_template(vid, eth_src, src_ip, vips, hop_limit, pi_flags):
+    return bytes(_router_advert_pkt(
+        vid, eth_src, mac.DONTCARE_STR, src_ip, ipaddress.IPv6Address(0),
+        vips, hop_limit, pi_flags).data)
+
+
+def arp_request(vid, eth_src, src_ip, dst_ip):
+    """Return an ARP request packet.
+
+    The packet is built from a cached template per (vid, eth_src, src_ip),
+    with only the requested address patched in.
+
+    Args:
+        vid (int or None): VLAN VID to use (or None).
+        eth_src (str): Ethernet source address.
+        src_ip (ipaddress.IPv4Address): source IPv4 address.
+        dst_ip (ipaddress.IPv4Address): requested IPv4 address.
+    Returns:
+        SerializedPacket: serialized ARP request packet.
+    """
+    pkt_data = bytearray(_arp_request_template(vid, eth_src, _ipv4(src_ip)))
+    arp_tpa = _l3_offset(vid) + ARP_TPA_OFFSET
+    pkt_data[arp_tpa:arp_tpa + 4] = _ipv4(dst_ip).packed
+    return SerializedPacket(bytes(pkt_data))
+
+
+def nd_request(vid, eth_src, src_ip, dst_ip):
+    """Return IPv6 neighbor discovery request packet.
+
+    The packet is built from a cached template per (vid, eth_src, src_ip),
+    with only the requested address patched in.
+
+    Args:
+        vid (int or None): VLAN VID to use (or None).
+        eth_src (str): source Ethernet MAC address.
+        src_ip (ipaddress.IPv6Address): source IPv6 address.
+        dst_ip (ipaddress.IPv6Address): requested IPv6 address.
+    Returns:
+        SerializedPacket: Serialized IPv6 neighbor discovery packet.
+    """
+    dst_ip_packed = _ipv6(dst_ip).packed
+    pkt_data = bytearray(_nd_request_template(vid, eth_src, _ipv6(src_ip)))
+    l3_offset = _l3_offset(vid)
+    nd_target = l3_offset + IPV6_HEADER_LEN + ND_TARGET_OFFSET
+    pkt_data[nd_target:nd_target + 16] = dst_ip_packed
+    return SerializedPacket(_patch_icmpv6(
+        pkt_data, l3_offset,
+        IPV6_SOLICITED_NODE_ETH_PREFIX + dst_ip_packed[-3:],
+        IPV6_SOLICITED_NODE_PREFIX + dst_ip_packed[-3:]))
+
+
+def nd_advert(vid, eth_src, eth_dst, src_ip, dst_ip, hop_limit):
+    """Return IPv6 neighbor avertisement packet.
+
+    The packet is built from a cached template per (vid, eth_src, src_ip,
+    hop_limit), with only the destination patched in.
+
+    Args:
+        vid (int or None): VLAN VID to use (or None).
+        eth_src (str): source Ethernet MAC address.
+        eth_dst (str): destination Ethernet MAC address.
+        src_ip (ipaddress.IPv6Address): source IPv6 address.
+        dst_ip (ipaddress.IPv6Address): destination IPv6 address.
+        hop_limit (int): IPv6 hop limit.
+    Returns:
+        SerializedPacket: Serialized IPv6 neighbor discovery packet.
+    """
+    pkt_data = bytearray(_nd_advert_template(
+        vid, eth_src, _ipv6(src_ip), hop_limit))
+    return SerializedPacket(_patch_icmpv6(
+        pkt_data, _l3_offset(vid), addrconv.mac.text_to_bin(eth_dst),
+        _ipv6(dst_ip).packed))
+
+
+def router_advert(vid, eth_src, eth_dst, src_ip, dst_ip,
+                  vips, hop_limit=255, pi_flags=0x6):
+    """Return IPv6 ICMP router advertisement packet.
+
+    The packet is built from a cached template per (vid, eth_src, src_ip,
+    vips, hop_limit, pi_flags), with only the destination patched in.
+
+    Args:
+        vid (int or None): VLAN VID to use (or None).
+        eth_src (str): source Ethernet MAC address.
+        eth_dst (str): dest Ethernet MAC address.
+        src_ip (ipaddress.IPv6Address): source IPv6 address.
+        dst_ip (ipaddress.IPv6Address): dest IPv6 address.
+        vips (list): prefixes (ipaddress.IPv6Address) to advertise.
+        hop_limit (int): IPv6 hop limit.
+        pi_flags (int): flags to set in prefix information field (default set A and L)
+    Returns:
+        SerializedPacket: Serialized IPv6 ICMP RA packet.
+    """
+    pkt_data = bytearray(_router_advert_template(
+        vid, eth_src, _ipv6(src_ip), tuple(vips), hop_limit, pi_flags))
+    return SerializedPacket(_patch_icmpv6(
+        pkt_data, _l3_offset(vid), addrconv.mac.text_to_bin(eth_dst),
+        _ipv6(dst_ip).packed))
@@ -0,0 +1,110 @@
+"""Token bucket rate limiting of packet ins."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import time
+
+
+class TokenBucket(object):
+    """Allow up to rate events per second, with bursts of up to burst events.
+
+    clock returns the current time in seconds (time.time() by default).
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time):
+        self.rate = rate
+        if burst is None:
+            burst = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last_time = None
+
+    def refill(self):
+        """Add tokens earned since the last refill."""
+        now = self.clock()
+        if self.last_time is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def available(self):
+        """Return True if at least one token is available."""
+        self.refill()
+        return self.tokens >= 1
+
+    def consume(self):
+        """Take one token (available() must have returned True)."""
+        self.tokens -= 1
+
+
+class PacketInLimiter(object):
+    """Hierarchical (DP, then VLAN, then port) packet in rate limiting.
+
+    A packet in is accepted only if its port, its VLAN and the DP all have
+    a token available, so one busy port cannot use up the budget of its
+    VLAN or DP. A rate of 0 disables limiting at that level. All buckets
+    share clock, which returns the current time in seconds.
+    """
+
+    PORT = 'port'
+    VLAN = 'vlan'
+    DP = 'dp'
+
+    def __init__(self, dp_rate, vlan_rate, port_rate, clock=time.time):
+        self.dp_rate = dp_rate
+        self.vlan_rate = vlan_rate
+        self.port_rate = port_rate
+        self.clock = clock
+        self.dp_bucket = None
+        if dp_rate:
+            self.dp_bucket = TokenBucket(dp_rate, clock=clock)
+        self.vlan_buckets = {}
+        self.port_buckets = {}
+        self.limited = collections.defaultdict(int)
+
+    def _bucket(self, buckets, key, rate):
+        if not rate:
+            return None
+        if key not in buckets:
+            buckets[key] = TokenBucket(rate, clock=self.clock)
+        return buckets[key]
+
+    def limit(self, port_num, vid):
+        """Return the level that limited a packet in, or None if accepted.
+
+        Args:
+            port_num (int): port packet in was received on.
+            vid (int): VLAN VID packet in was received on.
+        Returns:
+            str: PORT, VLAN, DP or None if not limited.
+        """
+        levels = (
+            (self.PORT, self._bucket(self.port_buckets, port_num, self.port_rate)),
+            (self.VLAN, self._bucket(self.vlan_buckets, vid, self.vlan_rate)),
+            (self.DP, self.dp_bucket))
+        buckets = []
+        for level, bucket in levels:
+            if bucket is None:
+                continue
+            if not bucket.available():
+                self.limited[level] += 1
+                return level
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.consume()
+        return None
@@ -57,6 +57,7 @@ class ValveRouteManager(object):
 
     IPV = None
     ETH_TYPE = None
+    CONTROL_ETH_TYPES = ()
     ICMP_TYPE = None
     MAX_LEN = 96
 
@@ -66,7 +67,7 @@ class ValveRouteManager(object):
                  fib_table, vip_table, eth_src_table, eth_dst_table, flood_table,
                  route_priority,
                  valve_in_match, valve_flowdel, valve_flowmod,
-                 valve_flowcontroller, use_group_table, routers):
+                 valve_flowcontroller, flood_pkt, use_group_table, routers):
         self.logger = logger
         self.faucet_mac = faucet_mac
         self.arp_neighbor_timeout = arp_neighbor_timeout
@@ -85,6 +86,7 @@ class ValveRouteManager(object):
         self.valve_flowdel = valve_flowdel
         self.valve_flowmod = valve_flowmod
         self.valve_flowcontroller = valve_flowcontroller
+        self.flood_pkt = flood_pkt
         self.use_group_table = use_group_table
         # TODO: if any router config present, we globally route between
         # all VLANs - we want however to be able to restrict routing
@@ -114,8 +116,8 @@ class ValveRouteManager(object):
         pass
 
     def resolve_gw_on_vlan(self, vlan, faucet_vip, ip_gw):
-        return vlan.flood_pkt(
-            self._neighbor_resolver_pkt, faucet_vip, ip_gw)
+        return self.flood_pkt(
+            vlan, self._neighbor_resolver_pkt, faucet_vip, ip_gw)
 
     def _nexthop_actions(self, eth_dst, vlan):
         ofmsgs = []
@@ -164,7 +166,8 @@ class ValveRouteManager(object):
                 eth_type=self.ETH_TYPE,
                 nw_proto=self.ICMP_TYPE),
             priority=priority,
-            max_len=self.MAX_LEN))
+            max_len=self.MAX_LEN,
+            packetin_type='control_plane'))
         if self.proactive_learn:
             ofmsgs.append(self.valve_flowmod(
                 self.fib_table,
@@ -181,7 +184,8 @@ class ValveRouteManager(object):
                     self.vip_table,
                     eth_type=self.ETH_TYPE),
                 priority=priority,
-                max_len=self.MAX_LEN))
+                max_len=self.MAX_LEN,
+                packetin_type='route_miss'))
         return ofmsgs
 
     def _add_faucet_vip_nd(self, vlan, priority, faucet_vip, faucet_vip_host):
@@ -254,8 +258,11 @@ class ValveRouteManager(object):
             group_id = self.ip_gw_to_group_id[resolved_ip_gw]
         else:
             group_mod_method = valve_of.groupadd
-            group_id = self._group_id_from_ip_gw(resolved_ip_gw)
-            self.ip_gw_to_group_id[resolved_ip_gw] = group_id
+            if resolved_ip_gw in self.ip_gw_to_group_id:
+                group_id = self.ip_gw_to_group_id[resolved_ip_gw]
+            else:
+                group_id = self._group_id_from_ip_gw(resolved_ip_gw)
+                self.ip_gw_to_group_id[resolved_ip_gw] = group_id
             ofmsgs.append(valve_of.groupdel(group_id=group_id))
         ofmsgs.append(
             group_mod_method(group_id=group_id, buckets=buckets))
@@ -283,6 +290,25 @@ class ValveRouteManager(object):
         self._update_nexthop_cache(vlan, eth_src, resolved_ip_gw)
         return ofmsgs
 
+    def restore_nexthop(self, vlan, port, eth_src, ip_gw):
+        """Reprovision a nexthop resolved before a controller restart.
+
+        Args:
+            vlan (vlan): VLAN containing this RIB/FIB.
+            port (port): port the nexthop was learned on.
+            eth_src (str): MAC address of the nexthop.
+            ip_gw (ipaddress.ip_address): IP address of the nexthop.
+        Returns:
+            list: OpenFlow messages.
+        """
+        ofmsgs = []
+        if not vlan.ip_in_vip_subnet(ip_gw) or vlan.is_faucet_vip(ip_gw):
+            return ofmsgs
+        ofmsgs.extend(self._update_nexthop(vlan, port, eth_src, ip_gw))
+        if ip_gw not in list(self._vlan_routes(vlan).values()):
+            ofmsgs.extend(self._add_host_fib_route(vlan, ip_gw))
+        return ofmsgs
+
     def _vlan_ip_gws(self, vlan):
         """Return IP gateways in VLAN.
 
@@ -294,9 +320,8 @@ class ValveRouteManager(object):
         routes = self._vlan_routes(vlan)
         ip_gws = []
         for ip_gw in set(routes.values()):
-            for faucet_vip in vlan.faucet_vips_by_ipv(self.IPV):
-                if ip_gw in faucet_vip.network:
-                    ip_gws.append((ip_gw, faucet_vip))
+            for faucet_vip in vlan.vips_for_ip(ip_gw):
+                ip_gws.append((ip_gw, faucet_vip))
         return ip_gws
 
     def _add_unresolved_nexthops(self, vlan, ip_gws):
@@ -445,25 +470,24 @@ class ValveRouteManager(object):
                     self.logger.info(
                         'not proactively learning %s, at limit %u', dst_ip, limit)
                     break
-                for faucet_vip in vlan.faucet_vips_by_ipv(self.IPV):
-                    if dst_ip in faucet_vip.network:
-                        priority = self._route_priority(dst_ip)
-                        dst_int = self._host_ip_to_host_int(dst_ip)
-                        in_match = self._route_match(vlan, dst_int)
-                        ofmsgs.append(self.valve_flowmod(
-                            self.fib_table,
-                            in_match,
-                            priority=priority,
-                            hard_timeout=self.arp_neighbor_timeout))
-                        ofmsgs.extend(
-                            self._add_host_fib_route(vlan, dst_ip))
-                        resolve_flows = self.resolve_gw_on_vlan(
-                            vlan, faucet_vip, dst_ip)
-                        ofmsgs.extend(resolve_flows)
-                        self.logger.info(
-                            'proactively resolving %s (%u flows)',
-                            dst_ip, len(resolve_flows))
-                        return ofmsgs
+                faucet_vip = vlan.vips_for_ip(dst_ip)[0]
+                priority = self._route_priority(dst_ip)
+                dst_int = self._host_ip_to_host_int(dst_ip)
+                in_match = self._route_match(vlan, dst_int)
+                ofmsgs.append(self.valve_flowmod(
+                    self.fib_table,
+                    in_match,
+                    priority=priority,
+                    hard_timeout=self.arp_neighbor_timeout))
+                ofmsgs.extend(
+                    self._add_host_fib_route(vlan, dst_ip))
+                resolve_flows = self.resolve_gw_on_vlan(
+                    vlan, faucet_vip, dst_ip)
+                ofmsgs.extend(resolve_flows)
+                self.logger.info(
+                    'proactively resolving %s (%u flows)',
+                    dst_ip, len(resolve_flows))
+                return ofmsgs
         return ofmsgs
 
     def add_route(self, vlan, ip_gw, ip_dst):
@@ -543,8 +567,12 @@ class ValveRouteManager(object):
         Returns:
             list: OpenFlow messages.
         """
-        ip_pkt = self._ip_pkt(pkt_meta.pkt)
         ofmsgs = []
+        # Avoid parsing beyond Ethernet unless a route could be added.
+        if (pkt_meta.eth_type != self.ETH_TYPE or
+                not pkt_meta.vlan.faucet_vips_by_ipv(self.IPV)):
+            return ofmsgs
+        ip_pkt = self._ip_pkt(pkt_meta.pkt)
         if ip_pkt:
             src_ip = ipaddress.ip_address(btos(ip_pkt.src))
             if src_ip and pkt_meta.vlan.ip_in_vip_subnet(src_ip):
@@ -611,6 +639,7 @@ class ValveIPv4RouteManager(ValveRouteManager):
 
     IPV = 4
     ETH_TYPE = ether.ETH_TYPE_IP
+    CONTROL_ETH_TYPES = (ether.ETH_TYPE_IP, ether.ETH_TYPE_ARP)
     ICMP_TYPE = inet.IPPROTO_ICMP
 
     def _vlan_nexthop_cache_limit(self, vlan):
@@ -657,7 +686,8 @@ class ValveIPv4RouteManager(ValveRouteManager):
                 eth_type=ether.ETH_TYPE_ARP,
                 nw_dst=faucet_vip_host),
             priority=priority,
-            max_len=self.MAX_LEN))
+            max_len=self.MAX_LEN,
+            packetin_type='control_plane'))
         return ofmsgs
 
     def _control_plane_arp_handler(self, pkt_meta, arp_pkt):
@@ -731,6 +761,7 @@ class ValveIPv6RouteManager(ValveRouteManager):
 
     IPV = 6
     ETH_TYPE = ether.ETH_TYPE_IPV6
+    CONTROL_ETH_TYPES = (ether.ETH_TYPE_IPV6,)
     ICMP_TYPE = inet.IPPROTO_ICMPV6
     MAX_LEN = 128
 
@@ -747,6 +778,8 @@ class ValveIPv6RouteManager(ValveRouteManager):
     def _add_faucet_vip_nd(self, vlan, priority, faucet_vip, faucet_vip_host):
         faucet_vip_host_nd_mcast = valve_packet.ipv6_link_eth_mcast(
             valve_packet.ipv6_solicited_node_from_ucast(faucet_vip.ip))
+        # Solicits are flooded as well as sent to the controller, so cannot
+        # be metered (a meter would drop the flooded copy too).
         controller_and_flood = [
             valve_of.apply_actions([valve_of.output_controller()]),
             valve_of.goto_table(self.flood_table)]
@@ -771,7 +804,8 @@ class ValveIPv6RouteManager(ValveRouteManager):
                 vlan=vlan,
                 nw_proto=inet.IPPROTO_ICMPV6,
                 icmpv6_type=icmpv6.ND_NEIGHBOR_ADVERT),
-            priority=priority))
+            priority=priority,
+            packetin_type='control_plane'))
         if faucet_vip.ip in valve_packet.IPV6_LINK_LOCAL:
             ofmsgs.append(self.valve_flowmod(
                 self.eth_src_table,
@@ -870,8 +904,8 @@ class ValveIPv6RouteManager(ValveRouteManager):
         link_local_vips, other_vips = self._link_and_other_vips(vlan)
         for link_local_vip in link_local_vips:
             # https://tools.ietf.org/html/rfc4861#section-6.1.2
-            ofmsgs.extend(vlan.flood_pkt(
-                valve_packet.router_advert, self.faucet_mac,
+            ofmsgs.extend(self.flood_pkt(
+                vlan, valve_packet.router_advert, self.faucet_mac,
                 valve_packet.IPV6_ALL_NODES_MCAST,
                 link_local_vip.ip, valve_packet.IPV6_ALL_NODES,
                 other_vips))
@@ -0,0 +1,72 @@
+"""Save and restore learned Valve state across controller restarts."""
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import time
+
+STATE_VERSION = 1
+
+
+def save_state(state_file, valves):
+    """Write learned state of all Valves to a file.
+
+    The state is written and synced to a temporary file, unique to this
+    process, which then replaces the old state file, so a crash while
+    saving never leaves a partial state file. Each Faucet process (eg.
+    each shard) must have its own state file, as the file holds only the
+    state of that process's Valves.
+
+    Args:
+        state_file (str): path to state file.
+        valves (dict): Valves by DP ID.
+    """
+    state = {
+        'version': STATE_VERSION,
+        'time': time.time(),
+        'dps': dict(
+            (str(dp_id), valve.get_warm_state())
+            for dp_id, valve in list(valves.items())),
+    }
+    tmp_state_file = '%s.%u.tmp' % (state_file, os.getpid())
+    with open(tmp_state_file, 'w') as state_fd:
+        json.dump(state, state_fd, separators=(',', ':'))
+        state_fd.flush()
+        os.fsync(state_fd.fileno())
+    os.rename(tmp_state_file, state_file)
+
+
+def load_state(state_file, logger):
+    """Return learned state saved by save_state().
+
+    Args:
+        state_file (str): path to state file.
+        logger (logging.Logger): logger for state file errors.
+    Returns:
+        dict: learned state by DP ID, empty if there is no usable state.
+    """
+    try:
+        with open(state_file, 'r') as state_fd:
+            state = json.load(state_fd)
+    except (IOError, OSError, ValueError) as err:
+        logger.info('not restoring state from %s: %s', state_file, err)
+        return {}
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        logger.warning('not restoring state from %s: unknown version', state_file)
+        return {}
+    return dict(
+        (int(dp_id), dp_state) for dp_id, dp_state in list(state['dps'].items()))
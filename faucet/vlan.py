@@ -56,6 +56,8 @@ class VLAN(Conf):
     dyn_faucet_vips_by_ipv = None
     dyn_routes_by_ipv = None
     dyn_neigh_cache_by_ipv = None
+    dyn_faucet_vip_ips = None
+    dyn_vip_networks_by_ipv = None
 
     defaults = {
         'name': None,
@@ -117,6 +119,8 @@ class VLAN(Conf):
         self.dyn_routes_by_ipv = collections.defaultdict(dict)
         self.dyn_neigh_cache_by_ipv = collections.defaultdict(dict)
         self.dyn_ipvs = []
+        self.dyn_faucet_vip_ips = set()
+        self.dyn_vip_networks_by_ipv = collections.defaultdict(list)
 
         if self.faucet_vips:
             self.faucet_vips = [
@@ -125,6 +129,7 @@ class VLAN(Conf):
                 self.dyn_faucet_vips_by_ipv[faucet_vip.version].append(
                     faucet_vip)
             self.dyn_ipvs = list(self.dyn_faucet_vips_by_ipv.keys())
+            self._index_faucet_vips()
 
         if self.bgp_as:
             assert self.bgp_port
@@ -141,6 +146,28 @@ class VLAN(Conf):
                 assert ip_gw.version == ip_dst.version
                 self.dyn_routes_by_ipv[ip_gw.version][ip_dst] = ip_gw
 
+    def _index_faucet_vips(self):
+        """Index VIPs, and their connected networks, for fast lookup.
+
+        Connected networks are indexed per IP version by prefix length (longest
+        first), then by network address, so finding the networks containing
+        an IP is one hash lookup per distinct prefix length.
+        """
+        for ipv, faucet_vips in list(self.dyn_faucet_vips_by_ipv.items()):
+            vips_by_prefixlen = collections.defaultdict(
+                lambda: collections.defaultdict(list))
+            for vip_index, faucet_vip in enumerate(faucet_vips):
+                self.dyn_faucet_vip_ips.add(faucet_vip.ip)
+                network = faucet_vip.network
+                vips_by_prefixlen[network.prefixlen][
+                    int(network.network_address)].append(
+                        (vip_index, faucet_vip))
+            for prefixlen in sorted(vips_by_prefixlen.keys(), reverse=True):
+                netmask = int(ipaddress.ip_network(
+                    faucet_vips[0].ip).supernet(new_prefix=prefixlen).netmask)
+                self.dyn_vip_networks_by_ipv[ipv].append(
+                    (netmask, dict(vips_by_prefixlen[prefixlen])))
+
     def add_tagged(self, port):
         self.tagged.append(port)
 
@@ -240,15 +267,27 @@ class VLAN(Conf):
 
     def is_faucet_vip(self, ipa):
         """Return True if IP is a VIP on this VLAN."""
-        for faucet_vip in self.faucet_vips_by_ipv(ipa.version):
-            if ipa == faucet_vip.ip:
-                return True
-        return False
+        return ipa in self.dyn_faucet_vip_ips
+
+    def vips_for_ip(self, ipa):
+        """Return VIPs on this VLAN whose connected network contains an IP.
+
+        Args:
+            ipa (ipaddress.ip_address): IP address.
+        Returns:
+            list: VIPs (ipaddress.ip_interface) in configuration order.
+        """
+        ipa_int = int(ipa)
+        vips = []
+        for netmask, vips_by_network in self.dyn_vip_networks_by_ipv[ipa.version]:
+            vips.extend(vips_by_network.get(ipa_int & netmask, []))
+        return [faucet_vip for _, faucet_vip in sorted(vips)]
 
     def ip_in_vip_subnet(self, ipa):
         """Return True if IP in same IP network as a VIP on this VLAN."""
-        for faucet_vip in self.faucet_vips_by_ipv(ipa.version):
-            if ipa in faucet_vip.network:
+        ipa_int = int(ipa)
+        for netmask, vips_by_network in self.dyn_vip_networks_by_ipv[ipa.version]:
+            if ipa_int & netmask in vips_by_network:
                 return True
         return False
 
@@ -1,19 +1,26 @@
+import hashlib
 import logging
-import random
 import json
 import time
 
-import numpy
-
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
-from requests.exceptions import ConnectionError
-from ryu.lib import hub
-
 try:
+    from gauge_file import file_writer
+    from gauge_flows import FlowSnapshot, flow_key
+    from gauge_influx import encode_line, encode_tags, influx_writer
+    from gauge_poll import POLL_REPLY_SECONDS, poll_scheduler
+    from gauge_prom import (
+        PROM_PORT_LINK_UP, PROM_PORT_STATE_REASON, PROM_PORT_STATS)
+    from gauge_rates import PORT_STATS, port_stats_history
     from nsodbc import nsodbc_factory, init_switch_db, init_flow_db
     from valve_util import dpid_log
 except ImportError:
+    from faucet.gauge_file import file_writer
+    from faucet.gauge_flows import FlowSnapshot, flow_key
+    from faucet.gauge_influx import encode_line, encode_tags, influx_writer
+    from faucet.gauge_poll import POLL_REPLY_SECONDS, poll_scheduler
+    from faucet.gauge_prom import (
+        PROM_PORT_LINK_UP, PROM_PORT_STATE_REASON, PROM_PORT_STATS)
+    from faucet.gauge_rates import PORT_STATS, port_stats_history
     from faucet.nsodbc import nsodbc_factory, init_switch_db, init_flow_db
     from faucet.valve_util import dpid_log
 
@@ -29,10 +36,12 @@ def watcher_factory(conf):
         'port_state': {
             'text': GaugePortStateLogger,
             'influx': GaugePortStateInfluxDBLogger,
+            'prometheus': GaugePortStatePrometheusLogger,
             },
         'port_stats': {
             'text': GaugePortStatsPoller,
             'influx': GaugePortStatsInfluxDBPoller,
+            'prometheus': GaugePortStatsPrometheusPoller,
             },
         'flow_table': {
             'text': GaugeFlowTablePoller,
@@ -54,38 +63,60 @@ def _rcv_time(rcv_time):
 class InfluxShipper(object):
     """Convenience class for shipping values to influx db.
 
-    Inheritors must have a WatcherConf object as conf.
+    Inheritors must have a WatcherConf object as conf, and a logger.
     """
     conf = None
+    logger = None
+    _port_tags = None
 
     def ship_points(self, points):
-        try:
-            client = InfluxDBClient(
-                host=self.conf.influx_host,
-                port=self.conf.influx_port,
-                username=self.conf.influx_user,
-                password=self.conf.influx_pwd,
-                database=self.conf.influx_db,
-                timeout=self.conf.influx_timeout)
-            return client.write_points(points=points, time_precision='s')
-        except (ConnectionError, InfluxDBClientError, InfluxDBServerError):
-            return False
+        """Queue points to be written to InfluxDB in the background.
+
+        Returns False if the write queue is full (and so points were dropped).
+        """
+        return influx_writer(self.conf, self.logger).ship(points)
+
+    def port_tags(self, dp_name, port_name):
+        """Return line protocol tags for a port, cached per port."""
+        if self._port_tags is None:
+            self._port_tags = {}
+        tags_key = (dp_name, port_name)
+        if tags_key not in self._port_tags:
+            self._port_tags[tags_key] = encode_tags((
+                ('dp_name', dp_name), ('port_name', port_name)))
+        return self._port_tags[tags_key]
 
     def make_point(self, dp_name, port_name, rcv_time, stat_name, stat_val):
-        port_tags = {
-            'dp_name': dp_name,
-            'port_name': port_name,
-        }
-        # InfluxDB has only one integer type, int64. We are logging OF
-        # stats that are uint64. Use float64 to prevent an overflow.
-        # q.v. https://docs.influxdata.com/influxdb/v1.2/write_protocols/line_protocol_reference/
-        point = {
-            'measurement': stat_name,
-            'tags': port_tags,
-            'time': int(rcv_time),
-            # pylint: disable=no-member
-            'fields': {'value': numpy.float64(stat_val)}}
-        return point
+        return encode_line(
+            stat_name, self.port_tags(dp_name, port_name), rcv_time, stat_val)
+
+
+class PrometheusExporter(object):
+    """Convenience class for exporting port values to Prometheus.
+
+    Values are served by the Gauge Prometheus endpoint from memory, so
+    scrapes always see the last values and nothing is written per poll.
+
+    Inheritors must have a DP object as dp.
+    """
+    dp = None
+    _port_metrics = None
+
+    def port_metric(self, metric, port_name):
+        """Return a Prometheus gauge labelled for a port, cached per port.
+
+        The cache is keyed on all labels, as dp may be replaced (eg. renamed)
+        when the config is reloaded.
+        """
+        if self._port_metrics is None:
+            self._port_metrics = {}
+        labels = (hex(self.dp.dp_id), self.dp.name, port_name)
+        metric_key = (metric, labels)
+        if metric_key not in self._port_metrics:
+            dp_id, dp_name, port_name = labels
+            self._port_metrics[metric_key] = metric.labels(
+                dp_id=dp_id, dp_name=dp_name, port_name=port_name)
+        return self._port_metrics[metric_key]
 
 
 class GaugeDBHelper(object):
@@ -116,16 +147,6 @@ class GaugeDBHelper(object):
             init_flow_db(self.flow_database)
         self.db_update_counter = int(self.conf.db_update_counter)
 
-    def refresh_switchdb(self):
-        self.conn.delete(self.conf.switches_doc)
-        self.switch_database, _ = self.conn.create(self.conf.switches_doc)
-        init_switch_db(self.switch_database)
-
-    def refresh_flowdb(self):
-        self.conn.delete(self.conf.flows_doc)
-        self.flow_database, _ = self.conn.create(self.conf.flows_doc)
-        init_flow_db(self.flow_database)
-
 
 class GaugePortStateLogger(object):
 
@@ -155,8 +176,8 @@ class GaugePortStateLogger(object):
         log_msg = '%s %s' % (dpid_log(dp_id), log_msg)
         self.logger.info(log_msg)
         if self.conf.file:
-            with open(self.conf.file, 'a') as logfile:
-                logfile.write('\t'.join((rcv_time_str, log_msg)) + '\n')
+            file_writer(self.conf).writelines(
+                ['\t'.join((rcv_time_str, log_msg)) + '\n'])
 
     def start(self, ryudp):
         pass
@@ -200,22 +221,49 @@ time			dp_name			port_name	value
                     '%s error shipping port_state_reason points', dpid_log(dp_id))
 
 
+class GaugePortStatePrometheusLogger(GaugePortStateLogger, PrometheusExporter):
+    """Exports the last port status change reason, and link state, to Prometheus."""
+
+    def update(self, rcv_time, dp_id, msg):
+        super(GaugePortStatePrometheusLogger, self).update(rcv_time, dp_id, msg)
+        port_no = msg.desc.port_no
+        if port_no in self.dp.ports:
+            ofp = msg.datapath.ofproto
+            port_name = self.dp.ports[port_no].name
+            self.port_metric(PROM_PORT_STATE_REASON, port_name).set(msg.reason)
+            link_up = not msg.desc.state & ofp.OFPPS_LINK_DOWN
+            if msg.reason == ofp.OFPPR_DELETE:
+                link_up = False
+            self.port_metric(PROM_PORT_LINK_UP, port_name).set(int(link_up))
+
+
 class GaugePoller(object):
-    """A ryu thread object for sending and receiving openflow stats requests.
+    """An object for sending and receiving openflow stats requests.
 
-    The thread runs in a loop sending a request, sleeping then checking a
-    response was received before sending another request.
+    The poll scheduler (see gauge_poll) calls poll() every poll_interval()
+    seconds, which checks a response was received to the last request
+    before sending another request.
+
+    Replies are matched to requests by xid, so the latency of a DP that
+    replies after the next poll is measured from the request it answers.
 
     The methods send_req, update and no_response should be implemented by
     subclasses.
     """
 
+    # Weight of the latest reply in the average reply latency.
+    LATENCY_WEIGHT = 0.2
+    # Requests unanswered for this many poll intervals are forgotten.
+    PENDING_POLLS = 4
+
     def __init__(self, conf, logname):
         self.dp = conf.dp
         self.conf = conf
-        self.thread = None
         self.reply_pending = False
         self.interval = self.conf.interval
+        # Time each unanswered request was sent, by xid.
+        self.req_times = {}
+        self.reply_latency = None
         self.logger = logging.getLogger(
             logname + '.{0}'.format(self.conf.type)
             )
@@ -224,34 +272,72 @@ class GaugePoller(object):
     def start(self, ryudp):
         self.ryudp = ryudp
         self.stop()
-        self.thread = hub.spawn(self)
+        poll_scheduler().add(self)
 
     def stop(self):
         if self.running():
-            hub.kill(self.thread)
-            hub.joinall([self.thread])
-            self.thread = None
-
-    def __call__(self):
-        """Send request loop.
-
-        Delays the initial request for a random interval to reduce load.
-        Then sends a request to the datapath, waits the specified interval and
-        checks that a response has been received in a loop."""
-        #TODO: this should use a deterministic method instead of random
-        hub.sleep(random.randint(1, self.conf.interval))
-        while True:
-            self.send_req()
-            self.reply_pending = True
-            hub.sleep(self.conf.interval)
-            if self.reply_pending:
-                self.no_response()
+            poll_scheduler().remove(self)
+            self.reply_pending = False
+            self.req_times = {}
+
+    def poll(self, now):
+        """Check the last request was answered, then send a request."""
+        if self.reply_pending:
+            self.no_response()
+        oldest_req_time = now - self.PENDING_POLLS * self.poll_interval()
+        self.req_times = dict(
+            (xid, req_time) for xid, req_time in list(self.req_times.items())
+            if req_time >= oldest_req_time)
+        reqs = self.send_req()
+        for req in reqs:
+            self.req_times[req.xid] = now
+        # No reply is expected if nothing was due (eg. no flow table was).
+        self.reply_pending = bool(reqs)
+
+    def poll_interval(self):
+        """Return seconds between polls.
+
+        This is the configured interval, unless the DP takes more than half
+        the interval to reply, in which case polls are spaced out to twice
+        the average reply latency.
+        """
+        if self.reply_latency is not None and self.reply_latency * 2 > self.interval:
+            return self.reply_latency * 2
+        return self.interval
+
+    def reply_received(self, rcv_time, xid):
+        """Acknowledge a reply to a request, and update reply latency.
+
+        Only the first reply to a request (eg. the first part of a multipart
+        reply) updates the latency. Requests sent before the one answered
+        will not be answered, as replies are in order, so are forgotten.
+        """
+        req_time = self.req_times.pop(xid, None)
+        if req_time is not None:
+            self.req_times = dict(
+                (other_xid, other_req_time)
+                for other_xid, other_req_time in list(self.req_times.items())
+                if other_req_time >= req_time)
+            latency = rcv_time - req_time
+            if self.reply_latency is None:
+                self.reply_latency = latency
+            else:
+                self.reply_latency += self.LATENCY_WEIGHT * (
+                    latency - self.reply_latency)
+            POLL_REPLY_SECONDS.labels(
+                dp_id=hex(self.dp.dp_id), type=self.conf.type).set(
+                    self.reply_latency)
+        self.reply_pending = bool(self.req_times)
 
     def running(self):
-        return self.thread is not None
+        return poll_scheduler().scheduled(self)
 
     def send_req(self):
-        """Send a stats request to a datapath."""
+        """Send stats requests to a datapath.
+
+        Returns:
+            list: requests sent.
+        """
         raise NotImplementedError
 
     def update(self, rcv_time, dp_id, msg):
@@ -260,8 +346,7 @@ class GaugePoller(object):
         Called when a reply to a stats request sent by this object is received
         by the controller.
 
-        It should acknowledge the receipt by setting self.reply_pending to
-        false.
+        It should acknowledge the receipt by calling self.reply_received().
 
         Arguments:
         rcv_time -- the time the response was received
@@ -274,17 +359,32 @@ class GaugePoller(object):
         """Called when a polling cycle passes without receiving a response."""
         raise NotImplementedError
 
-    def _stat_port_name(self, msg, stat, dp_id):
-        if stat.port_no == msg.datapath.ofproto.OFPP_CONTROLLER:
+    def _port_name(self, msg, port_no):
+        if port_no == msg.datapath.ofproto.OFPP_CONTROLLER:
             return 'CONTROLLER'
-        elif stat.port_no == msg.datapath.ofproto.OFPP_LOCAL:
+        elif port_no == msg.datapath.ofproto.OFPP_LOCAL:
             return 'LOCAL'
-        elif stat.port_no in self.dp.ports:
-            return self.dp.ports[stat.port_no].name
-        self.logger.info('%s stats for unknown port %u',
-                         dpid_log(dp_id), stat.port_no)
+        elif port_no in self.dp.ports:
+            return self.dp.ports[port_no].name
         return None
 
+    def _stat_port_name(self, msg, stat, dp_id):
+        port_name = self._port_name(msg, stat.port_no)
+        if port_name is None:
+            self.logger.info('%s stats for unknown port %u',
+                             dpid_log(dp_id), stat.port_no)
+        return port_name
+
+    def _update_port_stats_history(self, rcv_time, msg):
+        """Add a port stats reply to the DP's history, and export rates."""
+        if self.conf.port_stats_history:
+            history = port_stats_history(
+                self.dp.dp_id, self.conf.port_stats_history)
+            history.update(rcv_time, msg.body)
+            history.export(self.dp.name, dict(
+                (stat.port_no, self._port_name(msg, stat.port_no))
+                for stat in msg.body))
+
     def _format_port_stats(self, delim, stat):
         formatted_port_stats = []
         for stat_name_list, stat_val in (
@@ -313,6 +413,7 @@ class GaugePortStatsPoller(GaugePoller):
         ofp_parser = self.ryudp.ofproto_parser
         req = ofp_parser.OFPPortStatsRequest(self.ryudp, 0, ofp.OFPP_ANY)
         self.ryudp.send_msg(req)
+        return [req]
 
     def _update_line(self, rcv_time_str, stat_name, stat_val):
         return '\t'.join((rcv_time_str, stat_name, str(stat_val))) + '\n'
@@ -321,19 +422,19 @@ class GaugePortStatsPoller(GaugePoller):
         # TODO: it may be worth while verifying this is the correct stats
         # response before doing this
         rcv_time_str = _rcv_time(rcv_time)
-        self.reply_pending = False
+        self.reply_received(rcv_time, msg.xid)
+        self._update_port_stats_history(rcv_time, msg)
+        log_lines = []
         for stat in msg.body:
             port_name = self._stat_port_name(msg, stat, dp_id)
             if port_name is not None:
-                with open(self.conf.file, 'a') as logfile:
-                    log_lines = []
-                    for stat_name, stat_val in self._format_port_stats('-', stat):
-                        dp_port_name = '-'.join((
-                            self.dp.name, port_name, stat_name))
-                        log_lines.append(
-                            self._update_line(
-                                rcv_time_str, dp_port_name, stat_val))
-                    logfile.writelines(log_lines)
+                for stat_name, stat_val in self._format_port_stats('-', stat):
+                    dp_port_name = '-'.join((
+                        self.dp.name, port_name, stat_name))
+                    log_lines.append(
+                        self._update_line(
+                            rcv_time_str, dp_port_name, stat_val))
+        file_writer(self.conf).writelines(log_lines)
 
     def no_response(self):
         self.logger.info(
@@ -379,18 +480,33 @@ time			dp_name			port_name	value
         ofp_parser = self.ryudp.ofproto_parser
         req = ofp_parser.OFPPortStatsRequest(self.ryudp, 0, ofp.OFPP_ANY)
         self.ryudp.send_msg(req)
+        return [req]
+
+    INFLUX_PORT_STATS = PORT_STATS
+
+    def port_stats_lines(self, rcv_time, dp_id, msg):
+        """Return the stats in a port stats reply in line protocol."""
+        lines = []
+        rcv_time = int(rcv_time)
+        for stat in msg.body:
+            port_name = self._stat_port_name(msg, stat, dp_id)
+            if port_name is None:
+                continue
+            tags = self.port_tags(self.dp.name, port_name)
+            for stat_name, stat_attr in self.INFLUX_PORT_STATS:
+                stat_val = getattr(stat, stat_attr)
+                # For openvswitch, unsupported statistics are set to
+                # all-1-bits (UINT64_MAX), skip reporting them
+                if stat_val != 2**64-1:
+                    lines.append(encode_line(stat_name, tags, rcv_time, stat_val))
+        return lines
 
     def update(self, rcv_time, dp_id, msg):
         # TODO: it may be worth while verifying this is the correct stats
         # response before doing this
-        self.reply_pending = False
-        points = []
-        for stat in msg.body:
-            port_name = self._stat_port_name(msg, stat, dp_id)
-            for stat_name, stat_val in self._format_port_stats('_', stat):
-                points.append(
-                    self.make_point(
-                        self.dp.name, port_name, rcv_time, stat_name, stat_val))
+        self.reply_received(rcv_time, msg.xid)
+        self._update_port_stats_history(rcv_time, msg)
+        points = self.port_stats_lines(rcv_time, dp_id, msg)
         if not self.ship_points(points):
             self.logger.warn(
                 '%s error shipping port_stats points', dpid_log(dp_id))
@@ -400,96 +516,320 @@ time			dp_name			port_name	value
             'port stats request timed out for %s', self.dp.name)
 
 
-class GaugeFlowTablePoller(GaugePoller):
-    """Periodically dumps the current datapath flow table as a yaml object.
-
-    Includes a timestamp and a reference ($DATAPATHNAME-flowtables). The
-    flow table is dumped as an OFFlowStatsReply message (in yaml format) that
-    matches all flows.
+class GaugePortStatsPrometheusPoller(GaugePoller, PrometheusExporter):
+    """Periodically sends a port stats request to the datapath and exports
+       the response to Prometheus (as of_port_packets_out and so on).
     """
 
     def send_req(self):
         ofp = self.ryudp.ofproto
         ofp_parser = self.ryudp.ofproto_parser
-        match = ofp_parser.OFPMatch()
-        req = ofp_parser.OFPFlowStatsRequest(
-            self.ryudp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY,
-            0, 0, match)
+        req = ofp_parser.OFPPortStatsRequest(self.ryudp, 0, ofp.OFPP_ANY)
         self.ryudp.send_msg(req)
+        return [req]
 
     def update(self, rcv_time, dp_id, msg):
-        # TODO: it may be worth while verifying this is the correct stats
-        # response before doing this
-        rcv_time_str = _rcv_time(rcv_time)
-        self.reply_pending = False
-        jsondict = msg.to_jsondict()
-        with open(self.conf.file, 'a') as logfile:
-            ref = '-'.join((self.dp.name, 'flowtables'))
-            logfile.write(
-                '\n'.join((
-                    '---',
-                    'time: %s' % rcv_time_str,
-                    'ref: %s' % ref,
-                    'msg: %s' % json.dumps(jsondict, indent=4))))
+        self.reply_received(rcv_time, msg.xid)
+        self._update_port_stats_history(rcv_time, msg)
+        for stat in msg.body:
+            port_name = self._stat_port_name(msg, stat, dp_id)
+            if port_name is None:
+                continue
+            for stat_name, stat_attr in PORT_STATS:
+                stat_val = getattr(stat, stat_attr)
+                # For openvswitch, unsupported statistics are set to
+                # all-1-bits (UINT64_MAX), skip reporting them
+                if stat_val != 2**64-1:
+                    self.port_metric(
+                        PROM_PORT_STATS[stat_name], port_name).set(stat_val)
+
+    def no_response(self):
+        self.logger.info(
+            'port stats request timed out for %s', self.dp.name)
+
+
+class GaugeFlowStatsPoller(GaugePoller):
+    """Base class for pollers that request flow stats.
+
+    By default, all flows are requested every interval. flow_tables limits
+    requests to some tables (by ID, or Faucet table name such as eth_src),
+    flow_table_intervals sets how often each table is requested, and
+    flow_cookie, flow_cookie_mask and flow_match limit requests to
+    matching flows. One request is sent per table that is due, so a reply
+    covers one table (or all tables, OFPTT_ALL, if flow_tables and
+    flow_table_intervals are not set).
+    """
+
+    def __init__(self, conf, logname):
+        super(GaugeFlowStatsPoller, self).__init__(conf, logname)
+        # Poll as often as the most often polled table.
+        if self.conf.flow_table_intervals:
+            self.interval = min(
+                [self.interval] + list(self.conf.flow_table_intervals.values()))
+        self.table_next_poll = {}
+        self.req_tables = {}
+
+    def _table_id(self, table):
+        """Return the ID of a table, given its ID or Faucet table name."""
+        table_id = self.conf.flow_table_id(table)
+        if table_id is None:
+            self.logger.warning('%s unknown table %s', self.dp.name, table)
+        return table_id
+
+    def table_intervals(self, all_tables):
+        """Return seconds between polls of each table ID to be polled.
+
+        Args:
+            all_tables (int): table ID for all tables (OFPTT_ALL).
+        Returns:
+            dict: seconds between polls, by table ID.
+        """
+        conf_intervals = self.conf.flow_table_intervals or {}
+        tables = self.conf.flow_tables or list(conf_intervals.keys())
+        if not tables:
+            return {all_tables: self.conf.interval}
+        table_intervals = {}
+        for table in tables:
+            table_id = self._table_id(table)
+            if table_id is not None:
+                table_intervals[table_id] = conf_intervals.get(
+                    table, self.conf.interval)
+        return table_intervals
+
+    def send_req(self):
+        ofp = self.ryudp.ofproto
+        ofp_parser = self.ryudp.ofproto_parser
+        now = time.time()
+        match = ofp_parser.OFPMatch(**(self.conf.flow_match or {}))
+        # Allow for polls being slightly early.
+        due_time = now + self.poll_interval() / 2.0
+        table_intervals = self.table_intervals(ofp.OFPTT_ALL)
+        reqs = []
+        for table_id, table_interval in sorted(table_intervals.items()):
+            if self.table_next_poll.get(table_id, 0) > due_time:
+                continue
+            req = ofp_parser.OFPFlowStatsRequest(
+                self.ryudp, 0, table_id, ofp.OFPP_ANY, ofp.OFPG_ANY,
+                self.conf.flow_cookie, self.conf.flow_cookie_mask, match)
+            self.ryudp.send_msg(req)
+            # Forget any unanswered request for this table.
+            self.req_tables = dict(
+                (xid, req_table_id)
+                for xid, req_table_id in list(self.req_tables.items())
+                if req_table_id != table_id)
+            self.req_tables[req.xid] = table_id
+            self.table_next_poll[table_id] = now + table_interval
+            reqs.append(req)
+        return reqs
+
+    def reply_table(self, msg):
+        """Return the table ID requested, for a flow stats reply.
+
+        Replies to requests this poller did not send, or no longer expects
+        (eg. duplicates, or replies to requests from before a reload), are
+        logged and should be dropped, as which flows they cover is unknown.
+
+        Returns:
+            int: table ID (OFPTT_ALL for all tables), or None if unknown.
+        """
+        table_id = self.req_tables.get(msg.xid, None)
+        if table_id is None:
+            self.logger.info(
+                'dropping unexpected flow stats reply (xid %s) from %s',
+                msg.xid, self.dp.name)
+        elif not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del self.req_tables[msg.xid]
+        return table_id
 
     def no_response(self):
         self.logger.info(
             'flow dump request timed out for %s', self.dp.name)
 
 
-class GaugeFlowTableDBLogger(GaugePoller, GaugeDBHelper):
+class GaugeFlowTablePoller(GaugeFlowStatsPoller):
     """Periodically dumps the current datapath flow table as a yaml object.
 
     Includes a timestamp and a reference ($DATAPATHNAME-flowtables). The
     flow table is dumped as an OFFlowStatsReply message (in yaml format) that
     matches all flows.
+
+    If flow_dump_format is jsonl, each flow is instead written as one compact
+    JSON object per line, with the timestamp and reference.
+
+    If flow_dump_delta is set, only every flow_dump_keyframe'th dump is of
+    the whole table. Other dumps have only added and removed flows, and
+    counter deltas (see FlowSnapshot), from the last dump of the same
+    table(s).
+    """
+
+    def __init__(self, conf, logname):
+        super(GaugeFlowTablePoller, self).__init__(conf, logname)
+        # Snapshots and reply parts, by the table ID requested.
+        self.snapshots = {}
+        self.flow_parts = {}
+
+    def update(self, rcv_time, dp_id, msg):
+        # TODO: it may be worth while verifying this is the correct stats
+        # response before doing this
+        table_id = self.reply_table(msg)
+        if table_id is None:
+            return
+        rcv_time_str = _rcv_time(rcv_time)
+        self.reply_received(rcv_time, msg.xid)
+        jsondict = msg.to_jsondict()
+        ref = '-'.join((self.dp.name, 'flowtables'))
+        flows = jsondict['OFPFlowStatsReply']['body']
+        if not self.conf.flow_dump_delta:
+            log_lines = self._dump_lines(rcv_time_str, ref, jsondict, flows)
+        else:
+            # Deltas are between whole tables, so wait for the last part.
+            self.flow_parts.setdefault(table_id, []).extend(flows)
+            if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+                return
+            if table_id not in self.snapshots:
+                self.snapshots[table_id] = FlowSnapshot(
+                    self.conf.flow_dump_keyframe)
+            dump = self.snapshots[table_id].update(
+                self.flow_parts.pop(table_id))
+            if dump['keyframe']:
+                log_lines = self._dump_lines(
+                    rcv_time_str, ref,
+                    {'OFPFlowStatsReply': {'body': dump['flows']}},
+                    dump['flows'])
+            else:
+                log_lines = self._delta_lines(rcv_time_str, ref, dump)
+        file_writer(self.conf).writelines(log_lines)
+
+    def _dump_lines(self, rcv_time_str, ref, jsondict, flows):
+        if self.conf.flow_dump_format == 'jsonl':
+            return [
+                json.dumps(
+                    {'time': rcv_time_str, 'ref': ref, 'flow': flow},
+                    separators=(',', ':')) + '\n'
+                for flow in flows]
+        return [
+            '\n'.join((
+                '---',
+                'time: %s' % rcv_time_str,
+                'ref: %s' % ref,
+                'msg: %s' % json.dumps(jsondict, indent=4))) + '\n']
+
+    def _delta_lines(self, rcv_time_str, ref, dump):
+        if self.conf.flow_dump_format == 'jsonl':
+            return [
+                json.dumps(
+                    {'time': rcv_time_str, 'ref': ref, change: flow},
+                    separators=(',', ':')) + '\n'
+                for change in ('added', 'removed', 'counters')
+                for flow in dump[change]]
+        del dump['keyframe']
+        return [
+            '\n'.join((
+                '---',
+                'time: %s' % rcv_time_str,
+                'ref: %s' % ref,
+                'delta: %s' % json.dumps(dump, indent=4))) + '\n']
+
+
+class GaugeFlowTableDBLogger(GaugeFlowStatsPoller, GaugeDBHelper):
+    """Periodically dumps the current datapath flow table as a yaml object.
+
+    Includes a timestamp and a reference ($DATAPATHNAME-flowtables). The
+    flow table is dumped as an OFFlowStatsReply message (in yaml format) that
+    matches all flows.
+
+    Each flow is a document in the flows database, with an ID derived from
+    the DP and the flow's table, priority and match, so that a dump updates
+    existing flow documents (and deletes those of removed flows) in one bulk
+    request. The switch document, listing the DP's flow documents, is then
+    updated once. If only some tables are polled (see
+    GaugeFlowStatsPoller), a dump replaces only its table's documents.
     """
 
     def __init__(self, conf, logname):
         super(GaugeFlowTableDBLogger, self).__init__(conf, logname)
         self.setup()
-
-    def send_req(self):
-        ofp = self.ryudp.ofproto
-        ofp_parser = self.ryudp.ofproto_parser
-        match = ofp_parser.OFPMatch()
-        req = ofp_parser.OFPFlowStatsRequest(
-            self.ryudp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY,
-            0, 0, match)
-        self.ryudp.send_msg(req)
+        # Snapshots and reply parts, by the table ID requested.
+        self.snapshots = {}
+        self.flow_parts = {}
+        # Last saved revision of each flow document, by ID (fetched from
+        # the database on the first update, to remove stale flows).
+        self.flow_revs = None
+
+    def _flow_doc_id_prefix(self, table_id=None):
+        if table_id is None:
+            return '%s-' % str(hex(self.dp.dp_id))
+        return '%s-%u-' % (str(hex(self.dp.dp_id)), table_id)
+
+    def _flow_doc_id(self, flow):
+        return self._flow_doc_id_prefix(
+            flow['OFPFlowStats']['table_id']) + hashlib.sha1(
+                str(flow_key(flow)).encode('utf-8')).hexdigest()
 
     def update(self, rcv_time, dp_id, msg):
         # TODO: it may be worth while verifying this is the correct stats
         # response before doing this
-        self.reply_pending = False
+        table_id = self.reply_table(msg)
+        if table_id is None:
+            return
+        self.reply_received(rcv_time, msg.xid)
         jsondict = msg.to_jsondict()
+        # Flow documents are replaced per dump, so wait for the last part.
+        self.flow_parts.setdefault(table_id, []).extend(
+            jsondict['OFPFlowStatsReply']['body'])
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        flows = self.flow_parts.pop(table_id)
+        if self.conf.flow_dump_delta:
+            if table_id not in self.snapshots:
+                self.snapshots[table_id] = FlowSnapshot(
+                    self.conf.flow_dump_keyframe)
+            dump = self.snapshots[table_id].update(flows)
+            if not (dump['keyframe'] or dump['added'] or dump['removed']):
+                # Only counters changed, so leave the database until the
+                # flows change or the next keyframe.
+                return
+        if table_id == msg.datapath.ofproto.OFPTT_ALL:
+            table_id = None
         if self.db_update_counter == self.conf.db_update_counter:
-            self.refresh_switchdb()
-            switch_object = {'_id': str(hex(self.dp.dp_id)),
-                             'data': {'flows': []}}
-            self.switch_database.insert_update_doc(switch_object,
-                                                   'data')
-            try:
-                rows = self.switch_database.get_docs(
-                    self.conf.views['switch_view'],
-                    key=str(hex(self.dp.dp_id)))
-                switch = rows[0]
-            except IndexError:
-                switch = None
-
-            if switch:
-                self.refresh_flowdb()
-                for f_msg in jsondict['OFPFlowStatsReply']['body']:
-                    flow_object = {'data': f_msg, 'tags': []}
-                    flow_id = self.flow_database.insert_update_doc(
-                        flow_object, '')
-                    switch.value['data']['flows'].append(flow_id)
-                    self.switch_database.insert_update_doc(
-                        switch.value, 'data')
+            self.update_flow_docs(flows, table_id)
         self.db_update_counter -= 1
         if not self.db_update_counter:
             self.db_update_counter = self.conf.db_update_counter
 
+    def update_flow_docs(self, flows, table_id=None):
+        """Replace the DP's flow documents with flows, in one bulk request.
+
+        Args:
+            flows (list): OFPFlowStats as JSON dicts.
+            table_id (int): replace only this table's documents, if not None.
+        """
+        if self.flow_revs is None:
+            self.flow_revs = self.flow_database.get_revs(
+                self._flow_doc_id_prefix())
+        flow_docs = {}
+        for f_msg in flows:
+            flow_id = self._flow_doc_id(f_msg)
+            flow_docs[flow_id] = {'_id': flow_id, 'data': f_msg, 'tags': []}
+        table_prefix = self._flow_doc_id_prefix(table_id)
+        for flow_id in self.flow_revs:
+            if flow_id not in flow_docs and flow_id.startswith(table_prefix):
+                flow_docs[flow_id] = {'_id': flow_id, '_deleted': True}
+        for flow_id, flow_doc in list(flow_docs.items()):
+            if flow_id in self.flow_revs:
+                flow_doc['_rev'] = self.flow_revs[flow_id]
+        saved_revs = self.flow_database.insert_update_docs(
+            list(flow_docs.values()))
+        for flow_id, flow_doc in list(flow_docs.items()):
+            if flow_id in saved_revs and not flow_doc.get('_deleted', False):
+                self.flow_revs[flow_id] = saved_revs[flow_id]
+            else:
+                self.flow_revs.pop(flow_id, None)
+        switch_object = {
+            '_id': str(hex(self.dp.dp_id)),
+            'data': {'flows': sorted(self.flow_revs.keys())}}
+        self.switch_database.insert_update_doc(switch_object, 'data')
+
     def no_response(self):
         self.logger.info(
             'flow dump request timed out for %s', self.dp.name)
@@ -22,8 +22,10 @@
 from copy import deepcopy
 try:
     from conf import Conf
+    import valve_of
 except ImportError:
     from faucet.conf import Conf
+    from faucet import valve_of
 
 
 class WatcherConf(Conf):
@@ -36,9 +38,32 @@ class WatcherConf(Conf):
         'type': None,
         'dps': None,
         'interval': 30,
+        'port_stats_history': 60,
+        # number of port_stats replies to keep in memory for rates (0 to disable)
         'db': None,
         'db_type': 'text',
         'file': None,
+        # file to write to (for text db_type)
+        'file_max_bytes': 0,
+        # rotate file when it reaches this size (0 to never rotate)
+        'file_backups': 5,
+        # number of rotated files to keep
+        'flow_dump_format': 'yaml',
+        # format of flow_table dumps to file: yaml, or jsonl (one flow per line)
+        'flow_dump_delta': False,
+        # dump only changes to flow_table since the last dump, apart from keyframes
+        'flow_dump_keyframe': 10,
+        # with flow_dump_delta, dump the whole flow_table every this many dumps
+        'flow_tables': None,
+        # flow_table tables to poll, by ID or Faucet table name (default all)
+        'flow_table_intervals': None,
+        # seconds between polls of each flow_table table (default interval)
+        'flow_cookie': 0,
+        # poll only flows with this cookie (under flow_cookie_mask)
+        'flow_cookie_mask': 0,
+        # bits of flow_cookie to match (0 to poll flows with any cookie)
+        'flow_match': None,
+        # poll only flows matching these fields (eg. {eth_type: 0x800})
         'influx_db': 'faucet',
         # influx database name
         'influx_host': 'localhost',
@@ -50,6 +75,20 @@ class WatcherConf(Conf):
         # influx password
         'influx_timeout': 10,
         # timeout on influx requests
+        'influx_batch_size': 1000,
+        # write to influx when this many points are queued
+        'influx_flush_interval': 5,
+        # write queued points to influx at least this often (seconds)
+        'influx_queue_size': 100000,
+        # max points queued for influx, before the oldest are dropped
+        'influx_max_backoff': 60,
+        # max seconds to back off retrying failed influx writes
+    }
+
+    defaults_types = {
+        'flow_tables': list,
+        'flow_table_intervals': dict,
+        'flow_match': dict,
     }
 
     def __init__(self, _id, conf):
@@ -70,3 +109,46 @@ class WatcherConf(Conf):
 
     def add_dp(self, dp):
         self.dp = dp
+
+    def flow_table_id(self, table):
+        """Return the ID of a table, given its ID or Faucet table name (eg. eth_src).
+
+        Returns:
+            int: table ID, or None if the DP has no such table.
+        """
+        if isinstance(table, int):
+            return table
+        dp_tables = self.dp.get_tables()
+        for table_name in (table, '%s_table' % table):
+            if isinstance(dp_tables.get(table_name, None), int):
+                return dp_tables[table_name]
+        return None
+
+    def check_config(self):
+        """Check flow stats options, so errors are found when config is loaded, not when polling."""
+        if self.flow_match:
+            try:
+                valve_of.match(self.flow_match)
+            except (KeyError, TypeError, ValueError) as err:
+                assert False, 'invalid flow_match %s: %s' % (self.flow_match, err)
+        table_intervals = self.flow_table_intervals or {}
+        for table in list(self.flow_tables or []) + list(table_intervals.keys()):
+            assert self.flow_table_id(table) is not None, 'unknown flow table %s' % table
+        if self.flow_tables:
+            unpolled_tables = set(table_intervals.keys()) - set(self.flow_tables)
+            assert not unpolled_tables, (
+                'flow_table_intervals for tables not in flow_tables: %s' % unpolled_tables)
+        for table, interval in list(table_intervals.items()):
+            assert isinstance(interval, int) and interval > 0, (
+                'flow_table_intervals %s must be a positive integer' % table)
+
+    def __hash__(self):
+        # A watcher's config is its own items and its DP's ID: DP config
+        # (eg. port names) can change without restarting the watcher, and
+        # the watcher is for one DP whatever other dps are listed.
+        items = [
+            (k, v) for k, v in sorted(list(self.__dict__.items()))
+            if k not in ('dp', 'dps')]
+        if self.dp is not None:
+            items.append(('dp_id', self.dp.dp_id))
+        return hash(frozenset(list(map(str, items))))
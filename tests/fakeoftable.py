@@ -30,6 +30,8 @@ class FakeOFTable():
         self.tables = []
         for i in range(0, num_tables):
             self.tables.append([])
+        # Meters whose rate is exceeded, which drop packets.
+        self.exceeded_meters = set()
 
     def apply_ofmsgs(self, ofmsgs):
         """This is used to update the fake flowtable.
@@ -97,6 +99,19 @@ class FakeOFTable():
                                 break
         self.sort_tables()
 
+    def flow_stats(self):
+        """Return all flow table entries, as a flow stats reply would."""
+        stats = []
+        for table_id, table in enumerate(self.tables):
+            for fte in table:
+                stats.append(parser.OFPFlowStats(
+                    table_id=table_id, duration_sec=0, duration_nsec=0,
+                    priority=fte.priority, idle_timeout=fte.idle_timeout,
+                    hard_timeout=fte.hard_timeout, flags=0, cookie=fte.cookie,
+                    packet_count=0, byte_count=0, match=fte.match,
+                    instructions=fte.instructions))
+        return stats
+
     def lookup(self, match):
         """Return the entries from flowmods that matches match.
 
@@ -109,7 +124,8 @@ class FakeOFTable():
                 entry to be considered matching.
 
         Returns: a list of the flowmods that will be applied to the packet
-                represented by match
+                represented by match. A packet dropped by an exceeded meter
+                gets only the instructions applied before the meter.
         """
         packet_dict = match.copy() # Packet headers may be modified
         instructions = []
@@ -127,12 +143,23 @@ class FakeOFTable():
             # if a flowmod is found, make modifications to the match values and
             # determine if another lookup is necessary
             if matching_fte:
+                # Meters apply before any other instruction.
+                for instruction in matching_fte.instructions:
+                    if (instruction.type == ofp.OFPIT_METER and
+                            instruction.meter_id in self.exceeded_meters):
+                        return instructions
                 for instruction in matching_fte.instructions:
                     instructions.append(instruction)
                     if instruction.type == ofp.OFPIT_GOTO_TABLE:
                         if table_id < instruction.table_id:
                             table_id = instruction.table_id
                             goto_table = True
+                    elif instruction.type == ofp.OFPIT_WRITE_METADATA:
+                        metadata = packet_dict.get('metadata', 0)
+                        mask = instruction.metadata_mask
+                        packet_dict['metadata'] = (
+                            (metadata & ~mask) |
+                            (instruction.metadata & mask))
                     elif instruction.type == ofp.OFPIT_APPLY_ACTIONS:
                         for action in instruction.actions:
                             if action.type == ofp.OFPAT_SET_FIELD:
@@ -236,6 +263,10 @@ class FlowMod(object):
         """flowmod is a ryu flow modification message object"""
         self.priority = flowmod.priority
         self.instructions = flowmod.instructions
+        self.match = flowmod.match
+        self.cookie = flowmod.cookie
+        self.idle_timeout = flowmod.idle_timeout
+        self.hard_timeout = flowmod.hard_timeout
         self.match_values = {}
         self.match_masks = {}
         self.out_port = None
@@ -285,7 +316,7 @@ class FlowMod(object):
                 return False
             else:
                 val_bits = self.match_to_bits(key, pkt_dict[key])
-                if val_bits != (val & self.match_masks[key]):
+                if (val_bits & self.match_masks[key]) != val:
                     return False
         return True
 
@@ -117,6 +117,10 @@ class FaucetTestBase(unittest.TestCase):
         self.faucet_config_path = self.env['faucet']['FAUCET_CONFIG']
         self.gauge_config_path = self.env['gauge']['GAUGE_CONFIG']
         self._set_prom_port()
+        gauge_prom_port, _ = faucet_mininet_test_util.find_free_port(
+            self.ports_sock, self._test_name())
+        self._set_var('gauge', 'GAUGE_PROMETHEUS_PORT', str(gauge_prom_port))
+        self._set_var('gauge', 'GAUGE_PROMETHEUS_ADDR', u'127.0.0.1')
         self.debug_log_path = os.path.join(
             self.tmpdir, 'ofchannel.log')
         self.monitor_stats_file = os.path.join(
@@ -21,6 +21,8 @@ import logging
 import sys
 import os
 import ipaddress
+import shutil
+import tempfile
 
 testdir = os.path.dirname(__file__)
 srcdir = '../'
@@ -28,6 +30,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
 
 import unittest
 from faucet.config_parser import dp_parser, watcher_parser
+from faucet.vlan import VLAN
 
 
 class DistConfigTestCase(unittest.TestCase):
@@ -115,6 +118,14 @@ class DistConfigTestCase(unittest.TestCase):
         self.assertEqual(
             list(edge_data_a.values()), list(edge_data_b.values()))
 
+    def test_shard(self):
+        switch1 = self.v2_dps_by_id[0xcafef00d]
+        switch2 = self.v2_dps_by_id[0xdeadbeef]
+        for shards in (1, 2, 3, 7):
+            self.assertEqual(0xcafef00d % shards, switch1.shard(shards))
+            # Stacked DPs share the stack root's shard.
+            self.assertEqual(switch1.shard(shards), switch2.shard(shards))
+
     def test_port_numbers(self):
         self.assertEqual(set(self.v2_dp.ports.keys()), set([1, 2, 3, 4, 5, 6, 7]))
 
@@ -213,6 +224,34 @@ class DistConfigTestCase(unittest.TestCase):
                 vlan.routes_by_ipv(4)
                 )
 
+    def test_vip_lookup(self):
+        faucet_vips = [
+            '10.0.0.254/24', '10.0.0.253/16', '10.1.0.254/24',
+            'fc00::1:254/112', 'fe80::1/64']
+        vlan = VLAN(100, 1, {'faucet_vips': faucet_vips})
+        for faucet_vip in faucet_vips:
+            faucet_vip = ipaddress.ip_interface(faucet_vip)
+            self.assertTrue(vlan.is_faucet_vip(faucet_vip.ip))
+            self.assertTrue(vlan.ip_in_vip_subnet(faucet_vip.ip))
+        for ipa, vips in (
+                ('10.0.0.1', ['10.0.0.254/24', '10.0.0.253/16']),
+                ('10.0.1.1', ['10.0.0.253/16']),
+                ('10.1.0.1', ['10.1.0.254/24']),
+                ('10.2.0.1', []),
+                ('fc00::1:1', ['fc00::1:254/112']),
+                ('fc00::2:1', []),
+                ('fe80::2', ['fe80::1/64'])):
+            ipa = ipaddress.ip_address(ipa)
+            self.assertFalse(vlan.is_faucet_vip(ipa))
+            self.assertEqual(bool(vips), vlan.ip_in_vip_subnet(ipa))
+            self.assertEqual(
+                [ipaddress.ip_interface(vip) for vip in vips],
+                vlan.vips_for_ip(ipa))
+        self.assertTrue(vlan.from_connected_to_vip(
+            ipaddress.ip_address('10.0.1.1'), ipaddress.ip_address('10.0.0.253')))
+        self.assertFalse(vlan.from_connected_to_vip(
+            ipaddress.ip_address('10.2.0.1'), ipaddress.ip_address('10.0.0.253')))
+
     def test_port_acl(self):
         for dp in (self.v2_dp,):
             self.assertIn(1, dp.port_acl_in)
@@ -262,5 +301,74 @@ class DistConfigTestCase(unittest.TestCase):
             self.assertEqual(watcher.interval, 40)
             self.assertEqual(watcher.file, 'flow_table.JSON')
 
+
+class ShardConfigTestCase(unittest.TestCase):
+
+    CONFIG = """
+vlans:
+    v100:
+        vid: 100
+dps:
+%s
+    stack_root:
+        dp_id: 5
+        hardware: 'Open vSwitch'
+        stack:
+            priority: 1
+        interfaces:
+            1:
+                native_vlan: v100
+            2:
+                stack:
+                    dp: stack_leaf
+                    port: 2
+    stack_leaf:
+        dp_id: 6
+        hardware: 'Open vSwitch'
+        interfaces:
+            1:
+                native_vlan: v100
+            2:
+                stack:
+                    dp: stack_root
+                    port: 2
+"""
+    DP_CONFIG = """
+    s%u:
+        dp_id: %u
+        hardware: 'Open vSwitch'
+        interfaces:
+            1:
+                native_vlan: v100
+"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config_file = os.path.join(self.tmpdir, 'faucet.yaml')
+        with open(config_file, 'w') as config:
+            config.write(self.CONFIG % ''.join(
+                [self.DP_CONFIG % (dp_id, dp_id) for dp_id in range(1, 5)]))
+        _, self.dps = dp_parser(config_file, 'test_config')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_partition(self):
+        """Test shards of one config control disjoint sets of all its DPs."""
+        all_dp_names = set([dp.name for dp in self.dps])
+        self.assertEqual(6, len(all_dp_names))
+        for shards in (2, 3):
+            shard_dp_names = [
+                set([dp.name for dp in self.dps if dp.shard(shards) == shard])
+                for shard in range(shards)]
+            self.assertEqual(all_dp_names, set.union(*shard_dp_names))
+            self.assertEqual(
+                len(all_dp_names), sum([len(dp_names) for dp_names in shard_dp_names]))
+            for dp_names in shard_dp_names:
+                self.assertTrue(dp_names)
+                # A stack is never split between shards.
+                self.assertEqual(
+                    'stack_root' in dp_names, 'stack_leaf' in dp_names)
+
 if __name__ == "__main__":
     unittest.main()
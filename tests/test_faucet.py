@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2015 Research and Innovation Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from prometheus_client import CollectorRegistry, Gauge
+
+testdir = os.path.dirname(__file__)
+srcdir = '../'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet import faucet
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeFaucet(object):
+    """Just the Faucet state used by _time_sliced_valves()."""
+
+    Metrics = namedtuple('Metrics', ('faucet_event_loop_lag',))
+    _time_sliced_valves = faucet.Faucet._time_sliced_valves
+
+    def __init__(self, dp_ids, event_slice_sec):
+        self.valves = dict((dp_id, 'valve%u' % dp_id) for dp_id in dp_ids)
+        self.event_slice_sec = event_slice_sec
+        self.registry = CollectorRegistry()
+        self.metrics = self.Metrics(Gauge(
+            'faucet_event_loop_lag_seconds', '', ['event'],
+            registry=self.registry))
+        self.events = []
+
+    def send_event(self, app_name, ryu_event):
+        self.events.append((app_name, ryu_event))
+
+
+class FaucetTimeSliceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(faucet, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handle(self, app, ryu_event, valve_sec):
+        """Handle ryu_event, taking valve_sec seconds for each Valve."""
+        handled = []
+        for dp_id, valve in app._time_sliced_valves(ryu_event):
+            self.assertEqual(app.valves[dp_id], valve)
+            handled.append(dp_id)
+            self.clock.now += valve_sec
+        return handled
+
+    def test_slice_stops(self):
+        """Test a slice stops when the time budget is exceeded, requeueing the rest."""
+        app = FakeFaucet(range(1, 6), 1)
+        self.assertEqual(
+            [1, 2], self.handle(app, faucet.EventFaucetHostExpire(), 0.6))
+        self.assertEqual(1, len(app.events))
+        app_name, requeued = app.events[0]
+        self.assertEqual('Faucet', app_name)
+        self.assertEqual(faucet.EventFaucetHostExpire, type(requeued))
+        self.assertEqual([3, 4, 5], requeued.dp_ids)
+        self.assertEqual(self.clock.now, requeued.queued_time)
+
+    def test_no_livelock(self):
+        """Test each slice handles at least one Valve, and each Valve once."""
+        app = FakeFaucet(range(1, 6), 0)
+        ryu_event = faucet.EventFaucetAdvertise()
+        handled = []
+        while ryu_event is not None:
+            slice_handled = self.handle(app, ryu_event, 10)
+            self.assertEqual(1, len(slice_handled))
+            handled.extend(slice_handled)
+            ryu_event = None
+            if app.events:
+                _, ryu_event = app.events.pop()
+                self.assertEqual(faucet.EventFaucetAdvertise, type(ryu_event))
+        self.assertEqual([1, 2, 3, 4, 5], handled)
+
+    def test_event_loop_lag(self):
+        """Test event loop lag is the time since the event was queued."""
+        app = FakeFaucet(range(1, 3), 1)
+        ryu_event = faucet.EventFaucetResolveGateways()
+        self.clock.now += 2.5
+        self.assertEqual([1, 2], self.handle(app, ryu_event, 0))
+        self.assertEqual(2.5, app.registry.get_sample_value(
+            'faucet_event_loop_lag_seconds',
+            {'event': 'EventFaucetResolveGateways'}))
+        self.assertEqual([], app.events)
+
+
+if __name__ == "__main__":
+    unittest.main()
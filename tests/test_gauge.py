@@ -0,0 +1,800 @@
+#!/usr/bin/env python
+
+"""Unit tests for Gauge watchers."""
+
+# Copyright (C) 2015 Research and Innovation Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+
+import couchdb
+import numpy
+from influxdb.line_protocol import make_lines
+from prometheus_client import REGISTRY
+from requests.exceptions import ReadTimeout
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+testdir = os.path.dirname(__file__)
+srcdir = '../'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet import gauge_file
+from faucet import gauge_flows
+from faucet import gauge_influx
+from faucet import gauge_poll
+from faucet import gauge_prom
+from faucet import gauge_rates
+from faucet.nsodbc import DatabaseCouch
+from faucet.watcher import (
+    GaugeFlowTableDBLogger, GaugeFlowTablePoller, GaugePortStatsInfluxDBPoller, GaugePortStatsPoller,
+    GaugePortStatsPrometheusPoller, watcher_factory)
+from faucet.watcher_conf import WatcherConf
+
+
+class FakeInfluxClient(object):
+    """Records points written, failing while fail is True."""
+
+    def __init__(self):
+        self.fail = False
+        self.writes = []
+        self.during_write = None
+
+    def write_points(self, points, time_precision=None, protocol=None):
+        if self.during_write is not None:
+            self.during_write()
+        if self.fail:
+            return False
+        self.writes.append(points)
+        return True
+
+
+class InfluxWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        conf = WatcherConf('influx_test', {
+            'influx_batch_size': 2, 'influx_queue_size': 4})
+        self.writer = gauge_influx.InfluxWriter(
+            conf, logging.getLogger('test_gauge'))
+        self.writer.client = FakeInfluxClient()
+        # Don't start a background thread, flush explicitly.
+        self.writer.thread = True
+
+    def test_batched_writes(self):
+        """Test queued points are written in batches."""
+        self.assertTrue(self.writer.ship([1, 2, 3]))
+        self.assertTrue(self.writer.flush_event.is_set())
+        self.assertTrue(self.writer.flush())
+        self.assertEqual([[1, 2], [3]], self.writer.client.writes)
+        self.assertFalse(self.writer.queue)
+
+    def test_failed_write_requeued(self):
+        """Test points are kept for retry, with the oldest dropped when full."""
+        self.writer.client.fail = True
+        self.assertTrue(self.writer.ship([1, 2, 3]))
+        self.assertFalse(self.writer.flush())
+        self.assertEqual([1, 2, 3], list(self.writer.queue))
+        self.assertFalse(self.writer.ship([4, 5]))
+        self.assertEqual([2, 3, 4, 5], list(self.writer.queue))
+        self.writer.client.fail = False
+        self.assertTrue(self.writer.flush())
+        self.assertEqual([[2, 3], [4, 5]], self.writer.client.writes)
+
+    def test_failed_write_dropped(self):
+        """Test points that no longer fit when requeued are counted as dropped."""
+        labels = {'influx': self.writer.name}
+        dropped_before = REGISTRY.get_sample_value(
+            'gauge_influx_points_dropped_total', labels) or 0
+        self.writer.client.fail = True
+        self.assertTrue(self.writer.ship([1, 2, 3]))
+        # Newer points arrive while the write of [1, 2] is in progress.
+        self.writer.client.during_write = lambda: self.writer.ship([4, 5])
+        self.assertFalse(self.writer.flush())
+        self.assertEqual([2, 3, 4, 5], list(self.writer.queue))
+        self.assertEqual(1, REGISTRY.get_sample_value(
+            'gauge_influx_points_dropped_total', labels) - dropped_before)
+
+    def test_write_timeout_requeued(self):
+        """Test a batch is kept for retry when InfluxDB is slow to reply."""
+
+        def timeout():
+            raise ReadTimeout('read timed out')
+
+        self.writer.client.during_write = timeout
+        self.assertTrue(self.writer.ship([1, 2, 3]))
+        self.assertFalse(self.writer.flush())
+        self.assertEqual([1, 2, 3], list(self.writer.queue))
+
+    def test_dead_thread_reset(self):
+        """Test ship() can start a new thread if the writer thread dies."""
+
+        def flush():
+            raise RuntimeError('unexpected')
+
+        self.writer.flush_interval = 0
+        self.writer.flush = flush
+        self.assertRaises(RuntimeError, self.writer)
+        self.assertEqual(None, self.writer.thread)
+
+
+class GaugeFileTestCase(unittest.TestCase):
+
+    FakeDatapath = namedtuple('FakeDatapath', ('ofproto',))
+
+    class FakeFlowStatsReply(object):
+
+        def __init__(self, flows, flags=0, xid=None):
+            self.flows = flows
+            self.flags = flags
+            self.xid = xid
+            self.datapath = GaugeFileTestCase.FakeDatapath(ofp)
+
+        def to_jsondict(self):
+            return {'OFPFlowStatsReply': {'body': self.flows}}
+
+    FakeDP = namedtuple('FakeDP', ('dp_id', 'name'))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'gauge.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def poll(poller):
+        """Request all flows, and return the xid of the request."""
+        if poller.ryudp is None:
+            poller.ryudp = GaugeFlowStatsFilterTestCase.FakeRyuDP()
+        poller.table_next_poll = {}
+        poller.send_req()
+        return poller.ryudp.reqs[-1].xid
+
+    def test_rotate(self):
+        """Test files are rotated by size, keeping only backups old files."""
+        writer = gauge_file.FileWriter(self.path, max_bytes=10, backups=2)
+        for i in range(4):
+            writer.writelines(['%u23456789\n' % i])
+        writer.close()
+        self.assertFalse(os.path.exists(self.path))
+        with open('%s.1' % self.path) as log_file:
+            self.assertEqual('323456789\n', log_file.read())
+        with open('%s.2' % self.path) as log_file:
+            self.assertEqual('223456789\n', log_file.read())
+        self.assertFalse(os.path.exists('%s.3' % self.path))
+
+    def test_moved(self):
+        """Test a file moved away (eg. by logrotate) is reopened."""
+        writer = gauge_file.FileWriter(self.path)
+        writer.writelines(['1\n'])
+        os.rename(self.path, '%s.old' % self.path)
+        writer.writelines(['2\n'])
+        os.remove(self.path)
+        writer.writelines(['3\n'])
+        writer.close()
+        with open('%s.old' % self.path) as log_file:
+            self.assertEqual('1\n', log_file.read())
+        with open(self.path) as log_file:
+            self.assertEqual('3\n', log_file.read())
+
+    def test_flow_dump_jsonl(self):
+        """Test flow tables can be dumped one flow per line."""
+        conf = WatcherConf('flow_table_test', {
+            'type': 'flow_table', 'file': self.path,
+            'flow_dump_format': 'jsonl'})
+        conf.add_dp(self.FakeDP(1, 'dp1'))
+        poller = GaugeFlowTablePoller(conf, 'test_gauge')
+        flows = [{'OFPFlowStats': {'priority': i}} for i in range(3)]
+        xid = self.poll(poller)
+        poller.update(time.time(), 1, self.FakeFlowStatsReply(flows, xid=xid))
+        gauge_file.file_writer(conf).close()
+        with open(self.path) as log_file:
+            dumped = [json.loads(line) for line in log_file]
+        self.assertEqual(flows, [line['flow'] for line in dumped])
+        self.assertEqual(['dp1-flowtables'] * 3, [line['ref'] for line in dumped])
+
+
+    def test_flow_dump_delta(self):
+        """Test flow table dumps are written as changes between keyframes."""
+        conf = WatcherConf('flow_table_test', {
+            'type': 'flow_table', 'file': self.path,
+            'flow_dump_format': 'jsonl', 'flow_dump_delta': True})
+        conf.add_dp(self.FakeDP(1, 'dp1'))
+        poller = GaugeFlowTablePoller(conf, 'test_gauge')
+        flows = [flow(0, i) for i in range(2)]
+        xid = self.poll(poller)
+        poller.update(time.time(), 1, self.FakeFlowStatsReply(
+            flows[:1], flags=ofp.OFPMPF_REPLY_MORE, xid=xid))
+        poller.update(time.time(), 1, self.FakeFlowStatsReply(flows[1:], xid=xid))
+        poller.update(time.time(), 1, self.FakeFlowStatsReply(
+            [flow(0, 0), flow(0, 2)], xid=self.poll(poller)))
+        gauge_file.file_writer(conf).close()
+        with open(self.path) as log_file:
+            dumped = [json.loads(line) for line in log_file]
+        self.assertEqual(
+            [('flow', flows[0]), ('flow', flows[1]),
+             ('added', flow(0, 2)), ('removed', flows[1])],
+            [[(change, line[change]) for change in line
+              if change not in ('time', 'ref')][0] for line in dumped])
+
+
+def flow(table_id, priority, packet_count=0):
+    return {'OFPFlowStats': {
+        'table_id': table_id, 'priority': priority,
+        'match': {'OFPMatch': {'oxm_fields': []}},
+        'packet_count': packet_count, 'byte_count': packet_count * 64}}
+
+
+class GaugeFlowStatsFilterTestCase(unittest.TestCase):
+
+    class FakeDP(object):
+
+        dp_id = 1
+        name = 'dp1'
+
+        @staticmethod
+        def get_tables():
+            return {'vlan_table': 1, 'eth_src_table': 2, 'group_table': False}
+
+    class FakeRyuDP(object):
+
+        ofproto = ofp
+        ofproto_parser = parser
+
+        def __init__(self):
+            self.reqs = []
+
+        def send_msg(self, msg):
+            msg.xid = len(self.reqs) + 1
+            self.reqs.append(msg)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'gauge.txt')
+        conf = WatcherConf('flow_table_test', {
+            'type': 'flow_table', 'file': self.path, 'interval': 30,
+            'flow_dump_format': 'jsonl', 'flow_dump_delta': True,
+            'flow_tables': ['eth_src', 4],
+            'flow_table_intervals': {'eth_src': 10},
+            'flow_cookie': 0x5ab, 'flow_cookie_mask': 0xfff,
+            'flow_match': {'eth_type': 0x800}})
+        conf.add_dp(self.FakeDP())
+        self.poller = GaugeFlowTablePoller(conf, 'test_gauge')
+        self.poller.ryudp = self.FakeRyuDP()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_table_requests(self):
+        """Test tables are requested, filtered, at their own intervals."""
+        self.assertEqual(10, self.poller.poll_interval())
+        self.poller.send_req()
+        reqs = self.poller.ryudp.reqs
+        self.assertEqual([2, 4], [req.table_id for req in reqs])
+        for req in reqs:
+            self.assertEqual((0x5ab, 0xfff), (req.cookie, req.cookie_mask))
+            self.assertEqual(0x800, req.match['eth_type'])
+        self.poller.send_req()
+        self.assertEqual(2, len(reqs))
+        for table_id in self.poller.table_next_poll:
+            self.poller.table_next_poll[table_id] -= 10
+        self.poller.send_req()
+        self.assertEqual([2, 4, 2], [req.table_id for req in reqs])
+
+    def test_nothing_due(self):
+        """Test no reply is expected from a poll when no table was due."""
+        timeouts = []
+        self.poller.no_response = lambda: timeouts.append(True)
+        self.poller.poll(time.time())
+        self.assertTrue(self.poller.reply_pending)
+        reply = GaugeFileTestCase.FakeFlowStatsReply
+        self.poller.update(time.time(), 1, reply([flow(2, 1)], xid=1))
+        self.poller.update(time.time(), 1, reply([flow(4, 1)], xid=2))
+        self.poller.poll(time.time())
+        self.assertEqual(2, len(self.poller.ryudp.reqs))
+        self.assertFalse(self.poller.reply_pending)
+        self.poller.poll(time.time())
+        self.assertEqual([], timeouts)
+
+    def test_check_config(self):
+        """Test bad flow stats options are found when config is loaded."""
+        self.poller.conf.check_config()
+        for bad_conf in (
+                {'flow_match': {'eth_typ': 0x800}},
+                {'flow_tables': ['eth_src', 'no_such']},
+                {'flow_table_intervals': {'vlan': 10}},
+                {'flow_table_intervals': {'eth_src': 0}}):
+            conf = WatcherConf('flow_table_test', dict(
+                self.poller.conf.to_conf(), **bad_conf))
+            conf.add_dp(self.FakeDP())
+            self.assertRaises(AssertionError, conf.check_config)
+
+    def test_table_deltas(self):
+        """Test flow dump deltas are kept per table."""
+        self.poller.send_req()
+        reply = GaugeFileTestCase.FakeFlowStatsReply
+        self.poller.update(time.time(), 1, reply([flow(2, 1)], xid=1))
+        self.poller.update(time.time(), 1, reply([flow(4, 1)], xid=2))
+        self.poller.send_req()
+        for table_id in self.poller.table_next_poll:
+            self.poller.table_next_poll[table_id] -= 30
+        self.poller.send_req()
+        self.poller.update(time.time(), 1, reply([flow(2, 1), flow(2, 2)], xid=3))
+        self.assertEqual({4: 4}, self.poller.req_tables)
+        gauge_file.file_writer(self.poller.conf).close()
+        with open(self.path) as log_file:
+            dumped = [json.loads(line) for line in log_file]
+        self.assertEqual(
+            [('flow', flow(2, 1)), ('flow', flow(4, 1)), ('added', flow(2, 2))],
+            [(change, line[change]) for line in dumped
+             for change in ('flow', 'added', 'removed') if change in line])
+
+
+class FlowSnapshotTestCase(unittest.TestCase):
+
+    def test_deltas(self):
+        """Test flows added, removed and counter deltas are found."""
+        snapshot = gauge_flows.FlowSnapshot(3)
+        self.assertEqual(
+            {'keyframe': True, 'flows': [flow(0, 1, 5)]},
+            snapshot.update([flow(0, 1, 5)]))
+        dump = snapshot.update([flow(0, 1, 7), flow(1, 1)])
+        self.assertEqual([flow(1, 1)], dump['added'])
+        self.assertEqual([], dump['removed'])
+        self.assertEqual(
+            [{'table_id': 0, 'priority': 1,
+              'match': {'OFPMatch': {'oxm_fields': []}},
+              'packet_count': 2, 'byte_count': 128}],
+            dump['counters'])
+        dump = snapshot.update([flow(0, 1, 7)])
+        self.assertEqual(
+            {'keyframe': False, 'added': [], 'removed': [flow(1, 1)],
+             'counters': []},
+            dump)
+        self.assertTrue(snapshot.update([flow(0, 1, 7)])['keyframe'])
+
+
+class FakeCouchDatabase(object):
+    """In memory CouchDB database, supporting bulk updates."""
+
+    Row = namedtuple('Row', ('id', 'value'))
+
+    def __init__(self):
+        self.docs = {}
+        self.requests = 0
+
+    def update(self, docs):
+        self.requests += 1
+        results = []
+        for doc in docs:
+            doc_id = doc['_id']
+            if doc_id in self.docs and doc.get('_rev') != self.docs[doc_id]['_rev']:
+                results.append((False, doc_id, couchdb.http.ResourceConflict()))
+                continue
+            rev = '%u-x' % (int(self.docs.get(doc_id, {'_rev': '0-x'})['_rev'][0]) + 1)
+            if doc.get('_deleted', False):
+                del self.docs[doc_id]
+            else:
+                self.docs[doc_id] = dict(doc, _rev=rev)
+            results.append((True, doc_id, rev))
+        return results
+
+    def save(self, doc):
+        success, doc_id, rev = self.update([doc])[0]
+        if not success:
+            raise rev
+        return doc_id, rev
+
+    def get(self, doc_id):
+        return dict(self.docs[doc_id])
+
+    def view(self, view_url, keys=None, startkey=None, endkey=None):
+        self.requests += 1
+        if keys is None:
+            keys = sorted([
+                doc_id for doc_id in self.docs if startkey <= doc_id <= endkey])
+        return [
+            self.Row(doc_id, {'rev': self.docs[doc_id]['_rev']} if doc_id in self.docs else None)
+            for doc_id in keys]
+
+
+class DatabaseCouchTestCase(unittest.TestCase):
+
+    def test_insert_update_docs(self):
+        """Test docs are saved in bulk, refetching revs of conflicting docs."""
+        fake_db = FakeCouchDatabase()
+        database = DatabaseCouch(fake_db)
+        revs = database.insert_update_docs([
+            {'_id': 'a-%u' % i, 'data': i} for i in range(3)])
+        self.assertEqual(1, fake_db.requests)
+        self.assertEqual({'a-0': '1-x', 'a-1': '1-x', 'a-2': '1-x'}, revs)
+        self.assertEqual(revs, database.get_revs('a-'))
+        # Without revs (eg. after a restart), docs are retried once.
+        fake_db.requests = 0
+        revs = database.insert_update_docs([
+            {'_id': 'a-0', 'data': 5}, {'_id': 'a-3', 'data': 3},
+            {'_id': 'a-1', '_rev': '1-x', '_deleted': True}])
+        self.assertEqual(3, fake_db.requests)
+        self.assertEqual({'a-0': '2-x', 'a-1': '2-x', 'a-3': '1-x'}, revs)
+        self.assertEqual(['a-0', 'a-2', 'a-3'], sorted(fake_db.docs.keys()))
+        self.assertEqual(5, fake_db.docs['a-0']['data'])
+
+
+class GaugeFlowTableDBLoggerTestCase(unittest.TestCase):
+
+    class FakeDBLogger(GaugeFlowTableDBLogger):
+
+        def setup(self):
+            self.flow_database = DatabaseCouch(FakeCouchDatabase())
+            self.switch_database = DatabaseCouch(FakeCouchDatabase())
+            self.db_update_counter = self.conf.db_update_counter
+
+    def test_unexpected_reply(self):
+        """Test replies to unknown requests do not replace any flow documents."""
+        conf = WatcherConf('flow_table_test', {
+            'type': 'flow_table', 'flow_tables': [1, 2]})
+        conf.db_update_counter = 1
+        conf.add_dp(GaugeFileTestCase.FakeDP(1, 'dp1'))
+        poller = self.FakeDBLogger(conf, 'test_gauge')
+        poller.ryudp = GaugeFlowStatsFilterTestCase.FakeRyuDP()
+        poller.send_req()
+        reply = GaugeFileTestCase.FakeFlowStatsReply
+        poller.update(time.time(), 1, reply([flow(1, 1)], xid=1))
+        poller.update(time.time(), 1, reply([flow(2, 1)], xid=2))
+        flow_docs = poller.flow_database.database.docs
+        self.assertEqual(2, len(flow_docs))
+        # A duplicate reply, and a reply to a request from before a reload.
+        poller.update(time.time(), 1, reply([], xid=1))
+        poller.update(time.time(), 1, reply([], xid=99))
+        self.assertEqual(2, len(flow_docs))
+        self.assertEqual(
+            sorted(flow_docs.keys()),
+            poller.switch_database.database.docs['0x1']['data']['flows'])
+        # An expected empty reply removes only its own table's flows.
+        poller.table_next_poll = {}
+        poller.send_req()
+        poller.update(time.time(), 1, reply([], xid=3))
+        self.assertEqual(
+            [flow(2, 1)], [doc['data'] for doc in list(flow_docs.values())])
+
+
+class GaugePortStatsTestBase(unittest.TestCase):
+
+    FakeDatapath = namedtuple('FakeDatapath', ('ofproto',))
+    FakePortStatsReply = namedtuple('FakePortStatsReply', ('datapath', 'body', 'xid'))
+    FakePort = namedtuple('FakePort', ('name',))
+    FakeDP = namedtuple('FakeDP', ('dp_id', 'name', 'ports'))
+    NUM_PORTS = 500
+    RCV_TIME = 1500000000.5
+
+    def setUp(self):
+        conf = WatcherConf('port_stats_test', {
+            'type': 'port_stats', 'db_type': 'influx', 'interval': 10})
+        conf.add_dp(self.FakeDP(1, 'dp 1', dict(
+            (port_no, self.FakePort('port%u' % port_no))
+            for port_no in range(1, self.NUM_PORTS + 1))))
+        self.poller = GaugePortStatsInfluxDBPoller(conf, 'test_gauge')
+        self.msg = self.FakePortStatsReply(
+            self.FakeDatapath(ofp),
+            [self.port_stat(port_no)
+             for port_no in range(1, self.NUM_PORTS + 1)], 1)
+
+    @staticmethod
+    def port_stat(port_no):
+        return parser.OFPPortStats(
+            port_no=port_no, rx_packets=port_no, tx_packets=2**63 + port_no,
+            rx_bytes=port_no * 64, tx_bytes=port_no * 128,
+            rx_dropped=2**64-1, tx_dropped=0, rx_errors=1, tx_errors=0,
+            rx_frame_err=0, rx_over_err=0, rx_crc_err=0, collisions=0,
+            duration_sec=0, duration_nsec=0)
+
+    def json_points(self):
+        """The previous encoding, of one point dict per statistic."""
+        points = []
+        for stat in self.msg.body:
+            port_name = self.poller._stat_port_name(self.msg, stat, 1)
+            for stat_name, stat_val in self.poller._format_port_stats('_', stat):
+                points.append({
+                    'measurement': stat_name,
+                    'tags': {'dp_name': self.poller.dp.name, 'port_name': port_name},
+                    'time': int(self.RCV_TIME),
+                    'fields': {'value': float(stat_val)}})
+        return points
+
+
+class GaugePortStatsInfluxTestCase(GaugePortStatsTestBase):
+
+    @staticmethod
+    def _parse_line(line):
+        series, value_time = line.split(' value=')
+        value, point_time = value_time.split(' ')
+        return (series, float(value), int(point_time))
+
+    def test_port_stats_lines(self):
+        """Test port stats lines are equivalent to the previous point dicts."""
+        lines = self.poller.port_stats_lines(self.RCV_TIME, 1, self.msg)
+        self.assertEqual(6 * self.NUM_PORTS, len(lines))
+        self.assertEqual(
+            'packets_out,dp_name=dp\\ 1,port_name=port1 value=%u %u' % (
+                2**63 + 1, int(self.RCV_TIME)),
+            lines[0])
+        json_lines = make_lines({'points': self.json_points()}).splitlines()
+        self.assertEqual(
+            [self._parse_line(line) for line in json_lines],
+            [self._parse_line(line) for line in lines])
+
+    def test_escape_tag(self):
+        """Test tag values are escaped."""
+        self.assertEqual(
+            ',a\\ b=c\\,d\\=e',
+            gauge_influx.encode_tags((('a b', 'c,d=e'),)))
+
+
+class GaugePortStatsInfluxBenchmarkTestCase(GaugePortStatsTestBase):
+
+    ITERATIONS = 20
+
+    def _replies_per_sec(self, encoder):
+        start_time = time.time()
+        for _ in range(self.ITERATIONS):
+            encoder()
+        return self.ITERATIONS / (time.time() - start_time)
+
+    def test_port_stats_encode_rate(self):
+        """Test line protocol encodes 500 port stats replies at least 4x faster."""
+        json_rps = self._replies_per_sec(
+            lambda: make_lines({'points': self.json_points()}))
+        line_rps = self._replies_per_sec(
+            lambda: '\n'.join(
+                self.poller.port_stats_lines(self.RCV_TIME, 1, self.msg)))
+        # Typically 15-19x, so a slow or busy host should not fail this.
+        self.assertGreater(
+            line_rps, 4 * json_rps,
+            msg='point dicts: %.1f replies/s, line protocol: %.1f replies/s' % (
+                json_rps, line_rps))
+
+
+class PortStatsHistoryTestCase(unittest.TestCase):
+
+    FakePortStats = namedtuple(
+        'FakePortStats', ['port_no'] + [attr for _, attr in gauge_rates.PORT_STATS])
+
+    def port_stats(self, port_no, value):
+        return self.FakePortStats(
+            port_no, *([value] * len(gauge_rates.PORT_STATS)))
+
+    def test_rates(self):
+        """Test rates are computed across wraps, resets and unsupported counters."""
+        history = gauge_rates.PortStatsHistory(1, 3)
+        history.update(100, [self.port_stats(1, 2**64 - 100), self.port_stats(2, 1000)])
+        self.assertEqual({}, history.latest_rates())
+        history.update(110, [self.port_stats(1, 900), self.port_stats(2, 10)])
+        history.update(120, [
+            self.port_stats(1, 2**64-1), self.port_stats(2, 110), self.port_stats(3, 5)])
+        history.update(130, [self.port_stats(1, 1000), self.port_stats(2, 310)])
+        times, rates = history.history(2, 'bytes_in')
+        self.assertEqual([110, 120, 130], list(times))
+        # A reset (1000 to 10) is counted from 0.
+        self.assertEqual([1, 10, 20], list(rates))
+        times, rates = history.history(1, 'bytes_in')
+        # A wrap (2**64 - 100 to 900) is counted across the wrap.
+        self.assertEqual(100, rates[0])
+        self.assertTrue(numpy.isnan(rates[1:]).all())
+        self.assertEqual({2: 20}, dict(
+            (port_no, port_rates['packets_out'])
+            for port_no, port_rates in list(history.latest_rates().items())))
+
+    def test_export(self):
+        """Test rates are exported to Prometheus from port stats replies."""
+        conf = WatcherConf('port_stats_test', {
+            'type': 'port_stats', 'interval': 10, 'file': os.devnull})
+        conf.add_dp(GaugePortStatsTestBase.FakeDP(
+            0xabc, 'dp1', {1: GaugePortStatsTestBase.FakePort('port1')}))
+        poller = GaugePortStatsPoller(conf, 'test_gauge')
+        msg = GaugePortStatsTestBase.FakePortStatsReply(
+            GaugePortStatsTestBase.FakeDatapath(ofp),
+            [self.port_stats(1, 0), self.port_stats(2, 0)], 1)
+        poller.update(100, 0xabc, msg)
+        msg.body[:] = [self.port_stats(1, 50), self.port_stats(2, 50)]
+        poller.update(110, 0xabc, msg)
+        self.assertEqual(5, REGISTRY.get_sample_value(
+            'gauge_port_stats_rate',
+            {'dp_id': '0xabc', 'dp_name': 'dp1', 'port_name': 'port1',
+             'counter': 'bytes_out'}))
+        # Port 2 is not configured, so has no name to export.
+        self.assertEqual([], [
+            sample for metric in REGISTRY.collect()
+            if metric.name == 'gauge_port_stats_rate'
+            for sample in metric.samples
+            if sample[1]['dp_id'] == '0xabc' and sample[1]['port_name'] != 'port1'])
+
+
+class GaugePrometheusTestCase(GaugePortStatsTestBase):
+
+    NUM_PORTS = 2
+
+    def test_port_stats(self):
+        """Test port stats are exported with cached labels per port."""
+        conf = WatcherConf('port_stats_test', {
+            'type': 'port_stats', 'db_type': 'prometheus', 'interval': 10})
+        conf.add_dp(self.poller.dp)
+        self.assertEqual(GaugePortStatsPrometheusPoller, watcher_factory(conf))
+        poller = GaugePortStatsPrometheusPoller(conf, 'test_gauge')
+        poller.update(self.RCV_TIME, 1, self.msg)
+        labels = {'dp_id': '0x1', 'dp_name': 'dp 1', 'port_name': 'port2'}
+        self.assertEqual(128, REGISTRY.get_sample_value('of_port_bytes_in', labels))
+        self.assertEqual(float(2**63 + 2), REGISTRY.get_sample_value(
+            'of_port_packets_out', labels))
+        # UINT64_MAX (unsupported) is not exported.
+        self.assertEqual(None, REGISTRY.get_sample_value('of_port_dropped_in', labels))
+        port_metric = poller.port_metric(gauge_prom.PROM_PORT_STATS['bytes_in'], 'port2')
+        poller.update(self.RCV_TIME + 10, 1, self.msg)
+        self.assertTrue(port_metric is poller.port_metric(
+            gauge_prom.PROM_PORT_STATS['bytes_in'], 'port2'))
+        # Renamed DP on reload.
+        poller.dp = self.FakeDP(1, 'dp renamed', self.poller.dp.ports)
+        poller.update(self.RCV_TIME + 20, 1, self.msg)
+        self.assertEqual(128, REGISTRY.get_sample_value('of_port_bytes_in', {
+            'dp_id': '0x1', 'dp_name': 'dp renamed', 'port_name': 'port2'}))
+
+
+class WatcherConfTestCase(unittest.TestCase):
+
+    FakeDP = namedtuple('FakeDP', ('dp_id', 'name', 'ports'))
+
+    def watcher_conf(self, dp, **kwargs):
+        watcher_conf = {'type': 'port_stats', 'dps': ['dp1', 'dp2'], 'interval': 10}
+        watcher_conf.update(kwargs)
+        conf = WatcherConf('port_stats_poller', watcher_conf)
+        conf.add_db({'type': 'influx', 'influx_host': 'influx'})
+        conf.add_dp(dp)
+        return conf
+
+    def test_reload_equal(self):
+        """Test which config changes require a watcher to be restarted."""
+        conf = self.watcher_conf(self.FakeDP(1, 'dp1', {1: 'port1'}))
+        # Unchanged, apart from the DP's own config.
+        self.assertEqual(conf, self.watcher_conf(self.FakeDP(1, 'dp1', {1: 'port2'})))
+        self.assertEqual(conf, self.watcher_conf(
+            self.FakeDP(1, 'dp1', {}), dps=['dp1']))
+        # Changed.
+        self.assertNotEqual(conf, self.watcher_conf(self.FakeDP(2, 'dp2', {})))
+        self.assertNotEqual(conf, self.watcher_conf(
+            self.FakeDP(1, 'dp1', {}), interval=20))
+
+
+class GaugePollSchedulerTestCase(unittest.TestCase):
+
+    FakeDP = namedtuple('FakeDP', ('dp_id', 'name'))
+
+    class FakePoller(object):
+
+        def __init__(self, dp, conf):
+            self.dp = dp
+            self.conf = conf
+            self.logger = logging.getLogger('test_gauge')
+            self.polls = []
+            self.error = None
+
+        def poll_interval(self):
+            return self.conf.interval
+
+        def poll(self, now):
+            if self.error is not None:
+                raise self.error
+            self.polls.append(now)
+
+    def poller(self, dp_id, watcher_type='port_stats', interval=10):
+        conf = WatcherConf('poll_test', {'type': watcher_type, 'interval': interval})
+        return self.FakePoller(self.FakeDP(dp_id, 'dp%u' % dp_id), conf)
+
+    def test_poll_offset(self):
+        """Test poll offsets are deterministic and spread across the interval."""
+        offsets = [
+            gauge_poll.poll_offset(dp_id, 'port_stats', 10)
+            for dp_id in range(1, 1001)]
+        self.assertEqual(
+            offsets,
+            [gauge_poll.poll_offset(dp_id, 'port_stats', 10)
+             for dp_id in range(1, 1001)])
+        for second in range(10):
+            in_second = [
+                offset for offset in offsets if second <= offset < second + 1]
+            self.assertTrue(50 < len(in_second) < 150)
+
+    def test_schedule(self):
+        """Test pollers are polled at their offset, once per interval."""
+        scheduler = gauge_poll.GaugePollScheduler()
+        scheduler.thread = True
+        poller = self.poller(1)
+        offset = gauge_poll.poll_offset(1, 'port_stats', 10)
+        scheduler.add(poller, now=1000)
+        self.assertTrue(scheduler.scheduled(poller))
+        self.assertEqual([], scheduler.due(1000 + offset - 0.001))
+        self.assertEqual([poller], scheduler.due(1000 + offset))
+        self.assertEqual([], scheduler.due(1000 + offset + 9))
+        self.assertEqual([poller], scheduler.due(1010 + offset))
+        scheduler.remove(poller)
+        self.assertFalse(scheduler.scheduled(poller))
+        self.assertEqual([], scheduler.due(1020 + offset))
+
+    def test_poll_error(self):
+        """Test a poller raising an error does not stop other polls."""
+        scheduler = gauge_poll.GaugePollScheduler()
+        scheduler.thread = True
+        bad_poller = self.poller(1)
+        bad_poller.error = KeyError('unknown OXM field')
+        poller = self.poller(2)
+        scheduler.add(bad_poller, now=1000)
+        scheduler.add(poller, now=1000)
+        with self.assertLogs('test_gauge', level='ERROR'):
+            scheduler.poll_due(1020)
+        self.assertEqual([1020], poller.polls)
+        self.assertTrue(scheduler.scheduled(bad_poller))
+        with self.assertLogs('test_gauge', level='ERROR'):
+            scheduler.poll_due(1030)
+        self.assertEqual([1020, 1030], poller.polls)
+
+    FakeReq = namedtuple('FakeReq', ('xid',))
+
+    def slow_dp_poller(self, latency, duration=600):
+        """Return a poller, polled for duration seconds by a DP that replies after latency."""
+        conf = WatcherConf('poll_test', {
+            'type': 'flow_table', 'interval': 10, 'file': os.devnull})
+        conf.add_dp(self.FakeDP(1, 'dp1'))
+        poller = GaugeFlowTablePoller(conf, 'test_gauge')
+        reqs = []
+
+        def send_req():
+            reqs.append(self.FakeReq(len(reqs) + 1))
+            return reqs[-1:]
+
+        poller.send_req = send_req
+        scheduler = gauge_poll.GaugePollScheduler()
+        scheduler.thread = True
+        scheduler.add(poller, now=0)
+        replies = []
+        for now in range(duration):
+            while replies and replies[0][0] <= now:
+                rcv_time, xid = replies.pop(0)
+                poller.reply_received(rcv_time, xid)
+            for due_poller in scheduler.due(now):
+                due_poller.poll(now)
+                replies.append((now + latency, reqs[-1].xid))
+        return poller
+
+    def test_slow_dp(self):
+        """Test polls are spaced out for DPs that are slow to reply."""
+        poller = self.slow_dp_poller(8)
+        self.assertEqual(8, poller.reply_latency)
+        self.assertEqual(16, poller.poll_interval())
+        # Replies arrive after the next poll would have been sent.
+        poller = self.slow_dp_poller(15)
+        self.assertEqual(15, poller.reply_latency)
+        self.assertEqual(30, poller.poll_interval())
+        # Only requests that may still be answered are remembered.
+        self.assertTrue(len(poller.req_times) <= 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""Unit tests for the Gauge Ryu app."""
+
+# Copyright (C) 2015 Research and Innovation Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+testdir = os.path.dirname(__file__)
+srcdir = '../'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet import gauge
+from faucet import gauge_poll
+
+
+FAUCET_CONFIG = """
+version: 2
+dps:
+    s1:
+        dp_id: 1
+        hardware: 'Open vSwitch'
+        interfaces:
+            1:
+                native_vlan: v100
+            2:
+                native_vlan: v100
+vlans:
+    v100:
+        vid: 0x100
+"""
+
+WATCHERS = {
+    'port_stats': """
+    port_stats:
+        dps: ['s1']
+        type: 'port_stats'
+        interval: %u
+        db: 'stats_file'
+""",
+    'port_state': """
+    port_state:
+        dps: ['s1']
+        type: 'port_state'
+        db: 'state_file'
+""",
+    'flow_table': """
+    flow_table:
+        dps: ['s1']
+        type: 'flow_table'
+        interval: 10
+        db: 'flow_file'
+"""}
+
+GAUGE_CONFIG = """
+version: 2
+faucet_configs:
+    - %s
+watchers:
+%s
+dbs:
+    stats_file:
+        type: 'text'
+        file: %s
+    state_file:
+        type: 'text'
+        file: %s
+    flow_file:
+        type: 'text'
+        file: %s
+"""
+
+
+class FakeGauge(object):
+    """Just the Gauge state used by reload_config()."""
+
+    logname = 'test_gauge_app'
+    _load_config = gauge.Gauge._load_config
+    reload_config = gauge.Gauge.reload_config
+
+    def __init__(self, config_file, ryu_dps):
+        self.config_file = config_file
+        self.logger = logging.getLogger(self.logname)
+        self.dpset = ryu_dps
+        self.watchers = self._load_config()
+
+
+class GaugeReloadTestCase(unittest.TestCase):
+
+    DP_ID = 1
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.faucet_config_file = os.path.join(self.tmpdir, 'faucet.yaml')
+        with open(self.faucet_config_file, 'w') as config_file:
+            config_file.write(FAUCET_CONFIG)
+        self.config_file = os.path.join(self.tmpdir, 'gauge.yaml')
+        self.write_config(port_stats_interval=10)
+        # Poll from the test, not from a background thread.
+        self.scheduler = gauge_poll.GaugePollScheduler()
+        self.scheduler.thread = True
+        patcher = mock.patch.object(gauge_poll, '_SCHEDULER', self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env_patcher = mock.patch.dict(os.environ)
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        os.environ.pop('GAUGE_CONFIG', None)
+        self.app = FakeGauge(self.config_file, {self.DP_ID: object()})
+        for watcher in list(self.app.watchers[self.DP_ID].values()):
+            watcher.start(self.app.dpset[self.DP_ID])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_config(self, port_stats_interval, watcher_types=None):
+        if watcher_types is None:
+            watcher_types = sorted(WATCHERS.keys())
+        watchers = ''.join(
+            WATCHERS[watcher_type] for watcher_type in watcher_types)
+        watchers = watchers.replace(
+            WATCHERS['port_stats'], WATCHERS['port_stats'] % port_stats_interval)
+        with open(self.config_file, 'w') as config_file:
+            config_file.write(GAUGE_CONFIG % (
+                self.faucet_config_file,
+                watchers,
+                os.path.join(self.tmpdir, 'stats.txt'),
+                os.path.join(self.tmpdir, 'state.txt'),
+                os.path.join(self.tmpdir, 'flows.txt')))
+
+    def watcher(self, watcher_type):
+        return self.app.watchers.get(self.DP_ID, {}).get(watcher_type, None)
+
+    def test_unchanged_kept(self):
+        """Test unchanged watchers are kept, without restarting polling."""
+        old_watchers = dict(self.app.watchers[self.DP_ID])
+        poller = old_watchers['port_stats']
+        # A restarted poller would be rescheduled.
+        self.scheduler.next_poll[poller] = 1234
+        self.app.reload_config(None)
+        for watcher_type, watcher in list(old_watchers.items()):
+            self.assertIs(watcher, self.watcher(watcher_type))
+        self.assertEqual(1234, self.scheduler.next_poll[poller])
+
+    def test_changed_replaced(self):
+        """Test a changed watcher is stopped, and replaced by a new one."""
+        old_poller = self.watcher('port_stats')
+        old_flow_poller = self.watcher('flow_table')
+        self.write_config(port_stats_interval=20)
+        self.app.reload_config(None)
+        new_poller = self.watcher('port_stats')
+        self.assertIsNot(old_poller, new_poller)
+        self.assertFalse(old_poller.running())
+        self.assertTrue(new_poller.running())
+        self.assertEqual(20, new_poller.poll_interval())
+        self.assertIs(old_flow_poller, self.watcher('flow_table'))
+        self.assertTrue(old_flow_poller.running())
+
+    def test_removed_stopped(self):
+        """Test a removed watcher is stopped."""
+        old_flow_poller = self.watcher('flow_table')
+        self.write_config(
+            port_stats_interval=10, watcher_types=['port_stats', 'port_state'])
+        self.app.reload_config(None)
+        self.assertEqual(None, self.watcher('flow_table'))
+        self.assertFalse(old_flow_poller.running())
+        self.assertTrue(self.watcher('port_stats').running())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,13 +15,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ipaddress
 import sys
 import os
 import unittest
 import tempfile
 import shutil
+import time
+from collections import namedtuple
 from fakeoftable import FakeOFTable
 
+import yaml
+from prometheus_client import REGISTRY
+
 from ryu.ofproto import ofproto_v1_3 as ofp
 from ryu.lib.packet import ethernet, arp, vlan, ipv4, ipv6, packet
 
@@ -29,10 +35,26 @@ testdir = os.path.dirname(__file__)
 srcdir = '../'
 sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
 
+from faucet import faucet_metrics
+from faucet import valve_of
+from faucet import valve_packet
+from faucet import valve_ratelimit
+from faucet import valve_state
 from faucet.valve import valve_factory
 from faucet.config_parser import dp_parser
 
 
+FAUCET_METRICS = None
+
+
+def shared_faucet_metrics():
+    """Return FaucetMetrics shared by all tests (they can only be registered once)."""
+    global FAUCET_METRICS
+    if FAUCET_METRICS is None:
+        FAUCET_METRICS = faucet_metrics.FaucetMetrics(0, '127.0.0.1')
+    return FAUCET_METRICS
+
+
 def build_pkt(pkt):
     layers = []
     if 'arp_target_ip' in pkt:
@@ -103,6 +125,14 @@ vlans:
     UNKNOWN_MAC = '00:00:00:04:00:04'
     V100 = 0x100|ofp.OFPVID_PRESENT
     V200 = 0x200|ofp.OFPVID_PRESENT
+    # DP options to add to CONFIG.
+    DP_OPTIONS = {}
+
+    def config(self):
+        """Return CONFIG, with DP_OPTIONS added to the DP."""
+        config = yaml.safe_load(self.CONFIG)
+        config['dps']['s1'].update(self.DP_OPTIONS)
+        return yaml.dump(config)
 
     def update_config(self, config):
         with open(self.config_file, 'w') as f:
@@ -114,7 +144,7 @@ vlans:
         self.tmpdir = tempfile.mkdtemp()
         self.config_file = os.path.join(self.tmpdir, 'valve_unit.yaml')
         self.table = FakeOFTable(self.NUM_TABLES)
-        dp = self.update_config(self.CONFIG)
+        dp = self.update_config(self.config())
         self.valve = valve_factory(dp)(dp, 'test_valve')
 
         # establish connection to datapath
@@ -151,6 +181,24 @@ vlans:
             )
         self.table.apply_ofmsgs(rcv_packet_ofmsgs)
 
+    def learn(self, port, eth_src=None, vid=0x100):
+        """Receive a packet from a host on a tagged port, without applying any flows.
+
+        Returns:
+            list: OpenFlow messages sent in response.
+        """
+        if eth_src is None:
+            eth_src = self.UNKNOWN_MAC
+        return self.valve.rcv_packet(
+            self.DP_ID, {}, port, vid, build_pkt({
+                'eth_src': eth_src, 'eth_dst': self.P1_V100_MAC, 'vid': vid}))
+
+    def metric(self, name, **labels):
+        """Return the value of a Faucet metric for this DP, once updated."""
+        self.valve.update_metrics(shared_faucet_metrics())
+        labels['dpid'] = hex(self.DP_ID)
+        return REGISTRY.get_sample_value(name, labels)
+
     def tearDown(self):
         shutil.rmtree(self.tmpdir)
 
@@ -471,6 +519,41 @@ class ValveTestCase(ValveTestBase):
             self.table.is_output(match, port=2, vid=self.V100),
             msg="Packet not output after port add")
 
+    def test_rcv_packets_batch(self):
+        """Test a batch of packet ins is handled like individual packet ins."""
+        packet_ins = [
+            (1, 0x100, build_pkt({
+                'eth_src': self.UNKNOWN_MAC, 'eth_dst': self.P1_V100_MAC})),
+            (4, 0x200, build_pkt({
+                'eth_src': self.UNKNOWN_MAC, 'eth_dst': self.P2_V200_MAC,
+                'vid': 0x200})),
+            ]
+        ofmsgs = self.valve.rcv_packets(self.DP_ID, {}, packet_ins)
+        self.table.apply_ofmsgs(ofmsgs)
+        for in_port, vid, eth_dst in (
+                (1, 0, self.P1_V100_MAC), (4, self.V200, self.P2_V200_MAC)):
+            self.assertFalse(self.table.is_output(
+                {'in_port': in_port, 'vlan_vid': vid,
+                 'eth_src': self.UNKNOWN_MAC, 'eth_dst': eth_dst},
+                port=ofp.OFPP_CONTROLLER))
+        self.assertTrue(self.table.is_output(
+            {'in_port': 3, 'vlan_vid': self.V200, 'eth_src': self.P3_V200_MAC,
+             'eth_dst': self.UNKNOWN_MAC},
+            port=4, vid=self.V200))
+
+    def test_flood_pkt_multi_out(self):
+        """Test a controller packet is flooded with a single packet out."""
+        vlan = self.valve.dp.vlans[0x100]
+        ofmsgs = self.valve.flood_manager.build_flood_pkt(
+            vlan, valve_packet.arp_request, self.valve.FAUCET_MAC,
+            ipaddress.IPv4Address(u'10.0.0.254'),
+            ipaddress.IPv4Address(u'10.0.0.1'))
+        self.assertEqual(1, len(ofmsgs))
+        output_ports = [
+            action.port for action in ofmsgs[0].actions
+            if action.type == ofp.OFPAT_OUTPUT]
+        self.assertEqual([2, 3, 1], output_ports)
+
     def test_port_acl_deny(self):
         acl_config = '''
 version: 2
@@ -624,6 +707,539 @@ acls:
             msg='packet not allowed by acl'
             )
 
+    def test_port_acl_compress(self):
+        acl_config = '''
+version: 2
+dps:
+    s1:
+        ignore_learn_ins: 0
+        hardware: 'Open vSwitch'
+        dp_id: 1
+        compress_acls: True
+        interfaces:
+            p1:
+                number: 1
+                native_vlan: v100
+            p2:
+                number: 2
+                native_vlan: v200
+                tagged_vlans: [v100]
+                acl_in: allow_one_subnet
+            p3:
+                number: 3
+                tagged_vlans: [v100, v200]
+            p4:
+                number: 4
+                tagged_vlans: [v200]
+            p5:
+                number: 5
+vlans:
+    v100:
+        vid: 0x100
+    v200:
+        vid: 0x200
+acls:
+    allow_one_subnet:
+        - rule:
+            nw_dst: '192.0.2.0/25'
+            dl_type: 0x800
+            actions:
+                allow: 1
+        - rule:
+            nw_dst: '192.0.2.128/25'
+            dl_type: 0x800
+            actions:
+                allow: 1
+        - rule:
+            nw_dst: '192.0.2.1'
+            dl_type: 0x800
+            actions:
+                allow: 0
+        - rule:
+            dl_type: 0x800
+            actions:
+                allow: 0
+'''
+
+        drop_match = {
+            'in_port': 2,
+            'vlan_vid': 0,
+            'eth_type': 0x800,
+            'ipv4_dst': '198.51.100.1'
+            }
+        accept_match = {
+            'in_port': 2,
+            'vlan_vid': 0,
+            'eth_type': 0x800,
+            'ipv4_dst': '192.0.2.1'
+            }
+        new_dp = self.update_config(acl_config)
+        cold_start, ofmsgs = self.valve.reload_config(new_dp)
+        self.table.apply_ofmsgs(ofmsgs)
+        port_acl_flows = [
+            flowmod for flowmod in self.table.tables[new_dp.port_acl_table]
+            if 'eth_type' in flowmod.match_values]
+        self.assertEqual(2, len(port_acl_flows))
+        self.assertFalse(
+            self.table.is_output(drop_match),
+            msg='packet not blocked by acl'
+            )
+        self.assertTrue(
+            self.table.is_output(accept_match, port=3, vid=self.V200),
+            msg='packet not allowed by acl'
+            )
+
+
+class ValveACLMetadataTestCase(ValveTestBase):
+    CONFIG = """
+version: 2
+dps:
+    s1:
+        ignore_learn_ins: 0
+        hardware: 'Open vSwitch'
+        dp_id: 1
+        port_acl_metadata: True
+        interfaces:
+            p1:
+                number: 1
+                native_vlan: v100
+                acl_in: drop_non_ospf_ipv4
+            p2:
+                number: 2
+                native_vlan: v200
+                tagged_vlans: [v100]
+                acl_in: drop_non_ospf_ipv4
+            p3:
+                number: 3
+                tagged_vlans: [v100, v200]
+            p4:
+                number: 4
+                tagged_vlans: [v200]
+            p5:
+                number: 5
+vlans:
+    v100:
+        vid: 0x100
+    v200:
+        vid: 0x200
+acls:
+    drop_non_ospf_ipv4:
+        - rule:
+            nw_dst: '224.0.0.5'
+            dl_type: 0x800
+            actions:
+                allow: 1
+        - rule:
+            dl_type: 0x800
+            actions:
+                allow: 0
+"""
+    NUM_TABLES = 10
+
+    def test_port_acl_metadata(self):
+        """Test port ACL rules are shared between ports via metadata."""
+        rules_table = self.valve.dp.port_acl_rules_table
+        self.assertEqual(2, len([
+            flowmod for flowmod in self.table.tables[rules_table]
+            if 'metadata' in flowmod.match_values]))
+        for port in (1, 2):
+            drop_match = {
+                'in_port': port,
+                'vlan_vid': 0,
+                'eth_type': 0x800,
+                'ipv4_dst': '192.0.2.1'
+                }
+            accept_match = {
+                'in_port': port,
+                'vlan_vid': 0,
+                'eth_type': 0x800,
+                'ipv4_dst': '224.0.0.5'
+                }
+            self.assertFalse(
+                self.table.is_output(drop_match),
+                msg='packet not blocked by acl'
+                )
+            self.assertTrue(
+                self.table.is_output(accept_match, port=3),
+                msg='packet not allowed by acl'
+                )
+
+
+class ValvePendingLearnTestCase(ValveTestBase):
+
+    DP_OPTIONS = {'learn_hold_down': 0}
+
+    def test_pending_learn_suppressed(self):
+        """Test duplicate learns are suppressed until the barrier is acknowledged."""
+        ofmsgs = self.learn(2)
+        barriers = [
+            ofmsg for ofmsg in ofmsgs
+            if isinstance(ofmsg, valve_of.parser.OFPBarrierRequest)]
+        self.assertEqual(1, len(barriers))
+        self.assertEqual(barriers[0], ofmsgs[-1])
+        self.assertEqual([], self.learn(2))
+        self.assertEqual([], self.learn(2))
+        self.assertEqual(2, self.metric('vlan_learns_suppressed', vlan='256'))
+        # A move to another port is never suppressed.
+        self.assertTrue(self.learn(3))
+        self.assertEqual([], self.learn(3))
+        # Once the last barrier is acknowledged (which acknowledges earlier
+        # barriers too), the host can be relearned.
+        ofmsgs = self.learn(2)
+        self.assertTrue(ofmsgs)
+        self.assertEqual([], self.learn(2))
+        ofmsgs[-1].xid = 2
+        self.valve.barrier_reply(self.DP_ID, 2)
+        self.assertTrue(self.learn(2))
+
+
+class ValveMacFlapTestCase(ValveTestBase):
+
+    DP_OPTIONS = {'learn_hold_down': 0, 'mac_flap_threshold': 3}
+
+    @staticmethod
+    def _banned_ports(ofmsgs):
+        return set([
+            ofmsg.match['in_port'] for ofmsg in ofmsgs
+            if isinstance(ofmsg, valve_of.parser.OFPFlowMod) and
+            ofmsg.hard_timeout and not ofmsg.instructions])
+
+    def test_mac_flap_ban(self):
+        """Test learning is banned on ports a host flaps between."""
+        self.learn(2)
+        for port in (3, 2):
+            self.assertFalse(self._banned_ports(self.learn(port)))
+        self.assertEqual(set([2, 3]), self._banned_ports(self.learn(3)))
+        self.assertEqual(1, self.metric('vlan_mac_flaps', vlan='256'))
+
+
+class ValvePacketInLimitTestCase(ValveTestBase):
+
+    DP_OPTIONS = {'packetin_port_rate': 3, 'packetin_vlan_rate': 4}
+
+    def setUp(self):
+        super(ValvePacketInLimitTestCase, self).setUp()
+        # Start with full buckets, on a clock only the test advances.
+        self.now = 1000.0
+        self.valve.packet_in_limiter = valve_ratelimit.PacketInLimiter(
+            self.valve.dp.packetin_dp_rate, self.valve.dp.packetin_vlan_rate,
+            self.valve.dp.packetin_port_rate, clock=lambda: self.now)
+
+    def learn_new(self, port, i):
+        return self.learn(port, eth_src='00:00:00:05:00:%2.2x' % i)
+
+    def test_port_limit(self):
+        """Test a busy port is limited and banned, without starving other ports."""
+        for i in range(1, 4):
+            self.assertTrue(self.learn_new(2, i))
+        ofmsgs = self.learn_new(2, 4)
+        self.assertEqual(1, len(ofmsgs))
+        self.assertFalse(ofmsgs[0].instructions)
+        self.assertEqual(2, ofmsgs[0].match['in_port'])
+        self.assertEqual([], self.learn_new(2, 5))
+        self.assertEqual(2, self.metric('of_packet_ins_limited', level='port'))
+        self.assertTrue(self.learn_new(3, 6))
+        self.assertEqual([], self.learn_new(3, 7))
+        self.assertEqual(1, self.metric('of_packet_ins_limited', level='vlan'))
+
+    def test_refill(self):
+        """Test limited packet ins are accepted again as tokens are earned."""
+        for i in range(1, 4):
+            self.assertTrue(self.learn_new(3, i))
+        self.assertTrue(self.learn_new(2, 4))
+        self.assertEqual([], self.learn_new(2, 5))
+        self.assertEqual(1, self.metric('of_packet_ins_limited', level='vlan'))
+        # A quarter of a second earns the VLAN one token.
+        self.now += 0.25
+        self.assertTrue(self.learn_new(2, 6))
+        self.assertEqual([], self.learn_new(2, 7))
+        self.now += 1
+        for i in range(8, 11):
+            self.assertTrue(self.learn_new(3, i))
+        self.assertEqual(2, self.metric('of_packet_ins_limited', level='vlan'))
+        self.assertNotIn(
+            self.valve.packet_in_limiter.PORT, self.valve.packet_in_limiter.limited)
+
+
+class ValvePacketInMeterTestCase(ValveTestBase):
+
+    CONFIG = """
+version: 2
+dps:
+    s1:
+        ignore_learn_ins: 0
+        hardware: 'Open vSwitch'
+        dp_id: 1
+        packetin_control_plane_pps: 50
+        interfaces:
+            p1:
+                number: 1
+                native_vlan: v100
+            p2:
+                number: 2
+                native_vlan: v100
+vlans:
+    v100:
+        vid: 0x100
+        faucet_vips: ['10.0.0.254/24']
+"""
+
+    FakeMeterStats = namedtuple('FakeMeterStats', ('meter_id', 'band_stats'))
+    FakeMeterBandStats = namedtuple('FakeMeterBandStats', ('packet_band_count',))
+
+    @staticmethod
+    def _meter_ids(ofmsg):
+        return [
+            inst.meter_id for inst in ofmsg.instructions
+            if inst.type == ofp.OFPIT_METER]
+
+    def test_packetin_meters(self):
+        """Test packet ins are metered by type, and drops are recorded."""
+        ofmsgs = self.valve.datapath_connect(self.DP_ID, [1, 2])
+        meter_adds = [
+            ofmsg for ofmsg in ofmsgs
+            if isinstance(ofmsg, valve_of.parser.OFPMeterMod) and
+            ofmsg.command == ofp.OFPMC_ADD]
+        self.assertEqual(
+            [(valve_of.CONTROL_PLANE_METER_ID, 50)],
+            [(ofmsg.meter_id, ofmsg.bands[0].rate) for ofmsg in meter_adds])
+        metered = {}
+        for ofmsg in ofmsgs:
+            if isinstance(ofmsg, valve_of.parser.OFPFlowMod):
+                for meter_id in self._meter_ids(ofmsg):
+                    metered.setdefault(meter_id, set()).add(ofmsg.table_id)
+        self.assertEqual(
+            {valve_of.CONTROL_PLANE_METER_ID: set([self.valve.dp.vip_table])},
+            metered)
+        self.assertEqual(1, len(self.valve.meter_stats_request()))
+        self.valve.meter_stats_reply(self.DP_ID, [
+            self.FakeMeterStats(
+                valve_of.CONTROL_PLANE_METER_ID, [self.FakeMeterBandStats(5)]),
+            self.FakeMeterStats(99, [self.FakeMeterBandStats(1)])])
+        self.assertEqual(
+            5, self.metric('of_packet_ins_metered', type='control_plane'))
+        self.assertEqual(
+            None, self.metric('of_packet_ins_metered', type='route_miss'))
+
+    def test_forwarding_while_metered(self):
+        """Test exceeding a packet in meter does not stop forwarding."""
+        unknown_src = {
+            'in_port': 1,
+            'vlan_vid': 0,
+            'eth_src': self.UNKNOWN_MAC,
+            'eth_dst': self.P2_V200_MAC}
+        vip_arp = {
+            'in_port': 1,
+            'vlan_vid': 0,
+            'eth_type': 0x806,
+            'eth_src': self.P1_V100_MAC,
+            'eth_dst': self.valve.FAUCET_MAC,
+            'arp_tpa': '10.0.0.254'}
+        self.assertTrue(self.table.is_output(vip_arp, port=ofp.OFPP_CONTROLLER))
+        self.table.exceeded_meters = set([valve_of.CONTROL_PLANE_METER_ID])
+        self.assertFalse(self.table.is_output(vip_arp, port=ofp.OFPP_CONTROLLER))
+        # Packets from unlearned hosts are still learned and flooded.
+        self.assertTrue(
+            self.table.is_output(unknown_src, port=ofp.OFPP_CONTROLLER))
+        self.assertTrue(self.table.is_output(unknown_src, port=2, vid=0))
+
+class ValveWarmStartTestCase(ValveTestBase):
+
+    CONFIG = """
+version: 2
+dps:
+    s1:
+        ignore_learn_ins: 0
+        hardware: 'Open vSwitch'
+        dp_id: 1
+        interfaces:
+            p1:
+                number: 1
+                native_vlan: v100
+            p2:
+                number: 2
+                native_vlan: v200
+                tagged_vlans: [v100]
+            p3:
+                number: 3
+                tagged_vlans: [v100, v200]
+            p4:
+                number: 4
+                tagged_vlans: [v200]
+            p5:
+                number: 5
+vlans:
+    v100:
+        vid: 0x100
+        faucet_vips: ['10.0.0.254/24']
+    v200:
+        vid: 0x200
+"""
+
+    def test_warm_start(self):
+        """Test learned hosts and neighbors are reprovisioned after restart."""
+        self.rcv_packet(1, 0x100, {
+            'eth_src': self.P1_V100_MAC,
+            'eth_dst': self.UNKNOWN_MAC,
+            'ipv4_src': '10.0.0.1',
+            'ipv4_dst': '10.0.0.2'})
+        state_file = os.path.join(self.tmpdir, 'faucet_state.json')
+        valve_state.save_state(state_file, {self.DP_ID: self.valve})
+        self.assertEqual(
+            [], [name for name in os.listdir(self.tmpdir) if name.endswith('.tmp')])
+        logger = self.valve.logger
+
+        # Restart with an empty controller and switch.
+        self.table = FakeOFTable(self.NUM_TABLES)
+        dp = self.update_config(self.CONFIG)
+        self.valve = valve_factory(dp)(dp, 'test_valve')
+        state_by_dp_id = valve_state.load_state(state_file, logger)
+        self.valve.set_warm_state(state_by_dp_id[self.DP_ID])
+        ofmsgs = self.valve.datapath_connect(
+            self.DP_ID, range(1, self.NUM_PORTS + 1))
+        self.table.apply_ofmsgs(ofmsgs)
+
+        for match in (
+                {'in_port': 1, 'vlan_vid': 0, 'eth_src': self.P1_V100_MAC},
+                {'in_port': 2, 'vlan_vid': self.V200, 'eth_src': self.P2_V200_MAC},
+                {'in_port': 3, 'vlan_vid': self.V200, 'eth_src': self.P3_V200_MAC}):
+            self.assertFalse(
+                self.table.is_output(match, port=ofp.OFPP_CONTROLLER),
+                msg='host %s not restored' % match)
+        self.assertTrue(self.table.is_output(
+            {'in_port': 3, 'vlan_vid': self.V200, 'eth_src': self.P3_V200_MAC,
+             'eth_dst': self.P2_V200_MAC},
+            port=2))
+        self.assertIn(
+            ipaddress.ip_address(u'10.0.0.1'),
+            dp.vlans[0x100].neigh_cache_by_ipv(4))
+        self.assertTrue(self.table.is_output(
+            {'in_port': 3, 'vlan_vid': self.V100, 'eth_src': self.P3_V200_MAC,
+             'eth_dst': self.valve.FAUCET_MAC, 'eth_type': 0x800,
+             'ipv4_dst': '10.0.0.1'},
+            port=1))
+
+        # State is only restored once.
+        self.assertEqual([], self.valve._restore_warm_state())
+
+
+class ValveReconnectAuditTestCase(ValveTestBase):
+
+    CONFIG = """
+version: 2
+dps:
+    s1:
+        ignore_learn_ins: 0
+        hardware: 'Open vSwitch'
+        dp_id: 1
+        reconnect_audit: True
+        drop_bpdu: False
+        drop_lldp: False
+        interfaces:
+            p1:
+                number: 1
+                native_vlan: v100
+            p2:
+                number: 2
+                native_vlan: v200
+                tagged_vlans: [v100]
+            p3:
+                number: 3
+                tagged_vlans: [v100, v200]
+            p4:
+                number: 4
+                tagged_vlans: [v200]
+            p5:
+                number: 5
+vlans:
+    v100:
+        vid: 0x100
+    v200:
+        vid: 0x200
+"""
+
+    def audit(self):
+        """Reconnect the datapath and reply to the audit requests."""
+        ofmsgs = self.valve.datapath_reconnect(
+            self.DP_ID, range(1, self.NUM_PORTS + 1))
+        self.assertEqual(2, len(ofmsgs))
+        self.assertFalse([ofmsg for ofmsg in ofmsgs if valve_of.is_flowmod(ofmsg)])
+        self.assertEqual([], self.valve.group_desc_reply(self.DP_ID, [], False))
+        stats = self.table.flow_stats()
+        self.assertEqual(
+            [], self.valve.flow_stats_reply(self.DP_ID, stats[:1], True))
+        return self.valve.flow_stats_reply(self.DP_ID, stats[1:], False)
+
+    def test_reconnect_unchanged(self):
+        """Test no flows are sent when the datapath has the expected flows."""
+        self.assertEqual([], self.audit())
+
+    def assert_cold_start(self, ofmsgs):
+        """Assert ofmsgs cold start the datapath, with the audit abandoned."""
+        self.assertEqual(
+            ofp.OFPFC_DELETE, ofmsgs[0].command,
+            msg='cold start does not delete all flows')
+        self.table = FakeOFTable(self.NUM_TABLES)
+        self.table.apply_ofmsgs(ofmsgs)
+        self.assertTrue(self.table.is_output(
+            {'in_port': 1, 'vlan_vid': 0, 'eth_src': self.P1_V100_MAC},
+            port=ofp.OFPP_CONTROLLER))
+        stats = self.table.flow_stats()
+        self.assertEqual([], self.valve.flow_stats_reply(self.DP_ID, stats, False))
+        self.assertEqual([], self.valve.audit_expire(now=time.time() + 3600))
+
+    def test_reconnect_audit_timeout(self):
+        """Test the datapath is cold started if the audit replies never come."""
+        self.valve.datapath_reconnect(self.DP_ID, range(1, self.NUM_PORTS + 1))
+        self.assertEqual([], self.valve.audit_expire())
+        self.assertEqual([], self.valve.group_desc_reply(self.DP_ID, [], False))
+        self.assert_cold_start(self.valve.audit_expire(
+            now=time.time() + self.valve.dp.reconnect_audit_timeout + 1))
+
+    def test_reconnect_audit_error(self):
+        """Test the datapath is cold started if it rejects an audit request."""
+        self.valve.datapath_reconnect(self.DP_ID, range(1, self.NUM_PORTS + 1))
+        self.assert_cold_start(self.valve.ofp_error(self.DP_ID, None))
+        self.assertEqual([], self.valve.ofp_error(self.DP_ID, None))
+
+    def test_reconnect_audit(self):
+        """Test only differing flows are corrected, keeping learned hosts."""
+        vlan_table = self.table.tables[self.valve.dp.vlan_table]
+        missing_flow = self.table.flow_stats()[0]
+        vlan_table.pop(0)
+        unexpected_match = {'in_port': 5, 'vlan_vid': self.V100}
+        self.table.apply_ofmsgs([self.valve.valve_flowmod(
+            self.valve.dp.vlan_table,
+            match=self.valve.valve_in_match(
+                self.valve.dp.vlan_table, in_port=5, vlan=self.valve.dp.vlans[0x100]),
+            priority=self.valve.dp.highest_priority,
+            inst=[valve_of.apply_actions([valve_of.output_port(1)])])])
+        self.assertTrue(self.table.is_output(unexpected_match, port=1))
+
+        ofmsgs = self.audit()
+        self.assertEqual(1, len([
+            ofmsg for ofmsg in ofmsgs if valve_of.is_flowdel(ofmsg)]))
+        # The datapath must finish deleting before any flow is re-added.
+        barriers = [
+            i for i, ofmsg in enumerate(ofmsgs) if valve_of.is_barrier(ofmsg)]
+        self.assertEqual(1, len(barriers))
+        for i, ofmsg in enumerate(ofmsgs):
+            if valve_of.is_flowdel(ofmsg):
+                self.assertLess(i, barriers[0])
+            elif valve_of.is_flowmod(ofmsg):
+                self.assertGreater(i, barriers[0])
+        self.assertEqual(ofmsgs, self.valve.valve_flowreorder(ofmsgs))
+        self.table.apply_ofmsgs(ofmsgs)
+        self.assertFalse(self.table.is_output(unexpected_match, port=1))
+        self.assertIn(
+            valve_of.flow_key(missing_flow),
+            [valve_of.flow_key(flow) for flow in self.table.flow_stats()])
+        self.assertFalse(self.table.is_output(
+            {'in_port': 1, 'vlan_vid': 0, 'eth_src': self.P1_V100_MAC},
+            port=ofp.OFPP_CONTROLLER))
+        self.assertEqual([], self.audit())
+
+
 class ValveReloadConfigTestCase(ValveTestCase):
     '''Repeats the tests after a config reload'''
 
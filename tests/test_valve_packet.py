@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2015 Research and Innovation Advanced Network New Zealand Ltd.
+# Copyright (C) 2015--2017 The Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ipaddress
+import os
+import sys
+import time
+import unittest
+from collections import namedtuple
+
+from ryu.lib.packet import arp, ethernet, ipv4, packet, vlan
+
+testdir = os.path.dirname(__file__)
+srcdir = '../'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet import valve_packet
+
+
+class ValvePacketTestBase(unittest.TestCase):
+
+    FAUCET_MAC = '0e:00:00:00:00:01'
+    HOST_MAC = '0e:00:00:00:00:02'
+    VIDS = (None, 0x100)
+    IPV4_VIP = ipaddress.IPv4Address(u'10.0.0.254')
+    IPV4_GWS = [ipaddress.IPv4Address(u'10.0.0.%u' % i) for i in range(1, 65)]
+    IPV6_VIP = ipaddress.IPv6Address(u'fc00::1:254')
+    IPV6_LINK_VIP = ipaddress.IPv6Address(u'fe80::1')
+    IPV6_VIPS = [ipaddress.ip_interface(u'fc00::1:254/112')]
+    IPV6_GWS = [ipaddress.IPv6Address(u'fc00::1:%x' % i) for i in range(1, 65)]
+
+    def packet_builders(self, vid, i):
+        """Return (template builder, full builder, args) to compare."""
+        ipv4_gw = self.IPV4_GWS[i % len(self.IPV4_GWS)]
+        ipv6_gw = self.IPV6_GWS[i % len(self.IPV6_GWS)]
+        return (
+            (valve_packet.arp_request, valve_packet._arp_request_pkt,
+             (vid, self.FAUCET_MAC, self.IPV4_VIP, ipv4_gw)),
+            (valve_packet.nd_request, valve_packet._nd_request_pkt,
+             (vid, self.FAUCET_MAC, self.IPV6_VIP, ipv6_gw)),
+            (valve_packet.nd_advert, valve_packet._nd_advert_pkt,
+             (vid, self.FAUCET_MAC, self.HOST_MAC,
+              str(self.IPV6_VIP), ipv6_gw, 255)),
+            (valve_packet.router_advert, valve_packet._router_advert_pkt,
+             (vid, self.FAUCET_MAC, self.HOST_MAC,
+              self.IPV6_LINK_VIP, ipv6_gw, self.IPV6_VIPS)),
+        )
+
+
+class ValvePacketTemplateTestCase(ValvePacketTestBase):
+
+    def test_templates_match_serialized(self):
+        """Test packets from templates are identical to fully built packets."""
+        for vid in self.VIDS:
+            for i in range(len(self.IPV6_GWS)):
+                for template_builder, full_builder, args in self.packet_builders(vid, i):
+                    self.assertEqual(
+                        bytes(full_builder(*args).data),
+                        template_builder(*args).data,
+                        msg='%s differs for %s' % (
+                            template_builder.__name__, args))
+
+
+class ValvePacketTemplateBenchmarkTestCase(ValvePacketTestBase):
+
+    ITERATIONS = 1000
+
+    def _packets_per_sec(self, builder_index):
+        start_time = time.time()
+        for i in range(self.ITERATIONS):
+            for vid in self.VIDS:
+                builder_args = self.packet_builders(vid, i)
+                for builders in builder_args:
+                    builder = builders[builder_index]
+                    builder(*builders[2])
+        packets = self.ITERATIONS * len(self.VIDS) * len(builder_args)
+        return packets / (time.time() - start_time)
+
+    def test_packet_generation_rate(self):
+        """Test templates generate packets at least twice as fast as a full build."""
+        full_pps = self._packets_per_sec(1)
+        template_pps = self._packets_per_sec(0)
+        # Typically 6-8x, so a slow or busy host should not fail this.
+        self.assertGreater(
+            template_pps, 2 * full_pps,
+            msg='full build: %.0f pps, template: %.0f pps' % (
+                full_pps, template_pps))
+
+
+class ValvePacketInTestBase(unittest.TestCase):
+
+    FakePacketIn = namedtuple('FakePacketIn', ('data',))
+
+    def packet_in(self, eth_type=0x806, vid=0x100):
+        """Return a packet in message with a tagged ARP or IPv4 packet."""
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(
+            dst='ff:ff:ff:ff:ff:ff', src='0e:00:00:00:00:02',
+            ethertype=0x8100))
+        pkt.add_protocol(vlan.vlan(vid=vid, ethertype=eth_type))
+        if eth_type == 0x806:
+            pkt.add_protocol(arp.arp(
+                src_mac='0e:00:00:00:00:02', src_ip='10.0.0.1',
+                dst_ip='10.0.0.254'))
+        else:
+            pkt.add_protocol(ipv4.ipv4(src='10.0.0.1', dst='10.0.0.254'))
+        pkt.serialize()
+        return self.FakePacketIn(bytes(pkt.data))
+
+
+class ValvePacketInTestCase(ValvePacketInTestBase):
+
+    def test_parse_packet_in_header(self):
+        """Test Ethernet/VLAN header is decoded without a full parse."""
+        pkt, vlan_vid = valve_packet.parse_packet_in_pkt(
+            self.packet_in(eth_type=0x800, vid=0x200))
+        self.assertEqual(0x200, vlan_vid)
+        eth_pkt = valve_packet.parse_pkt(pkt)
+        self.assertEqual('0e:00:00:00:00:02', eth_pkt.src)
+        self.assertEqual('ff:ff:ff:ff:ff:ff', eth_pkt.dst)
+        self.assertEqual(0x800, valve_packet.parse_eth_type(pkt))
+        self.assertIsNone(pkt._pkt)
+
+    def test_parse_packet_in_lazy(self):
+        """Test higher layers are parsed on demand."""
+        pkt, _ = valve_packet.parse_packet_in_pkt(self.packet_in())
+        arp_pkt = pkt.get_protocol(arp.arp)
+        self.assertEqual('10.0.0.254', arp_pkt.dst_ip)
+        self.assertIsNone(pkt.get_protocol(ipv4.ipv4))
+
+    def test_parse_packet_in_short(self):
+        """Test truncated packets are ignored."""
+        data = self.packet_in().data
+        for length in (0, 13, 16):
+            pkt, vlan_vid = valve_packet.parse_packet_in_pkt(
+                self.FakePacketIn(data[:length]))
+            self.assertIsNone(pkt)
+            self.assertIsNone(vlan_vid)
+
+
+class ValvePacketInBenchmarkTestCase(ValvePacketInTestBase):
+
+    ITERATIONS = 10000
+
+    @staticmethod
+    def _full_parse(msg):
+        """The previous packet in parser (full parse of every layer)."""
+        pkt = packet.Packet(msg.data)
+        eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
+        vlan_vid = pkt.get_protocols(vlan.vlan)[0].vid
+        return eth_pkt.src, eth_pkt.dst, vlan_vid
+
+    @staticmethod
+    def _lazy_parse(msg):
+        pkt, vlan_vid = valve_packet.parse_packet_in_pkt(msg)
+        eth_pkt = valve_packet.parse_pkt(pkt)
+        return eth_pkt.src, eth_pkt.dst, vlan_vid
+
+    def _packets_per_sec(self, parser, msg):
+        start_time = time.time()
+        for _ in range(self.ITERATIONS):
+            parser(msg)
+        return self.ITERATIONS / (time.time() - start_time)
+
+    def test_packet_in_parse_rate(self):
+        """Test header only parsing is at least twice as fast as a full parse."""
+        for eth_type in (0x806, 0x800):
+            msg = self.packet_in(eth_type=eth_type)
+            self.assertEqual(self._full_parse(msg), self._lazy_parse(msg))
+            full_pps = self._packets_per_sec(self._full_parse, msg)
+            lazy_pps = self._packets_per_sec(self._lazy_parse, msg)
+            # Typically 5-8x, so a slow or busy host should not fail this.
+            self.assertGreater(
+                lazy_pps, 2 * full_pps,
+                msg='0x%x full parse: %.0f pps, header only: %.0f pps' % (
+                    eth_type, full_pps, lazy_pps))
+
+
+if __name__ == "__main__":
+    unittest.main()